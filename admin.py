@@ -1,35 +1,70 @@
 import os
+import asyncio
 import logging
-from aiogram import Router, Bot, F, Dispatcher
+import sqlite3
+from datetime import datetime
+from aiogram import Router, Bot, F, Dispatcher, html
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, FSInputFile
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
 from db_manager import (
-    add_survey,
     survey_exists,
-    add_question,
-    get_all_surveys,
-    get_survey_id_by_name,
+    unit_of_work,
+    insert_survey,
+    get_surveys_page,
     get_survey_name_by_id,
     delete_survey_by_id,
     get_all_groups,
+    publish_survey_version,
     update_survey_name,
-    get_questions_by_survey,
+    get_questions_page,
     update_question_text,
     delete_question_by_id,
     add_question_to_survey,
+    get_latest_version_id,
+    get_survey_version,
+    get_choice_tallies,
+    is_live_results_enabled,
+    set_live_results_enabled,
+    cancel_jobs,
 )
+from callbacks import (
+    AdminMenuCallback,
+    MenuAction,
+    SurveyCallback,
+    SurveyAction,
+    QuestionCallback,
+    SurveyPageCallback,
+    QuestionPageCallback,
+    PageOp,
+    JobCallback,
+)
+from choices import parse_question_spec, render_tallies, QUESTION_FORMAT_HINT
+from announce import announce_survey
+from scheduler import schedule_publication, upcoming_publications
+from survey_import import import_document, IMPORT_FORMAT_HINT
+import metrics
+from outbound import outbound_priority, BROADCAST
+from api_session import UPLOAD_LIMIT
+from data_manager import export_survey_results
+from facets import parse_facet_filters, facet_report_text
 from dotenv import load_dotenv
 
 load_dotenv()
 ADMIN_IDS = [int(admin_id) for admin_id in os.getenv('ADMIN_IDS').split(',')]
+# Сколько опросов или вопросов показывать на одной странице клавиатуры
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '10'))
 
 class SurveyCreation(StatesGroup):
     waiting_for_survey_name = State()
     waiting_for_questions = State()
 
+class SurveyImport(StatesGroup):
+    waiting_for_file = State()
+
 class SendResultsState(StatesGroup):
     waiting_for_survey_selection = State()
 
@@ -41,6 +76,10 @@ class SurveyEdit(StatesGroup):
     editing_question = State()
     adding_question = State()
     deleting_question = State()
+    scheduling_publication = State()
+
+class PickerSearch(StatesGroup):
+    waiting_for_prefix = State()
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
@@ -54,154 +93,417 @@ async def admin_panel(message: Message, state: FSMContext):
         return
 
     keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="Создать опрос", callback_data="create_survey")
-    keyboard.button(text="Редактировать опрос", callback_data="edit_survey")
-    keyboard.button(text="Просмотреть список опросов", callback_data="view_surveys")
-    keyboard.button(text="Удалить опрос", callback_data="delete_survey")
-    keyboard.button(text="Отправить результаты", callback_data="send_results")
-    keyboard.button(text="Повторно отправить опрос", callback_data="resend_survey")
+    keyboard.button(text="Создать опрос", callback_data=AdminMenuCallback(action=MenuAction.create_survey))
+    keyboard.button(text="Редактировать опрос", callback_data=AdminMenuCallback(action=MenuAction.edit_survey))
+    keyboard.button(text="Просмотреть список опросов", callback_data=AdminMenuCallback(action=MenuAction.view_surveys))
+    keyboard.button(text="Удалить опрос", callback_data=AdminMenuCallback(action=MenuAction.delete_survey))
+    keyboard.button(text="Отправить результаты", callback_data=AdminMenuCallback(action=MenuAction.send_results))
+    keyboard.button(text="Повторно отправить опрос", callback_data=AdminMenuCallback(action=MenuAction.resend_survey))
+    keyboard.button(text="Итоги голосований", callback_data=AdminMenuCallback(action=MenuAction.view_tallies))
+    keyboard.button(text="Запланированные отправки", callback_data=AdminMenuCallback(action=MenuAction.view_schedule))
+    keyboard.button(text="Импортировать опросы из файла", callback_data=AdminMenuCallback(action=MenuAction.import_surveys))
     keyboard.adjust(1)
 
     # Отправляем начальное сообщение и сохраняем его message_id в состоянии
     sent_message = await message.answer("Выберите действие:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
     await state.update_data(menu_message_id=sent_message.message_id)
 
-@router.callback_query()
-async def admin_callback_handler(call: CallbackQuery, state: FSMContext, bot: Bot):
-    if not is_admin(call.from_user.id):
-        await call.answer("У вас нет прав доступа.", show_alert=True)
+@router.message(Command('stats'), F.chat.type == "private")
+async def stats_handler(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав доступа к административным функциям.", parse_mode='HTML')
+        return
+    await message.answer(html.quote(metrics.render_text()), parse_mode='HTML')
+
+FACETS_USAGE = (
+    "Использование: /facets [role=&lt;роль&gt;] [region=&lt;регион&gt;] [group=&lt;id группы&gt;]\n"
+    "Без параметров — число участников по ролям, регионам и группам."
+)
+
+@router.message(Command('facets'), F.chat.type == "private")
+async def facets_handler(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав доступа к административным функциям.", parse_mode='HTML')
+        return
+    try:
+        filters, group_id = parse_facet_filters(command.args)
+    except ValueError:
+        await message.answer(FACETS_USAGE, parse_mode='HTML')
         return
+    # Отбор идет по индексированным колонкам анкеты, а не по выгрузке ответов
+    text = await asyncio.to_thread(facet_report_text, filters, group_id)
+    await message.answer(text, parse_mode='HTML')
+
+# Колбэки администратора отсекаются здесь для всех остальных пользователей,
+# поэтому обработчики ниже не проверяют права повторно
+@router.callback_query(
+    or_f(
+        AdminMenuCallback.filter(),
+        SurveyCallback.filter(),
+        QuestionCallback.filter(),
+        SurveyPageCallback.filter(),
+        QuestionPageCallback.filter(),
+        JobCallback.filter(),
+    ),
+    ~F.from_user.id.in_(ADMIN_IDS),
+)
+async def admin_callback_denied(call: CallbackQuery):
+    await call.answer("У вас нет прав доступа.", show_alert=True)
+
+SURVEY_PICKER_TITLES = {
+    SurveyAction.edit: "Выберите опрос для редактирования:",
+    SurveyAction.delete: "Выберите опрос для удаления:",
+    SurveyAction.send_results: "Выберите опрос для отправки результатов:",
+    SurveyAction.resend: "Выберите опрос для повторной отправки:",
+    SurveyAction.view: "Список опросов:",
+    SurveyAction.tallies: "Выберите опрос для просмотра итогов:",
+}
+
+def page_buttons(rows, has_prev, has_next, make_callback):
+    # Кнопки листания ссылаются на первый и последний id текущей страницы
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=make_callback(before_id=rows[0][0]).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Далее ▶️", callback_data=make_callback(after_id=rows[-1][0]).pack()))
+    return buttons
 
-    data = call.data
+def survey_picker(action: SurveyAction, prefix=None, after_id=0, before_id=0):
+    rows, has_prev, has_next = get_surveys_page(after_id, before_id, prefix, ADMIN_PAGE_SIZE)
+    if not rows and (after_id or before_id):
+        # Страница опустела (опросы удалили) — возвращаемся к началу списка
+        rows, has_prev, has_next = get_surveys_page(prefix=prefix, limit=ADMIN_PAGE_SIZE)
+    if not rows and not prefix:
+        return "Опросы не найдены.", None
+
+    keyboard = InlineKeyboardBuilder()
+    if not rows:
+        text = f"Опросы, название которых начинается с «{html.quote(prefix)}», не найдены."
+    elif action == SurveyAction.view:
+        text = SURVEY_PICKER_TITLES[action] + "\n" + "\n".join(f"• {html.quote(name)}" for survey_id, name in rows)
+    else:
+        text = SURVEY_PICKER_TITLES[action]
+        for survey_id, name in rows:
+            keyboard.button(text=name, callback_data=SurveyCallback(action=action, survey_id=survey_id))
+    if prefix and rows:
+        text += f"\nФильтр: «{html.quote(prefix)}»"
+    keyboard.adjust(1)
+
+    navigation = page_buttons(rows, has_prev, has_next, lambda **bounds: SurveyPageCallback(action=action, **bounds))
+    if navigation:
+        keyboard.row(*navigation)
+    keyboard.row(InlineKeyboardButton(
+        text="🔍 Поиск по названию",
+        callback_data=SurveyPageCallback(action=action, op=PageOp.search).pack(),
+    ))
+    if prefix:
+        keyboard.row(InlineKeyboardButton(
+            text="Сбросить фильтр",
+            callback_data=SurveyPageCallback(action=action, op=PageOp.reset).pack(),
+        ))
+    return text, keyboard.as_markup()
+
+async def show_survey_picker(call: CallbackQuery, state: FSMContext, action: SurveyAction):
+    # Вход в список из меню всегда начинается с первой страницы без фильтра
+    await state.update_data(picker_prefix=None)
+    text, markup = survey_picker(action)
+    await call.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    await call.answer()
+    return markup is not None
+
+@router.callback_query(SurveyPageCallback.filter(F.op == PageOp.page))
+async def survey_page_callback(call: CallbackQuery, callback_data: SurveyPageCallback, state: FSMContext):
     data_state = await state.get_data()
-    menu_message_id = data_state.get('menu_message_id')
-
-    if data == "create_survey":
-        await call.message.edit_text("Введите название опроса.", parse_mode='HTML')
-        await state.set_state(SurveyCreation.waiting_for_survey_name)
-    elif data == "edit_survey":
-        surveys = get_all_surveys()
-        if not surveys:
-            await call.message.edit_text("Опросы не найдены.", parse_mode='HTML')
-            return
-        keyboard = InlineKeyboardBuilder()
-        for survey in surveys:
-            survey_id = get_survey_id_by_name(survey)
-            keyboard.button(text=survey, callback_data=f"edit_{survey_id}")
-        keyboard.adjust(1)
-        await call.message.edit_text("Выберите опрос для редактирования:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
+    text, markup = survey_picker(
+        callback_data.action, data_state.get('picker_prefix'), callback_data.after_id, callback_data.before_id
+    )
+    await call.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(SurveyPageCallback.filter(F.op == PageOp.search))
+async def survey_search_callback(call: CallbackQuery, callback_data: SurveyPageCallback, state: FSMContext):
+    await state.update_data(picker_action=callback_data.action.value)
+    await call.message.edit_text("Введите начало названия опроса.", parse_mode='HTML')
+    await state.set_state(PickerSearch.waiting_for_prefix)
+    await call.answer()
+
+@router.callback_query(SurveyPageCallback.filter(F.op == PageOp.reset))
+async def survey_reset_filter_callback(call: CallbackQuery, callback_data: SurveyPageCallback, state: FSMContext):
+    await state.update_data(picker_prefix=None)
+    text, markup = survey_picker(callback_data.action)
+    await call.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    await call.answer()
+
+@router.message(PickerSearch.waiting_for_prefix, F.chat.type == "private", F.text)
+async def survey_search_prefix_handler(message: Message, state: FSMContext):
+    prefix = message.text.strip()
+    data_state = await state.get_data()
+    action = SurveyAction(data_state.get('picker_action', SurveyAction.view.value))
+    await state.update_data(picker_prefix=prefix)
+    await state.set_state(None)
+    text, markup = survey_picker(action, prefix)
+    await message.answer(text, reply_markup=markup, parse_mode='HTML')
+
+def question_picker(survey_id, after_id=0, before_id=0):
+    rows, has_prev, has_next = get_questions_page(survey_id, after_id, before_id, ADMIN_PAGE_SIZE)
+    if not rows and (after_id or before_id):
+        rows, has_prev, has_next = get_questions_page(survey_id, limit=ADMIN_PAGE_SIZE)
+    if not rows:
+        return None
+    keyboard = InlineKeyboardBuilder()
+    for question_id, question_text in rows:
+        keyboard.button(text=question_text, callback_data=QuestionCallback(question_id=question_id))
+    keyboard.adjust(1)
+    navigation = page_buttons(
+        rows, has_prev, has_next, lambda **bounds: QuestionPageCallback(survey_id=survey_id, **bounds)
+    )
+    if navigation:
+        keyboard.row(*navigation)
+    return keyboard.as_markup()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.create_survey))
+async def create_survey_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text("Введите название опроса.", parse_mode='HTML')
+    await state.set_state(SurveyCreation.waiting_for_survey_name)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.import_surveys))
+async def import_surveys_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text(
+        f"Отправьте файл .json или .csv с описанием опросов.\n\n{html.quote(IMPORT_FORMAT_HINT)}",
+        parse_mode='HTML'
+    )
+    await state.set_state(SurveyImport.waiting_for_file)
+    await call.answer()
+
+@router.message(SurveyImport.waiting_for_file, F.chat.type == "private", F.document)
+async def import_surveys_file_handler(message: Message, state: FSMContext, bot: Bot):
+    try:
+        surveys = await import_document(bot, message.document)
+    except ValueError as e:
+        await message.answer(f"Файл не импортирован: {html.quote(str(e))}", parse_mode='HTML')
+        return
+    summary = "\n".join(f"• {html.quote(name)} — вопросов: {len(questions)}" for name, questions in surveys)
+    await message.answer(f"Импортировано опросов: {len(surveys)}\n{summary}", parse_mode='HTML')
+    await state.clear()
+
+@router.message(SurveyImport.waiting_for_file, F.chat.type == "private")
+async def import_surveys_no_file_handler(message: Message):
+    await message.answer("Отправьте файл .json или .csv.", parse_mode='HTML')
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.edit_survey))
+async def edit_survey_callback(call: CallbackQuery, state: FSMContext):
+    if await show_survey_picker(call, state, SurveyAction.edit):
         await state.set_state(SurveyEdit.choosing_survey)
-    elif data.startswith("edit_") and data.replace("edit_", "").isdigit():
-        survey_id = int(data.replace("edit_", ""))
-        survey_name = get_survey_name_by_id(survey_id)
-        await state.update_data(survey_id=survey_id, survey_name=survey_name)
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="Переименовать опрос", callback_data="rename_survey")
-        keyboard.button(text="Редактировать вопросы", callback_data="edit_questions")
-        keyboard.adjust(1)
-        await call.message.edit_text(f"Вы выбрали опрос '{survey_name}'. Что вы хотите сделать?", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-        await state.set_state(SurveyEdit.choosing_edit_action)
-    elif data == "rename_survey":
-        await call.message.edit_text("Введите новое название опроса.", parse_mode='HTML')
-        await state.set_state(SurveyEdit.renaming_survey)
-    elif data == "edit_questions":
-        data_state = await state.get_data()
-        survey_id = data_state.get('survey_id')
-        questions = get_questions_by_survey(survey_id, include_ids=True)
-        if not questions:
-            await call.message.edit_text("В этом опросе нет вопросов.", parse_mode='HTML')
-        else:
-            keyboard = InlineKeyboardBuilder()
-            for question_id, question_text in questions:
-                keyboard.button(text=question_text, callback_data=f"edit_question_{question_id}")
-            keyboard.adjust(1)
-            await call.message.edit_text("Выберите вопрос для редактирования или удаления:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="Добавить новый вопрос", callback_data="add_question")
-        keyboard.adjust(1)
-        await call.message.answer("Вы можете добавить новый вопрос:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-        await state.set_state(SurveyEdit.choosing_question_to_edit)
-    elif data.startswith("edit_question_"):
-        question_id = int(data.replace("edit_question_", ""))
-        await state.update_data(question_id=question_id)
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="Изменить текст вопроса", callback_data="modify_question")
-        keyboard.button(text="Удалить вопрос", callback_data="delete_question")
-        keyboard.adjust(1)
-        await call.message.edit_text("Что вы хотите сделать с этим вопросом?", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-    elif data == "modify_question":
-        await call.message.edit_text("Введите новый текст вопроса.", parse_mode='HTML')
-        await state.set_state(SurveyEdit.editing_question)
-    elif data == "delete_question":
-        data_state = await state.get_data()
-        question_id = data_state.get('question_id')
-        delete_question_by_id(question_id)
-        await call.message.edit_text("Вопрос удален.", parse_mode='HTML')
-        await state.update_data(question_id=None)
-    elif data == "add_question":
-        await call.message.edit_text("Введите текст нового вопроса.", parse_mode='HTML')
-        await state.set_state(SurveyEdit.adding_question)
-    elif data == "delete_survey":
-        surveys = get_all_surveys()
-        if not surveys:
-            await call.message.edit_text("Опросы не найдены.", parse_mode='HTML')
-            return
-        keyboard = InlineKeyboardBuilder()
-        for survey in surveys:
-            survey_id = get_survey_id_by_name(survey)
-            keyboard.button(text=survey, callback_data=f"delete_{survey_id}")
-        keyboard.adjust(1)
-        await call.message.edit_text("Выберите опрос для удаления:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-    elif data.startswith("delete_") and data.replace("delete_", "").isdigit():
-        survey_id = int(data.replace("delete_", ""))
-        survey_name = get_survey_name_by_id(survey_id)
-        delete_survey_by_id(survey_id)
-        await call.message.edit_text(f"Опрос '{survey_name}' был удален.", parse_mode='HTML')
-    elif data == "send_results":
-        surveys = get_all_surveys()
-        if not surveys:
-            await call.message.edit_text("Опросы не найдены.", parse_mode='HTML')
-            return
-        keyboard = InlineKeyboardBuilder()
-        for survey in surveys:
-            survey_id = get_survey_id_by_name(survey)
-            keyboard.button(text=survey, callback_data=f"send_results_{survey_id}")
-        keyboard.adjust(1)
-        await call.message.edit_text("Выберите опрос для отправки результатов:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-        await state.set_state(SendResultsState.waiting_for_survey_selection)
-    elif data.startswith("send_results_") and data.replace("send_results_", "").isdigit():
-        survey_id = int(data.replace("send_results_", ""))
-        survey_name = get_survey_name_by_id(survey_id)
-        filename = f"data/survey_results_{survey_name.replace(' ', '_').replace('/', '_')}.xlsx"
-
-        if not os.path.exists(filename):
-            await call.message.edit_text(f"Результаты для опроса '{survey_name}' не найдены.", parse_mode='HTML')
-            return
-
-        file = FSInputFile(filename)
-        await call.message.answer_document(file, caption=f"Результаты опроса: {survey_name}", parse_mode='HTML')
-    elif data == "resend_survey":
-        surveys = get_all_surveys()
-        if not surveys:
-            await call.message.edit_text("Опросы не найдены.", parse_mode='HTML')
-            return
-        keyboard = InlineKeyboardBuilder()
-        for survey in surveys:
-            survey_id = get_survey_id_by_name(survey)
-            keyboard.button(text=survey, callback_data=f"resend_{survey_id}")
-        keyboard.adjust(1)
-        await call.message.edit_text("Выберите опрос для повторной отправки:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
-    elif data.startswith("resend_") and data.replace("resend_", "").isdigit():
-        survey_id = int(data.replace("resend_", ""))
-        survey_name = get_survey_name_by_id(survey_id)
-        await resend_survey(call, survey_id, survey_name, bot)
-    elif data.startswith("publish_") and data.replace("publish_", "").isdigit():
-        survey_id = int(data.replace("publish_", ""))
-        survey_name = get_survey_name_by_id(survey_id)
-        await resend_survey(call, survey_id, survey_name, bot)
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.view_surveys))
+async def view_surveys_callback(call: CallbackQuery, state: FSMContext):
+    await show_survey_picker(call, state, SurveyAction.view)
+
+@router.callback_query(SurveyCallback.filter(F.action == SurveyAction.edit))
+async def edit_selected_survey_callback(call: CallbackQuery, callback_data: SurveyCallback, state: FSMContext):
+    survey_id = callback_data.survey_id
+    survey_name = get_survey_name_by_id(survey_id)
+    await state.update_data(survey_id=survey_id, survey_name=survey_name)
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Переименовать опрос", callback_data=AdminMenuCallback(action=MenuAction.rename_survey))
+    keyboard.button(text="Редактировать вопросы", callback_data=AdminMenuCallback(action=MenuAction.edit_questions))
+    live_label = "Выключить живые итоги" if is_live_results_enabled(survey_id) else "Включить живые итоги"
+    keyboard.button(text=live_label, callback_data=AdminMenuCallback(action=MenuAction.toggle_live_results))
+    keyboard.button(text="Запланировать отправку", callback_data=AdminMenuCallback(action=MenuAction.schedule_publication))
+    keyboard.adjust(1)
+    await call.message.edit_text(f"Вы выбрали опрос '{survey_name}'. Что вы хотите сделать?", reply_markup=keyboard.as_markup(), parse_mode='HTML')
+    await state.set_state(SurveyEdit.choosing_edit_action)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.rename_survey))
+async def rename_survey_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text("Введите новое название опроса.", parse_mode='HTML')
+    await state.set_state(SurveyEdit.renaming_survey)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.toggle_live_results))
+async def toggle_live_results_callback(call: CallbackQuery, state: FSMContext):
+    data_state = await state.get_data()
+    survey_id = data_state.get('survey_id')
+    enabled = not is_live_results_enabled(survey_id)
+    set_live_results_enabled(survey_id, enabled)
+    if enabled:
+        text = "Живые итоги включены. Сообщение с итогами появится в группах при следующей отправке опроса."
     else:
-        await call.message.edit_text("Неизвестная команда.", parse_mode='HTML')
+        text = "Живые итоги выключены."
+    await call.message.edit_text(text, parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.schedule_publication))
+async def schedule_publication_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text("Введите дату и время отправки в формате ДД.ММ.ГГГГ ЧЧ:ММ.", parse_mode='HTML')
+    await state.set_state(SurveyEdit.scheduling_publication)
+    await call.answer()
+
+def schedule_markup_and_text():
+    publications = upcoming_publications()
+    if not publications:
+        return "Запланированных отправок нет.", None
+    keyboard = InlineKeyboardBuilder()
+    lines = []
+    for job_id, run_at, survey_id, survey_name in publications:
+        when = datetime.fromtimestamp(run_at).strftime("%d.%m.%Y %H:%M")
+        lines.append(f"• {when} — {html.quote(survey_name or str(survey_id))}")
+        keyboard.button(text=f"Отменить: {when} {survey_name}", callback_data=JobCallback(job_id=job_id))
+    keyboard.adjust(1)
+    return "Запланированные отправки:\n" + "\n".join(lines), keyboard.as_markup()
 
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.view_schedule))
+async def view_schedule_callback(call: CallbackQuery):
+    text, markup = schedule_markup_and_text()
+    await call.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(JobCallback.filter())
+async def cancel_job_callback(call: CallbackQuery, callback_data: JobCallback):
+    cancelled = cancel_jobs(job_id=callback_data.job_id)
+    text, markup = schedule_markup_and_text()
+    await call.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    await call.answer("Отправка отменена." if cancelled else "Отправка уже выполнена или отменена.")
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.edit_questions))
+async def edit_questions_callback(call: CallbackQuery, state: FSMContext):
+    data_state = await state.get_data()
+    survey_id = data_state.get('survey_id')
+    markup = question_picker(survey_id)
+    if markup is None:
+        await call.message.edit_text("В этом опросе нет вопросов.", parse_mode='HTML')
+    else:
+        await call.message.edit_text("Выберите вопрос для редактирования или удаления:", reply_markup=markup, parse_mode='HTML')
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Добавить новый вопрос", callback_data=AdminMenuCallback(action=MenuAction.add_question))
+    keyboard.adjust(1)
+    await call.message.answer("Вы можете добавить новый вопрос:", reply_markup=keyboard.as_markup(), parse_mode='HTML')
+    await state.set_state(SurveyEdit.choosing_question_to_edit)
+    await call.answer()
+
+@router.callback_query(QuestionPageCallback.filter())
+async def question_page_callback(call: CallbackQuery, callback_data: QuestionPageCallback):
+    markup = question_picker(callback_data.survey_id, callback_data.after_id, callback_data.before_id)
+    if markup is None:
+        await call.message.edit_text("В этом опросе нет вопросов.", parse_mode='HTML')
+    else:
+        await call.message.edit_reply_markup(reply_markup=markup)
+    await call.answer()
+
+@router.callback_query(QuestionCallback.filter())
+async def edit_selected_question_callback(call: CallbackQuery, callback_data: QuestionCallback, state: FSMContext):
+    await state.update_data(question_id=callback_data.question_id)
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Изменить текст вопроса", callback_data=AdminMenuCallback(action=MenuAction.modify_question))
+    keyboard.button(text="Удалить вопрос", callback_data=AdminMenuCallback(action=MenuAction.delete_question))
+    keyboard.adjust(1)
+    await call.message.edit_text("Что вы хотите сделать с этим вопросом?", reply_markup=keyboard.as_markup(), parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.modify_question))
+async def modify_question_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text(f"Введите новый текст вопроса.\n\n{html.quote(QUESTION_FORMAT_HINT)}", parse_mode='HTML')
+    await state.set_state(SurveyEdit.editing_question)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.delete_question))
+async def delete_question_callback(call: CallbackQuery, state: FSMContext):
+    data_state = await state.get_data()
+    question_id = data_state.get('question_id')
+    delete_question_by_id(question_id)
+    await call.message.edit_text("Вопрос удален.", parse_mode='HTML')
+    await state.update_data(question_id=None)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.add_question))
+async def add_question_callback(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text(f"Введите текст нового вопроса.\n\n{html.quote(QUESTION_FORMAT_HINT)}", parse_mode='HTML')
+    await state.set_state(SurveyEdit.adding_question)
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.delete_survey))
+async def delete_survey_callback(call: CallbackQuery, state: FSMContext):
+    await show_survey_picker(call, state, SurveyAction.delete)
+
+@router.callback_query(SurveyCallback.filter(F.action == SurveyAction.delete))
+async def delete_selected_survey_callback(call: CallbackQuery, callback_data: SurveyCallback):
+    survey_id = callback_data.survey_id
+    survey_name = get_survey_name_by_id(survey_id)
+    delete_survey_by_id(survey_id)
+    await call.message.edit_text(f"Опрос '{survey_name}' был удален.", parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.send_results))
+async def send_results_callback(call: CallbackQuery, state: FSMContext):
+    if await show_survey_picker(call, state, SurveyAction.send_results):
+        await state.set_state(SendResultsState.waiting_for_survey_selection)
+
+@router.callback_query(SurveyCallback.filter(F.action == SurveyAction.send_results))
+async def send_selected_results_callback(call: CallbackQuery, callback_data: SurveyCallback):
+    survey_id = callback_data.survey_id
+    survey_name = get_survey_name_by_id(survey_id)
+    # Сборка книги Excel из базы выполняется вне цикла событий
+    filename = await asyncio.to_thread(export_survey_results, survey_id, survey_name)
+
+    if filename is None:
+        await call.message.edit_text(f"Результаты для опроса '{survey_name}' не найдены.", parse_mode='HTML')
+        await call.answer()
+        return
+
+    size = os.path.getsize(filename)
+    if size > UPLOAD_LIMIT:
+        # Облачный Bot API принимает файлы до 50 МБ, собственный сервер в режиме --local — до 2000 МБ
+        await call.message.edit_text(
+            f"Файл результатов опроса '{survey_name}' слишком большой для отправки ({size // (1024 * 1024)} МБ). "
+            f"Подключите собственный сервер Bot API (TELEGRAM_API_SERVER, TELEGRAM_API_LOCAL).",
+            parse_mode='HTML'
+        )
+        await call.answer()
+        return
+
+    file = FSInputFile(filename)
+    await call.message.answer_document(file, caption=f"Результаты опроса: {survey_name}", parse_mode='HTML')
+    await call.answer()
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.resend_survey))
+async def resend_survey_callback(call: CallbackQuery, state: FSMContext):
+    await show_survey_picker(call, state, SurveyAction.resend)
+
+@router.callback_query(SurveyCallback.filter(F.action.in_({SurveyAction.resend, SurveyAction.publish})))
+async def resend_selected_survey_callback(call: CallbackQuery, callback_data: SurveyCallback, bot: Bot):
+    survey_id = callback_data.survey_id
+    survey_name = get_survey_name_by_id(survey_id)
+    await resend_survey(call, survey_id, survey_name, bot)
+
+@router.callback_query(AdminMenuCallback.filter(F.action == MenuAction.view_tallies))
+async def view_tallies_callback(call: CallbackQuery, state: FSMContext):
+    await show_survey_picker(call, state, SurveyAction.tallies)
+
+@router.callback_query(SurveyCallback.filter(F.action == SurveyAction.tallies))
+async def survey_tallies_callback(call: CallbackQuery, callback_data: SurveyCallback):
+    survey_id = callback_data.survey_id
+    survey_name = get_survey_name_by_id(survey_id)
+    version_id = get_latest_version_id(survey_id)
+    version = get_survey_version(version_id) if version_id else None
+    # Итоги читаются из счетчиков, а не пересчитываются по файлам с ответами
+    # Чтение идет из снимка базы в отдельном потоке и не задерживает запись ответов
+    tallies = await asyncio.to_thread(get_choice_tallies, version_id) if version else {}
+    report = render_tallies(version[2], version[3], tallies) if version else ""
+    if not report:
+        await call.message.edit_text(f"В опросе '{survey_name}' нет вопросов с вариантами ответа.", parse_mode='HTML')
+        await call.answer()
+        return
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Обновить", callback_data=callback_data)
+    text = f"Итоги опроса '{html.quote(survey_name)}' (версия {version[1]}):\n\n{report}"
+    try:
+        await call.message.edit_text(text, reply_markup=keyboard.as_markup(), parse_mode='HTML')
+    except TelegramBadRequest as e:
+        # Повторное нажатие "Обновить" без новых голосов
+        if "message is not modified" not in str(e):
+            raise
     await call.answer()
 
 @router.message(SurveyCreation.waiting_for_survey_name, F.chat.type == "private")
@@ -210,53 +512,60 @@ async def survey_name_handler(message: Message, state: FSMContext):
     if survey_exists(survey_name):
         await message.answer(f"Опрос с названием '{survey_name}' уже существует. Введите другое название.", parse_mode='HTML')
         return
-    survey_id = add_survey(survey_name)
-    await state.update_data(survey_id=survey_id, survey_name=survey_name)
-    await message.answer("Введите вопросы по одному. После ввода всех вопросов напишите /done", parse_mode='HTML')
+    # Вопросы копятся в состоянии и записываются одной транзакцией по /done
+    await state.update_data(survey_name=survey_name, questions=[])
+    await message.answer(
+        f"Введите вопросы по одному. После ввода всех вопросов напишите /done\n\n{html.quote(QUESTION_FORMAT_HINT)}",
+        parse_mode='HTML'
+    )
     await state.set_state(SurveyCreation.waiting_for_questions)
 
 @router.message(Command('done'), SurveyCreation.waiting_for_questions, F.chat.type == "private")
 async def survey_done_handler(message: Message, state: FSMContext):
     data_state = await state.get_data()
-    survey_id = data_state.get('survey_id')
     survey_name = data_state.get('survey_name')
+    try:
+        with unit_of_work() as cursor:
+            survey_id = insert_survey(cursor, survey_name, data_state.get('questions', []))
+    except sqlite3.IntegrityError:
+        await message.answer(f"Опрос с названием '{survey_name}' уже существует.", parse_mode='HTML')
+        await state.clear()
+        return
     keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="Опубликовать опрос", callback_data=f"publish_{survey_id}")
+    keyboard.button(text="Опубликовать опрос", callback_data=SurveyCallback(action=SurveyAction.publish, survey_id=survey_id))
     keyboard.adjust(1)
     await message.answer(f"Опрос '{survey_name}' успешно создан. Хотите опубликовать его сейчас?", reply_markup=keyboard.as_markup(), parse_mode='HTML')
     await state.clear()
 
 @router.message(SurveyCreation.waiting_for_questions, F.chat.type == "private")
 async def survey_question_handler(message: Message, state: FSMContext):
+    try:
+        question, qtype, options = parse_question_spec(message.text)
+    except ValueError as e:
+        await message.answer(html.quote(str(e)), parse_mode='HTML')
+        return
     data_state = await state.get_data()
-    survey_id = data_state.get('survey_id')
-    question = message.text.strip()
-    add_question(survey_id, question)
+    await state.update_data(questions=data_state.get('questions', []) + [[question, qtype, options]])
     await message.answer("Вопрос добавлен. Введите следующий вопрос или /done для завершения.", parse_mode='HTML')
 
-@router.callback_query(F.data.startswith("publish_"))
-async def publish_survey_handler(call: CallbackQuery, bot: Bot):
-    survey_id = int(call.data.replace("publish_", ""))
-    survey_name = get_survey_name_by_id(survey_id)
-    await resend_survey(call, survey_id, survey_name, bot)
-
 async def resend_survey(call: CallbackQuery, survey_id: int, survey_name: str, bot: Bot):
     groups = get_all_groups()
     if not groups:
         await call.message.edit_text("Бот не состоит ни в одной группе.", parse_mode='HTML')
         return
-    bot_user = await bot.get_me()
-    bot_username = bot_user.username
-    for group_id, group_title in groups:
-        survey_param_with_chat = f"survey_{survey_id}_{group_id}"
-        deep_link = f"https://t.me/{bot_username}?start={survey_param_with_chat}"
-        message_text = f"Дорогие друзья, просим вас пройти опрос: [{survey_name}]({deep_link})"
+    # Публикуем текущий черновик как новую версию (если он менялся)
+    version_id = publish_survey_version(survey_id)
+
+    async def announce_in_group(group_id):
         try:
-            sent_message = await bot.send_message(chat_id=group_id, text=message_text, parse_mode="Markdown")
-            if survey_name != "первичный":
-                await bot.pin_chat_message(chat_id=group_id, message_id=sent_message.message_id, disable_notification=False)
+            await announce_survey(bot, survey_id, version_id, group_id, survey_name)
         except Exception as e:
-            logging.error(f"Ошибка при отправке опроса в группу {group_id}: {e}")
+            logging.error("Ошибка при отправке опроса в группу %s: %s", group_id, e)
+
+    # Рассылка уходит с низшим приоритетом: очередь исходящих сообщений
+    # сама распределяет ее по времени и не задерживает ответы пользователям
+    with outbound_priority(BROADCAST):
+        await asyncio.gather(*(announce_in_group(group_id) for group_id, group_title in groups))
     await call.message.edit_text(f"Опрос '{survey_name}' был успешно отправлен во все группы.", parse_mode='HTML')
     await call.answer()
 
@@ -279,22 +588,48 @@ async def rename_survey_handler(message: Message, state: FSMContext):
     await message.answer(f"Название опроса было изменено на '{new_name}'.", parse_mode='HTML')
     await state.clear()
 
+@router.message(SurveyEdit.scheduling_publication, F.chat.type == "private")
+async def schedule_publication_handler(message: Message, state: FSMContext):
+    try:
+        run_at = datetime.strptime(message.text.strip(), "%d.%m.%Y %H:%M")
+    except (ValueError, AttributeError):
+        await message.answer("Не удалось разобрать дату. Используйте формат ДД.ММ.ГГГГ ЧЧ:ММ.", parse_mode='HTML')
+        return
+    if run_at <= datetime.now():
+        await message.answer("Время отправки уже прошло. Укажите время в будущем.", parse_mode='HTML')
+        return
+    data_state = await state.get_data()
+    schedule_publication(data_state.get('survey_id'), run_at.timestamp())
+    await message.answer(
+        f"Отправка опроса '{html.quote(data_state.get('survey_name'))}' запланирована на {run_at.strftime('%d.%m.%Y %H:%M')}.",
+        parse_mode='HTML'
+    )
+    await state.clear()
+
 @router.message(SurveyEdit.editing_question, F.chat.type == "private")
 async def edit_question_text_handler(message: Message, state: FSMContext):
-    new_text = message.text.strip()
+    try:
+        new_text, qtype, options = parse_question_spec(message.text)
+    except ValueError as e:
+        await message.answer(html.quote(str(e)), parse_mode='HTML')
+        return
     data_state = await state.get_data()
     question_id = data_state.get('question_id')
-    update_question_text(question_id, new_text)
+    update_question_text(question_id, new_text, qtype, options)
     await message.answer("Текст вопроса был обновлен.", parse_mode='HTML')
     await state.update_data(question_id=None)
     await state.clear()
 
 @router.message(SurveyEdit.adding_question, F.chat.type == "private")
 async def add_new_question_handler(message: Message, state: FSMContext):
-    question_text = message.text.strip()
+    try:
+        question_text, qtype, options = parse_question_spec(message.text)
+    except ValueError as e:
+        await message.answer(html.quote(str(e)), parse_mode='HTML')
+        return
     data_state = await state.get_data()
     survey_id = data_state.get('survey_id')
-    add_question_to_survey(survey_id, question_text)
+    add_question_to_survey(survey_id, question_text, qtype, options)
     await message.answer("Новый вопрос добавлен в опрос.", parse_mode='HTML')
     await state.clear()
 
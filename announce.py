@@ -0,0 +1,30 @@
+import logging
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from db_manager import get_survey_name_by_id, is_live_results_enabled
+from group_event import send_to_group
+from live_results import post_live_results
+from deeplink import survey_deep_link
+
+
+async def announce_survey(bot: Bot, survey_id, version_id, group_id, survey_name=None):
+    # Объявление опроса в группе: ссылка, закрепление и (если включены) живые итоги
+    survey_name = survey_name or get_survey_name_by_id(survey_id)
+    bot_user = await bot.me()
+    deep_link = survey_deep_link(bot_user.username, version_id, group_id)
+    message_text = f"Дорогие друзья, просим вас пройти опрос: [{survey_name}]({deep_link})"
+    sent_message = await send_to_group(bot, group_id, message_text, parse_mode="Markdown")
+    chat_id = sent_message.chat.id
+    # Объявление уже отправлено: ошибки дальше только записываются в лог, иначе
+    # планировщик повторит задачу и опрос появится в группе второй раз
+    if survey_name != "первичный":
+        try:
+            await bot.pin_chat_message(chat_id=chat_id, message_id=sent_message.message_id, disable_notification=False)
+        except TelegramAPIError as e:
+            logging.warning("Failed to pin survey %s announcement in chat %s: %s", survey_id, chat_id, e)
+    if is_live_results_enabled(survey_id):
+        try:
+            await post_live_results(bot, survey_id, version_id, chat_id)
+        except Exception as e:
+            logging.error("Failed to post live results for survey %s in chat %s: %s", survey_id, chat_id, e)
+    return sent_message
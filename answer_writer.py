@@ -0,0 +1,54 @@
+import os
+import asyncio
+import logging
+import metrics
+from db_manager import save_answers
+
+# Ответы пользователей копятся в памяти и записываются в базу пачками: раз в
+# ANSWER_FLUSH_INTERVAL секунд или сразу, как только набралось ANSWER_BATCH_SIZE
+ANSWER_FLUSH_INTERVAL = float(os.getenv('ANSWER_FLUSH_INTERVAL', '0.5'))
+ANSWER_BATCH_SIZE = int(os.getenv('ANSWER_BATCH_SIZE', '200'))
+
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 200, 500)
+
+
+class AnswerWriter:
+    def __init__(self, interval=ANSWER_FLUSH_INTERVAL, batch_size=ANSWER_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+
+    def add(self, submission_id, position, answer, choices=None):
+        self.pending.append((submission_id, position, answer, choices))
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        # Запись идет в отдельном потоке; блокировка сохраняет порядок пачек
+        async with self.lock:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                try:
+                    await asyncio.to_thread(save_answers, batch)
+                except Exception:
+                    # Ответы не теряются: пачка вернется в очередь до следующей попытки
+                    self.pending[:0] = batch
+                    raise
+                metrics.histogram('answers.batch_size', BATCH_BUCKETS).observe(len(batch))
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error("Failed to save survey answers: %s", e)
+
+
+answer_writer = AnswerWriter()
@@ -0,0 +1,73 @@
+import os
+import time
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
+from aiogram.exceptions import TelegramAPIError
+from dotenv import load_dotenv
+import metrics
+from fast_profile import session_json_options
+
+load_dotenv()
+
+# Адрес собственного сервера Bot API (telegram-bot-api). Пусто — облачный api.telegram.org
+TELEGRAM_API_SERVER = os.getenv('TELEGRAM_API_SERVER')
+# Сервер запущен с --local: файлы до 2000 МБ, скачивание с диска сервера
+TELEGRAM_API_LOCAL = os.getenv('TELEGRAM_API_LOCAL', 'False').lower() == 'true'
+# Размер пула соединений и время жизни простаивающего соединения (секунды)
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '100'))
+BOT_API_KEEPALIVE = float(os.getenv('BOT_API_KEEPALIVE', '60'))
+# Таймаут запроса по умолчанию и отдельные таймауты методов: "sendDocument=300,getFile=120"
+BOT_API_TIMEOUT = float(os.getenv('BOT_API_TIMEOUT', '30'))
+BOT_API_METHOD_TIMEOUTS = os.getenv('BOT_API_METHOD_TIMEOUTS', 'sendDocument=300,getFile=120')
+
+# Ограничение на отправку файлов ботом
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_UPLOAD_LIMIT = 2000 * 1024 * 1024
+UPLOAD_LIMIT = LOCAL_UPLOAD_LIMIT if TELEGRAM_API_SERVER and TELEGRAM_API_LOCAL else CLOUD_UPLOAD_LIMIT
+
+
+def parse_method_timeouts(value):
+    timeouts = {}
+    for item in value.split(','):
+        method, _, seconds = item.partition('=')
+        if method.strip() and seconds.strip():
+            timeouts[method.strip().lower()] = float(seconds)
+    return timeouts
+
+
+class TunedSession(AiohttpSession):
+    # Общая сессия бота: явный пул соединений с keep-alive, таймауты по методам
+    # и гистограммы задержки каждого метода Bot API (видны в /stats)
+    def __init__(self, api=PRODUCTION, limit=BOT_API_POOL_SIZE, keepalive=BOT_API_KEEPALIVE,
+                 timeout=BOT_API_TIMEOUT, method_timeouts=None, **kwargs):
+        super().__init__(api=api, limit=limit, timeout=timeout, **kwargs)
+        self._connector_init['keepalive_timeout'] = keepalive
+        self.method_timeouts = method_timeouts or {}
+
+    @classmethod
+    def from_env(cls):
+        api = TelegramAPIServer.from_base(TELEGRAM_API_SERVER, is_local=TELEGRAM_API_LOCAL) if TELEGRAM_API_SERVER else PRODUCTION
+        return cls(api=api, method_timeouts=parse_method_timeouts(BOT_API_METHOD_TIMEOUTS), **session_json_options())
+
+    def request_timeout(self, method, timeout):
+        if timeout is not None:
+            return timeout
+        name = method.__api_method__
+        timeout = self.method_timeouts.get(name.lower(), self.timeout)
+        # Длинный опрос getUpdates не должен обрываться раньше, чем ответит сервер
+        long_poll = getattr(method, 'timeout', None) if name == 'getUpdates' else None
+        if long_poll:
+            timeout = max(timeout, long_poll + 5)
+        return timeout
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, self.request_timeout(method, timeout))
+        except TelegramAPIError as e:
+            metrics.inc(f'bot_api.errors.{name}.{type(e).__name__}')
+            raise
+        finally:
+            if name != 'getUpdates':
+                metrics.observe(f'bot_api.latency.{name}', time.perf_counter() - started)
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import socket
+import tempfile
+import subprocess
+
+# Сравнение обычного и быстрого профиля (FAST_PROFILE): каждый прогон идет в
+# отдельном процессе, потому что профиль выбирается при импорте.
+#   parse — разбор ответа getUpdates (100 апдейтов) сессией aiogram;
+#   fsm   — запись и чтение состояния анкеты в SQLiteStorage;
+#   round — апдейты из заглушки Bot API (отдельный процесс, одинаковый для обоих
+#           прогонов) через getUpdates, обработчик с ответом sendMessage, не больше
+#           --concurrency апдейтов одновременно; скорость и задержка от получения
+#           апдейта до ответа.
+# Запуск: python bench_fast_profile.py --updates 5000
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def sample_updates(count, users):
+    # Сообщения и нажатия кнопок вперемешку, с кириллицей, как в реальном опросе
+    for number in range(count):
+        user = {"id": 100000 + number % users, "is_bot": False, "first_name": "Участник", "language_code": "ru"}
+        chat = {"id": user["id"], "type": "private", "first_name": "Участник"}
+        if number % 3:
+            yield {"message": {
+                "message_id": number + 1, "date": 1760000000, "chat": chat, "from": user,
+                "text": f"Ответ на вопрос анкеты номер {number}: самозанятый, Москва",
+            }}
+        else:
+            yield {"callback_query": {
+                "id": str(number), "from": user, "chat_instance": "1", "data": f"ch:1:{number % 5}:0",
+                "message": {"message_id": number, "date": 1760000000, "chat": chat, "text": "Ваш цвет?"},
+            }}
+
+
+def bench_parse(bot, repeat):
+    from aiogram.methods import GetUpdates
+    updates = []
+    for update_id, update in enumerate(sample_updates(100, 50), start=1):
+        updates.append({'update_id': update_id, **update})
+    body = json.dumps({"ok": True, "result": updates}, ensure_ascii=False)
+    method = GetUpdates()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        bot.session.check_response(bot, method, 200, body)
+    return repeat * len(updates) / (time.perf_counter() - started)
+
+
+async def bench_fsm(repeat):
+    from aiogram.fsm.storage.base import StorageKey
+    from fsm_storage import SQLiteStorage
+    from fast_profile import json_dumps, json_loads
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix='bench-fsm-'), 'fsm.db'), json_dumps, json_loads)
+    data = {
+        'version_id': 1, 'group_id': -1001234567890, 'submission_id': 42, 'current_question': 7,
+        'responses': [f"Развернутый ответ на вопрос {position}, с подробностями" for position in range(20)],
+        'choices': [[position, [0, 2]] for position in range(10)], 'selected': [1, 3],
+    }
+    key = StorageKey(bot_id=1, chat_id=100, user_id=100)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await storage.set_data(key, data)
+        await storage.get_data(key)
+    elapsed = time.perf_counter() - started
+    await storage.close()
+    return repeat / elapsed
+
+
+def start_stub(count, users):
+    # Заглушка в отдельном процессе не делит с ботом ни цикл событий, ни GIL
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-updates-'), 'updates.jsonl')
+    with open(path, 'w', encoding='utf-8') as f:
+        for update in sample_updates(count, users):
+            f.write(json.dumps(update, ensure_ascii=False) + '\n')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_bot_api.py'),
+         '--updates', path, '--port', str(port)],
+        env={**os.environ, 'FAST_PROFILE': 'False'}, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return stub, port
+
+
+async def bench_round(port, count, concurrency):
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Message, CallbackQuery, Update
+    from api_session import TunedSession
+    from fast_profile import session_json_options
+
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+    bot = Bot(token="123456:bench", session=TunedSession(api=api, **session_json_options()))
+    dp = Dispatcher()
+    received = {}
+    latencies = []
+
+    @dp.message()
+    async def echo(message: Message, event_update: Update):
+        await message.answer(f"Принято: {message.text}")
+        latencies.append(time.perf_counter() - received.pop(event_update.update_id))
+
+    @dp.callback_query()
+    async def choice(call: CallbackQuery, event_update: Update):
+        await call.message.answer("Вариант учтен")
+        latencies.append(time.perf_counter() - received.pop(event_update.update_id))
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def process(update):
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            slots.release()
+
+    offset = None
+    fed = 0
+    started = time.perf_counter()
+    while fed < count:
+        updates = await bot.get_updates(offset=offset, timeout=0)
+        fed += len(updates)
+        for update in updates:
+            await slots.acquire()
+            received[update.update_id] = time.perf_counter()
+            task = loop.create_task(process(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            offset = update.update_id + 1
+    if tasks:
+        await asyncio.wait(tasks)
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    latencies.sort()
+    return {
+        'updates_s': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def child(args):
+    from fast_profile import install_event_loop, describe
+    from aiogram import Bot
+    from api_session import TunedSession
+    install_event_loop()
+    bot = Bot(token="123456:bench", session=TunedSession.from_env())
+    report = {'profile': describe(), 'parse_updates_s': bench_parse(bot, args.parse_repeat)}
+    report['fsm_ops_s'] = asyncio.run(bench_fsm(args.fsm_repeat))
+    stub, port = start_stub(args.updates, args.users)
+    try:
+        report.update(asyncio.run(bench_round(port, args.updates, args.concurrency)))
+    finally:
+        stub.terminate()
+        stub.wait()
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение обычного и быстрого профиля (uvloop, orjson)")
+    parser.add_argument('--updates', type=int, default=5000, help="Апдейтов в прогоне через заглушку Bot API")
+    parser.add_argument('--users', type=int, default=500, help="Разных пользователей в апдейтах")
+    parser.add_argument('--concurrency', type=int, default=50, help="Апдейтов в обработке одновременно")
+    parser.add_argument('--parse-repeat', type=int, default=200, help="Сколько раз разбирать ответ getUpdates")
+    parser.add_argument('--fsm-repeat', type=int, default=5000, help="Циклов записи и чтения FSM")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    print(f"{'FAST_PROFILE':<14}{'profile':<40}{'parse upd/s':>13}{'fsm ops/s':>11}{'round upd/s':>13}{'p50 ms':>9}{'p99 ms':>9}")
+    for enabled in ('False', 'True'):
+        env = {**os.environ, 'FAST_PROFILE': enabled, 'LOGGING_LEVEL': 'WARNING'}
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', *sys.argv[1:]],
+            env=env, check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{enabled:<14}{report['profile']:<40}{report['parse_updates_s']:>13.0f}{report['fsm_ops_s']:>11.0f}"
+            f"{report['updates_s']:>13.0f}{report['p50_ms']:>9.1f}{report['p99_ms']:>9.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+# Задержка записи на горячем пути (add_user_to_pending, сохранение и завершение анкеты)
+# во время большой выгрузки результатов. Прогоны:
+#   idle     — выгрузки нет;
+#   blocking — выгрузка прямо в цикле событий, как синхронный вызов из обработчика;
+#   snapshot — выгрузка в отдельном потоке из снимка базы (как в admin.py);
+#   rows     — только чтение всех ответов из снимка, подряд в течение того же времени
+#              (без построения xlsx, которое само по себе держит GIL).
+# Задержка считается от запланированного момента записи до ее фиксации, поэтому
+# остановка цикла событий тоже попадает в результат.
+# Запуск: python bench_snapshot_reads.py --submissions 5000
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def seed(db, survey_id, version_id, submissions, questions):
+    now = int(time.time())
+    with db.unit_of_work() as cursor:
+        for number in range(submissions):
+            cursor.execute(
+                "INSERT INTO submissions (user_id, survey_id, version_id, group_id, first_name, status, "
+                "started_at, completed_at, completed_seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (10 ** 6 + number, survey_id, version_id, -100, f"user{number}", db.SUBMISSION_COMPLETE,
+                 now, now, number + 1)
+            )
+            submission_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO submission_answers (submission_id, position, answer) VALUES (?, ?, ?)",
+                [(submission_id, position, f"ответ {number}-{position} " * 4) for position in range(questions)]
+            )
+
+
+async def writer(db, survey_id, version_id, questions, interval, stop, latencies):
+    loop = asyncio.get_running_loop()
+    user_id = 5 * 10 ** 6
+    due = loop.time()
+    while not stop.is_set():
+        user_id += 1
+        db.add_user_to_pending(user_id, -100)
+        submission_id = db.start_submission(user_id, survey_id, version_id, -100, "bench")
+        db.save_answers([(submission_id, position, "ответ", None) for position in range(questions)])
+        db.complete_submission(submission_id)
+        latencies.append(loop.time() - due)
+        due += interval
+        now = loop.time()
+        # Если отстала сама запись, следующая планируется от текущего момента;
+        # остановка цикла во время паузы учитывается в задержке следующей записи
+        due = max(due, now)
+        await asyncio.sleep(due - now)
+
+
+async def run_mode(mode, db, data_manager, survey_id, survey_name, version_id, questions, interval, duration):
+    latencies = []
+    stop = asyncio.Event()
+    writer_task = asyncio.create_task(writer(db, survey_id, version_id, questions, interval, stop, latencies))
+    await asyncio.sleep(0.2)
+    started = time.perf_counter()
+    if mode == 'blocking':
+        data_manager.export_survey_results(survey_id, survey_name)
+    elif mode == 'snapshot':
+        await asyncio.to_thread(data_manager.export_survey_results, survey_id, survey_name)
+    elif mode == 'rows':
+        while time.perf_counter() - started < duration:
+            await asyncio.to_thread(db.get_submission_rows, survey_id)
+    else:
+        await asyncio.sleep(duration)
+    export_time = time.perf_counter() - started
+    await asyncio.sleep(0.2)
+    stop.set()
+    await writer_task
+    latencies.sort()
+    return {
+        'writes': len(latencies),
+        'export_s': round(export_time, 2),
+        **{name: round(percentile(latencies, q) * 1000, 2) for name, q in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))},
+    }
+
+
+async def check_snapshot(db, survey_id, version_id, questions):
+    # Два чтения внутри одного снимка видят одно и то же, хотя между ними
+    # другой поток успевает зафиксировать новую анкету
+    def read_twice():
+        with db.read_snapshot() as cursor:
+            query = "SELECT COUNT(*) FROM submissions WHERE survey_id = ? AND status = ?"
+            cursor.execute(query, (survey_id, db.SUBMISSION_COMPLETE))
+            before = cursor.fetchone()[0]
+            submission_id = db.start_submission(9 * 10 ** 6, survey_id, version_id, -100, "check")
+            db.complete_submission(submission_id)
+            cursor.execute(query, (survey_id, db.SUBMISSION_COMPLETE))
+            return before, cursor.fetchone()[0]
+    return await asyncio.to_thread(read_twice)
+
+
+async def main_async(args):
+    import db_manager as db
+    import data_manager
+    db.initialize_db()
+    survey_name = "bench"
+    with db.unit_of_work() as cursor:
+        survey_id = db.insert_survey(
+            cursor, survey_name, [(f"Вопрос {position}", db.QTYPE_TEXT, None) for position in range(args.questions)]
+        )
+    db.publish_survey_version(survey_id)
+    version_id = db.get_latest_version_id(survey_id)
+    seed(db, survey_id, version_id, args.submissions, args.questions)
+
+    print(f"{args.submissions} submissions x {args.questions} answers, write every {args.interval * 1000:.0f} ms")
+    print(f"{'mode':<10}{'writes':>8}{'export s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    duration = None
+    for mode in ('blocking', 'idle', 'snapshot', 'rows'):
+        report = await run_mode(mode, db, data_manager, survey_id, survey_name, version_id,
+                                args.questions, args.interval, duration or 1.0)
+        if mode == 'blocking':
+            # Прогон без выгрузки длится столько же, сколько сама выгрузка
+            duration = report['export_s']
+        print(f"{mode:<10}{report['writes']:>8}{report['export_s']:>10}{report['p50']:>9}{report['p99']:>9}{report['max']:>9}")
+    before, after = await check_snapshot(db, survey_id, version_id, args.questions)
+    print(f"snapshot consistency: {before} == {after} ({'ok' if before == after else 'FAILED'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка записи во время выгрузки результатов")
+    parser.add_argument('--submissions', type=int, default=5000, help="Сколько завершенных анкет в базе")
+    parser.add_argument('--questions', type=int, default=5, help="Ответов в анкете")
+    parser.add_argument('--interval', type=float, default=0.005, help="Пауза между записями, секунды")
+    parser.add_argument('--workdir', help="Рабочий каталог для базы и выгрузок; по умолчанию временный")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-')
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,34 @@
 import os
+import signal
 import asyncio
 import logging
+import threading
+import multiprocessing
+from queue import Empty
 from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 from admin import register_admin_handlers
 from survey import register_survey_handlers
 from group_event import register_group_handlers
 from db_manager import initialize_db
+from throttling import ThrottlingMiddleware
+from outbound import OutboundQueue
+from fsm_storage import SQLiteStorage
+from retention import retention_loop
+from log_setup import setup_logging, install_logging_middlewares
+from shutdown import install_shutdown, register_flush
+from group_event import resume_captcha_timers
+from live_results import flush_live_results
+from scheduler import scheduler_loop
+from recorder import UpdateRecorder
+from api_session import TunedSession
+from loop_watchdog import LoopWatchdog, ENABLE_WATCHDOG
+from answer_writer import answer_writer
+from pull_api import serve_pull_api, ENABLE_PULL_API
+from facets import index_facets
+from fast_profile import install_event_loop, log_profile, json_dumps, json_loads
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
@@ -16,19 +37,70 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 ADMIN_IDS = [int(admin_id) for admin_id in os.getenv('ADMIN_IDS').split(',')]
 ENABLE_LOGGING = os.getenv('ENABLE_LOGGING', 'True').lower() == 'true'
 LOGGING_LEVEL = os.getenv('LOGGING_LEVEL', 'INFO').upper()
+# json — структурированные события, text — привычный построчный вывод
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+# Доля сохраняемых служебных событий об обработке каждого апдейта
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+ENABLE_THROTTLING = os.getenv('ENABLE_THROTTLING', 'True').lower() == 'true'
+ENABLE_OUTBOUND_QUEUE = os.getenv('ENABLE_OUTBOUND_QUEUE', 'True').lower() == 'true'
+# Число процессов-воркеров; при значении больше 1 основной процесс только принимает апдейты
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '10'))
+# При нескольких воркерах состояние FSM должно храниться на диске
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite' if BOT_WORKERS > 1 else 'memory').lower()
+ENABLE_RETENTION = os.getenv('ENABLE_RETENTION', 'True').lower() == 'true'
+ENABLE_SCHEDULER = os.getenv('ENABLE_SCHEDULER', 'True').lower() == 'true'
+# Запись входящих апдейтов для воспроизведения через replay.py
+RECORD_UPDATES = os.getenv('RECORD_UPDATES', 'False').lower() == 'true'
+# Апдейты, полученные Telegram во время перезапуска, по умолчанию обрабатываются
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', 'False').lower() == 'true'
 
 # Настройка логирования
+# Записи уходят в очередь, а форматирование и вывод выполняет отдельный поток
 if ENABLE_LOGGING:
-    logging.basicConfig(level=getattr(logging, LOGGING_LEVEL, logging.INFO))
+    setup_logging(LOGGING_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
     logging.info("Логирование включено")
 else:
     logging.disable(logging.CRITICAL)
 
+# FAST_PROFILE=True: uvloop и orjson, если установлены. Политика цикла событий
+# задается при импорте, поэтому действует и в процессах-воркерах
+install_event_loop()
+log_profile()
+
 # Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_TOKEN)
-storage = MemoryStorage()
+# Общая HTTP-сессия: пул соединений, таймауты по методам, при необходимости
+# собственный сервер Bot API (TELEGRAM_API_SERVER)
+bot = Bot(token=TELEGRAM_TOKEN, session=TunedSession.from_env())
+# Все исходящие запросы к чатам проходят через общую очередь с приоритетами.
+# Воркеры делят общий лимит бота поровну
+if ENABLE_OUTBOUND_QUEUE:
+    outbound_queue = OutboundQueue.from_env(share=BOT_WORKERS)
+    bot.session.middleware(outbound_queue)
+storage = SQLiteStorage(json_dumps=json_dumps, json_loads=json_loads) if FSM_STORAGE == 'sqlite' else MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+# Учет незавершенных апдейтов для корректной остановки. Накопленные ответы
+# записываются в базу, отложенные правки живых итогов выполняются до того,
+# как опустошается очередь исходящих
+install_shutdown(dp)
+register_flush(answer_writer.flush)
+register_flush(flush_live_results)
+if ENABLE_OUTBOUND_QUEUE:
+    register_flush(outbound_queue.drain)
+
+if RECORD_UPDATES:
+    recorder = UpdateRecorder()
+    dp.update.outer_middleware(recorder)
+    register_flush(recorder.close)
+
+if ENABLE_LOGGING:
+    install_logging_middlewares(dp)
+
+# Антифлуд: лишние апдейты отсекаются до обработчиков
+if ENABLE_THROTTLING:
+    dp.update.outer_middleware(ThrottlingMiddleware.from_env())
+
 # Инициализация базы данных
 initialize_db()
 
@@ -37,9 +109,168 @@ register_admin_handlers(dp)
 register_survey_handlers(dp)
 register_group_handlers(dp)
 
+background_tasks = set()
+
+async def on_startup(worker_index: int = 0):
+    # Задержки цикла событий отслеживаются в каждом процессе
+    if ENABLE_WATCHDOG:
+        task = LoopWatchdog().start()
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    # Ответы на опросы записываются пачками в каждом процессе
+    task = asyncio.create_task(answer_writer.run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    # Фоновое обслуживание выполняется только в одном процессе
+    if worker_index != 0:
+        return
+    resumed = resume_captcha_timers(bot)
+    if resumed:
+        logging.info("Resumed %s captcha timers", resumed)
+    # Анкеты, завершенные до появления фасетов, разбираются один раз
+    indexed = await asyncio.to_thread(index_facets)
+    if indexed:
+        logging.info("Indexed facets for %s submissions", indexed)
+    if ENABLE_RETENTION:
+        task = asyncio.create_task(retention_loop())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    if ENABLE_SCHEDULER:
+        task = asyncio.create_task(scheduler_loop(bot))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    if ENABLE_PULL_API:
+        task = asyncio.create_task(serve_pull_api())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 async def main():
-    await bot.delete_webhook(drop_pending_updates=True)
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
     await dp.start_polling(bot)
 
+# Режим нескольких процессов: главный процесс получает апдейты и раздает их
+# воркерам по стабильному хешу пользователя (или чата), так что все апдейты
+# одного пользователя обрабатываются одним и тем же воркером по порядку
+
+def shard_for_update(update, workers):
+    context = UserContextMiddleware.resolve_event_context(update)
+    key = context.user_id or context.chat_id or update.update_id
+    return key % workers
+
+async def receive_updates(queues):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    logging.info("Receiver started with %s workers", len(queues))
+    while not stop.is_set():
+        polling = asyncio.create_task(
+            bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+        )
+        stopping = asyncio.create_task(stop.wait())
+        await asyncio.wait({polling, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not polling.done():
+            polling.cancel()
+            break
+        try:
+            updates = polling.result()
+        except Exception as e:
+            logging.error("Failed to fetch updates: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            raw_update = update.model_dump(mode='json', exclude_none=True, by_alias=True)
+            queues[shard_for_update(update, len(queues))].put(raw_update)
+            offset = update.update_id + 1
+    await bot.session.close()
+
+async def worker_main(index, queue):
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    # multiprocessing.Queue блокирующая, поэтому читаем ее в отдельном потоке.
+    # Если главный процесс погиб, не успев отправить None, воркер завершается сам
+    parent = multiprocessing.parent_process()
+
+    def pump():
+        while True:
+            try:
+                raw_update = queue.get(timeout=1)
+            except Empty:
+                if parent is not None and not parent.is_alive():
+                    raw_update = None
+                else:
+                    continue
+            loop.call_soon_threadsafe(inbox.put_nowait, raw_update)
+            if raw_update is None:
+                return
+
+    threading.Thread(target=pump, name=f"worker-{index}-inbox", daemon=True).start()
+    workflow_data = {'dispatcher': dp, 'bots': [bot], 'worker_index': index, **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    logging.info("Worker %s started", index)
+    tasks = set()
+    try:
+        while True:
+            raw_update = await inbox.get()
+            if raw_update is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, raw_update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+
+def run_worker(index, queue):
+    # Остановкой воркеров управляет главный процесс: сигнал, отправленный всей
+    # группе процессов (Ctrl+C, systemctl stop), воркер пропускает и дожидается
+    # None в очереди, чтобы успеть доделать апдейты и сбросить накопленное
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker_main(index, queue))
+
+def run_supervisor(workers):
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=run_worker, args=(index, queue), name=f"bot-worker-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    # Воркеры наследуют игнорирование сигналов с момента запуска: сигнал,
+    # пришедший, пока воркер еще импортирует модули, не должен его убить
+    handlers = {sig: signal.signal(sig, signal.SIG_IGN) for sig in (signal.SIGINT, signal.SIGTERM)}
+    for process in processes:
+        process.start()
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+    try:
+        asyncio.run(receive_updates(queues))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                # SIGTERM воркеры игнорируют
+                process.kill()
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if BOT_WORKERS > 1:
+        run_supervisor(BOT_WORKERS)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,81 @@
+from enum import Enum
+from aiogram.filters.callback_data import CallbackData
+
+
+class MenuAction(str, Enum):
+    create_survey = "create"
+    edit_survey = "edit"
+    view_surveys = "view"
+    delete_survey = "delete"
+    send_results = "results"
+    resend_survey = "resend"
+    rename_survey = "rename"
+    edit_questions = "questions"
+    add_question = "add_q"
+    modify_question = "modify_q"
+    delete_question = "delete_q"
+    view_tallies = "tallies"
+    toggle_live_results = "live"
+    schedule_publication = "sched"
+    view_schedule = "sched_list"
+    import_surveys = "import"
+
+
+class SurveyAction(str, Enum):
+    edit = "edit"
+    delete = "delete"
+    send_results = "results"
+    resend = "resend"
+    publish = "publish"
+    view = "view"
+    tallies = "tally"
+
+
+class PageOp(str, Enum):
+    page = "p"
+    search = "s"
+    reset = "r"
+
+
+# Кнопки главного меню администратора и действий без параметров
+class AdminMenuCallback(CallbackData, prefix="adm"):
+    action: MenuAction
+
+
+# Действия над конкретным опросом
+class SurveyCallback(CallbackData, prefix="srv"):
+    action: SurveyAction
+    survey_id: int
+
+
+# Выбор вопроса для редактирования
+class QuestionCallback(CallbackData, prefix="qst"):
+    question_id: int
+
+
+# Листание списка опросов. Страница задается границей по id, а не смещением
+class SurveyPageCallback(CallbackData, prefix="spg"):
+    action: SurveyAction
+    op: PageOp = PageOp.page
+    after_id: int = 0
+    before_id: int = 0
+
+
+# Листание вопросов опроса
+class QuestionPageCallback(CallbackData, prefix="qpg"):
+    survey_id: int
+    after_id: int = 0
+    before_id: int = 0
+
+
+# Отмена запланированной отправки опроса
+class JobCallback(CallbackData, prefix="job"):
+    job_id: int
+
+
+# Ответ на вопрос с вариантами. Поля - только числа, чтобы уложиться
+# в 64 байта callback_data при любом тексте вариантов
+class ChoiceCallback(CallbackData, prefix="ch"):
+    version_id: int
+    position: int
+    option: int
@@ -0,0 +1,110 @@
+import re
+from aiogram import html
+from aiogram.types import InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from callbacks import ChoiceCallback
+from db_manager import QTYPE_TEXT, QTYPE_SINGLE, QTYPE_MULTI, QTYPE_SCALE
+
+MAX_OPTIONS = 10
+MAX_SCALE_STEPS = 11
+# Кнопка "Готово" у вопроса с несколькими ответами
+DONE_OPTION = -1
+
+SCALE_PATTERN = re.compile(r'^(-?\d+)\s*\.\.\s*(-?\d+)$')
+OPTION_MARKERS = {'-': QTYPE_SINGLE, '+': QTYPE_MULTI}
+
+QUESTION_FORMAT_HINT = (
+    "Варианты ответа можно указать с новой строки после текста вопроса:\n"
+    "«- вариант» — один ответ, «+ вариант» — несколько ответов, «1..5» — шкала."
+)
+
+
+def parse_question_spec(text):
+    # Возвращает (текст вопроса, тип, варианты). Ошибки формата - ValueError с текстом для администратора
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    question_lines, options, qtype = [], [], QTYPE_TEXT
+    for line in lines:
+        scale = SCALE_PATTERN.match(line) if question_lines else None
+        marker = line[0] if len(line) > 1 and line[1] == ' ' else None
+        if scale:
+            if qtype != QTYPE_TEXT:
+                raise ValueError("Шкалу нельзя сочетать с другими вариантами ответа.")
+            low, high = int(scale.group(1)), int(scale.group(2))
+            if not 2 <= high - low + 1 <= MAX_SCALE_STEPS:
+                raise ValueError(f"Шкала должна содержать от 2 до {MAX_SCALE_STEPS} значений.")
+            qtype, options = QTYPE_SCALE, [str(value) for value in range(low, high + 1)]
+        elif question_lines and marker in OPTION_MARKERS:
+            if qtype not in (QTYPE_TEXT, OPTION_MARKERS[marker]):
+                raise ValueError("Все варианты ответа должны начинаться с одного и того же знака.")
+            qtype = OPTION_MARKERS[marker]
+            options.append(line[2:].strip())
+        elif options:
+            raise ValueError("Текст вопроса должен идти до вариантов ответа.")
+        else:
+            question_lines.append(line)
+    if not question_lines:
+        raise ValueError("Текст вопроса не может быть пустым.")
+    if qtype in (QTYPE_SINGLE, QTYPE_MULTI) and not 2 <= len(options) <= MAX_OPTIONS:
+        raise ValueError(f"Укажите от 2 до {MAX_OPTIONS} вариантов ответа.")
+    return "\n".join(question_lines), qtype, options
+
+
+def validate_question(text, qtype=QTYPE_TEXT, options=None):
+    # То же, что parse_question_spec, но для уже разобранных полей (импорт из файла).
+    # Шкала задается строкой "a..b" или готовым списком подписей
+    text = (text or "").strip()
+    qtype = (qtype or QTYPE_TEXT).strip().lower()
+    if not text:
+        raise ValueError("Текст вопроса не может быть пустым.")
+    if qtype == QTYPE_TEXT:
+        return text, qtype, []
+    if qtype == QTYPE_SCALE and isinstance(options, str):
+        scale = SCALE_PATTERN.match(options.strip())
+        if not scale:
+            raise ValueError("Шкала задается в виде «1..5».")
+        low, high = int(scale.group(1)), int(scale.group(2))
+        options = [str(value) for value in range(low, high + 1)]
+    if qtype not in (QTYPE_SINGLE, QTYPE_MULTI, QTYPE_SCALE):
+        raise ValueError(f"Неизвестный тип вопроса «{qtype}».")
+    options = [str(option).strip() for option in options or [] if str(option).strip()]
+    limit = MAX_SCALE_STEPS if qtype == QTYPE_SCALE else MAX_OPTIONS
+    if not 2 <= len(options) <= limit:
+        raise ValueError(f"Укажите от 2 до {limit} вариантов ответа.")
+    return text, qtype, options
+
+
+def choice_keyboard(version_id, position, qtype, options, selected=()):
+    keyboard = InlineKeyboardBuilder()
+    for index, option in enumerate(options):
+        text = f"✅ {option}" if index in selected else option
+        keyboard.button(text=text, callback_data=ChoiceCallback(version_id=version_id, position=position, option=index))
+    if qtype == QTYPE_SCALE:
+        keyboard.adjust(6)
+    else:
+        keyboard.adjust(1)
+    if qtype == QTYPE_MULTI:
+        keyboard.row(InlineKeyboardButton(
+            text="Готово",
+            callback_data=ChoiceCallback(version_id=version_id, position=position, option=DONE_OPTION).pack(),
+        ))
+    return keyboard.as_markup()
+
+
+def answer_text(options, indexes):
+    return ", ".join(options[index] for index in indexes)
+
+
+def render_tallies(questions, layout, tallies):
+    # Итоги по вопросам с вариантами ответа в HTML для сообщения администратору
+    blocks = []
+    for position, (question, (qtype, options)) in enumerate(zip(questions, layout)):
+        if qtype == QTYPE_TEXT:
+            continue
+        counts = [tallies.get((position, index), 0) for index in range(len(options))]
+        total = sum(counts)
+        lines = [f"<b>{html.quote(question)}</b>"]
+        for option, count in zip(options, counts):
+            share = f" ({count * 100 / total:.0f}%)" if total else ""
+            lines.append(f"• {html.quote(option)} — {count}{share}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
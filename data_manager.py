@@ -1,32 +1,100 @@
 import os
+import glob
 import pandas as pd
+from datetime import datetime
+from db_manager import get_submission_rows, get_surveys_with_submissions, delete_submissions
 
 DATA_FOLDER = "data"
+ARCHIVE_FOLDER = os.path.join(DATA_FOLDER, "archive")
+# Выгрузки результатов для администратора, собираются из базы по запросу
+EXPORT_FOLDER = os.path.join(DATA_FOLDER, "exports")
 
 if not os.path.exists(DATA_FOLDER):
     os.makedirs(DATA_FOLDER)
 
-def save_to_excel(user_id, first_name, last_name, username, group_id, group_name, survey_date, responses, survey_name):
+COLUMNS = [
+    "User ID", "First Name", "Last Name", "Username", "Group ID", "Group Name",
+    "Survey Date", "Survey Name", "Survey Version", "Question", "Answer",
+]
+
+def results_filename(survey_name, folder=DATA_FOLDER):
     sanitized_survey_name = survey_name.replace(" ", "_").replace("/", "_")
-    filename = f"{DATA_FOLDER}/survey_results_{sanitized_survey_name}.xlsx"
-    
-    # Формирование DataFrame с дополнительной информацией о пользователе и группе
-    df = pd.DataFrame({
-        "User ID": [user_id] * len(responses),
-        "First Name": [first_name] * len(responses),
-        "Last Name": [last_name] * len(responses),
-        "Username": [username] * len(responses),
-        "Group ID": [group_id] * len(responses),
-        "Group Name": [group_name] * len(responses),
-        "Survey Date": [survey_date] * len(responses),
-        "Survey Name": [survey_name] * len(responses),
-        "Question": [resp['question'] for resp in responses],
-        "Answer": [resp['answer'] for resp in responses]
-    })
-    
-    if os.path.exists(filename):
-        existing_df = pd.read_excel(filename)
-        df = pd.concat([existing_df, df], ignore_index=True)
-    
-    # Сохранение в Excel
-    df.to_excel(filename, index=False)
+    return f"{folder}/survey_results_{sanitized_survey_name}.xlsx"
+
+def submissions_frame(rows, survey_name):
+    # rows — результат get_submission_rows, по строке на ответ
+    return pd.DataFrame(
+        [
+            (user_id, first_name, last_name or "", username or "", group_id, group_name,
+             datetime.fromtimestamp(completed_at).strftime("%d-%m-%Y"), survey_name, version, question, answer)
+            for submission_id, user_id, first_name, last_name, username, group_id, group_name,
+                completed_at, version, question, answer in rows
+        ],
+        columns=COLUMNS,
+    )
+
+def export_survey_results(survey_id, survey_name):
+    # Выгрузка строится из базы. Ответы, сохраненные до перехода на хранение
+    # в базе, остаются в прежнем файле data/survey_results_<имя>.xlsx и добавляются в начало
+    frames = []
+    legacy_filename = results_filename(survey_name)
+    if os.path.exists(legacy_filename):
+        frames.append(pd.read_excel(legacy_filename))
+    rows = get_submission_rows(survey_id)
+    if rows:
+        frames.append(submissions_frame(rows, survey_name))
+    if not frames:
+        return None
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+    filename = results_filename(survey_name, EXPORT_FOLDER)
+    tmp_filename = f"{filename}.tmp.xlsx"
+    pd.concat(frames, ignore_index=True).to_excel(tmp_filename, index=False, engine="openpyxl")
+    os.replace(tmp_filename, filename)
+    return filename
+
+def append_to_archive(stem, rows, months):
+    # gzip допускает дозапись: новый блок просто добавляется в конец файла
+    for month, month_rows in rows.groupby(months):
+        archive_name = f"{ARCHIVE_FOLDER}/{stem}_{month}.csv.gz"
+        month_rows.to_csv(
+            archive_name,
+            index=False,
+            mode="a",
+            header=not os.path.exists(archive_name),
+            compression={"method": "gzip"},
+        )
+
+def archive_old_submissions(cutoff):
+    # Завершенные анкеты старше cutoff переносятся из базы в те же помесячные архивы
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    archived = 0
+    for survey_id, survey_name in get_surveys_with_submissions(cutoff.timestamp()):
+        rows = get_submission_rows(survey_id, completed_before=cutoff.timestamp())
+        df = submissions_frame(rows, survey_name)
+        stem = os.path.splitext(os.path.basename(results_filename(survey_name)))[0]
+        months = pd.to_datetime(df["Survey Date"], format="%d-%m-%Y").dt.strftime("%Y-%m")
+        append_to_archive(stem, df, months)
+        delete_submissions(sorted({row[0] for row in rows}))
+        archived += len(df)
+    return archived
+
+def archive_old_responses(cutoff):
+    # Переносит ответы старше cutoff из рабочих файлов в сжатые помесячные архивы
+    # data/archive/<имя файла>_<ГГГГ-ММ>.csv.gz и перезаписывает рабочий файл без них
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    archived = 0
+    for filename in glob.glob(f"{DATA_FOLDER}/survey_results_*.xlsx"):
+        df = pd.read_excel(filename)
+        if df.empty or "Survey Date" not in df:
+            continue
+        dates = pd.to_datetime(df["Survey Date"], format="%d-%m-%Y", errors="coerce")
+        old_mask = dates < pd.Timestamp(cutoff)
+        if not old_mask.any():
+            continue
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        append_to_archive(stem, df[old_mask], dates[old_mask].dt.strftime("%Y-%m"))
+        tmp_filename = f"{filename}.tmp.xlsx"
+        df[~old_mask].to_excel(tmp_filename, index=False, engine="openpyxl")
+        os.replace(tmp_filename, filename)
+        archived += int(old_mask.sum())
+    return archived
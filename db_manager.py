@@ -1,11 +1,107 @@
 import sqlite3
 import os
+import time
+import json
+import queue
+from contextlib import contextmanager
 
-DB_FILE = "surveys.db"
+DB_FILE = os.getenv('DB_FILE', "surveys.db")
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))
+# После стольких отказов подряд (бот удален или лишен прав) группа исключается из рассылок
+GROUP_FAILURE_THRESHOLD = int(os.getenv('GROUP_FAILURE_THRESHOLD', '3'))
+# Сколько соединений только для чтения держится открытыми для тяжелых запросов
+READ_POOL_SIZE = int(os.getenv('READ_POOL_SIZE', '4'))
+
+GROUP_ACTIVE = 'active'
+GROUP_LEFT = 'left'
+GROUP_PARKED = 'parked'
+
+# Типы вопросов. Для вариантов выбора и шкалы в questions.options хранится JSON-список подписей
+QTYPE_TEXT = 'text'
+QTYPE_SINGLE = 'single'
+QTYPE_MULTI = 'multi'
+QTYPE_SCALE = 'scale'
+CHOICE_QTYPES = (QTYPE_SINGLE, QTYPE_MULTI, QTYPE_SCALE)
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+# Анкета пользователя: черновик пополняется по мере ответов, завершение — смена статуса
+SUBMISSION_DRAFT = 'draft'
+SUBMISSION_COMPLETE = 'complete'
+SUBMISSION_ABANDONED = 'abandoned'
+
+# Нормализованные ответы анкеты (роль, регион) в отдельных индексируемых колонках
+FACETS = ('role', 'region')
+
+def get_connection():
+    # Базу могут одновременно использовать несколько процессов-воркеров,
+    # поэтому при блокировке ждем, а не падаем сразу с "database is locked"
+    conn = sqlite3.connect(DB_FILE, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_readonly_connection():
+    # Только чтение: внешние потребители (выгрузки, API) не мешают записи бота.
+    # Соединение из пула может использоваться из разных потоков, но не одновременно
+    return sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+
+read_pool = queue.SimpleQueue()
+
+@contextmanager
+def read_snapshot():
+    # Согласованный снимок базы для тяжелых чтений (выгрузки, отчеты, API). В режиме
+    # WAL читатель не блокирует запись: бот продолжает писать, а все запросы внутри
+    # блока видят базу такой, какой она была на момент первого из них
+    try:
+        conn = read_pool.get_nowait()
+    except queue.Empty:
+        conn = get_readonly_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        yield cursor
+    finally:
+        # Конец транзакции отпускает снимок, иначе WAL не сможет сократиться
+        conn.rollback()
+        if read_pool.qsize() < READ_POOL_SIZE:
+            read_pool.put(conn)
+        else:
+            conn.close()
+
+@contextmanager
+def unit_of_work():
+    # Одна транзакция на группу изменений: либо применяется все, либо ничего.
+    # Внутри блока используйте переданный курсор и executemany для пакетных вставок
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        conn.close()
+
+def ensure_column(cursor, table, column, definition):
+    # Простая миграция: добавляет столбец в уже существующую таблицу
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
 
 def initialize_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
+    # WAL позволяет читателям не блокировать писателя (настройка сохраняется в файле базы)
+    cursor.execute("PRAGMA journal_mode=WAL")
     # Создание таблиц
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS surveys (
@@ -31,16 +127,162 @@ def initialize_db():
         CREATE TABLE IF NOT EXISTS pending_users (
             user_id INTEGER,
             chat_id INTEGER,
+            joined_at INTEGER,
             PRIMARY KEY (user_id, chat_id)
         )
     ''')
+    ensure_column(cursor, "groups", "status", f"TEXT NOT NULL DEFAULT '{GROUP_ACTIVE}'")
+    ensure_column(cursor, "groups", "failures", "INTEGER NOT NULL DEFAULT 0")
+    if ensure_column(cursor, "pending_users", "joined_at", "INTEGER"):
+        # Для старых записей время вступления неизвестно, отсчитываем его от миграции
+        cursor.execute("UPDATE pending_users SET joined_at = ? WHERE joined_at IS NULL", (int(time.time()),))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_users_joined_at ON pending_users (joined_at)")
+    # Постраничный выбор вопросов в админке идет по (survey_id, id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_survey_id ON questions (survey_id, id)")
+    # Опубликованные версии опросов неизменяемы: правки вопросов меняют только
+    # черновик (таблица questions) и попадают к пользователям со следующей публикацией
+    ensure_column(cursor, "surveys", "draft_dirty", "INTEGER NOT NULL DEFAULT 1")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            survey_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            UNIQUE (survey_id, version)
+        )
+    ''')
+    # Версии удаленного опроса остаются для уже собранных ответов, но по ним
+    # больше нельзя начать опрос
+    ensure_column(cursor, "survey_versions", "retired", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_version_questions (
+            version_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            question_id INTEGER,
+            question TEXT NOT NULL,
+            PRIMARY KEY (version_id, position)
+        )
+    ''')
+    for table in ("questions", "survey_version_questions"):
+        ensure_column(cursor, table, "qtype", f"TEXT NOT NULL DEFAULT '{QTYPE_TEXT}'")
+        ensure_column(cursor, table, "options", "TEXT")
+    # Счетчики голосов по вариантам ответа. Обновляются по мере прохождения
+    # опросов, поэтому итоги не требуют пересчета сырых ответов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS choice_tallies (
+            version_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            votes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (version_id, position, option_index, chat_id)
+        )
+    ''')
+    # Живые итоги: включаются для опроса отдельно и публикуются в группе
+    # отдельным закрепленным сообщением, которое бот периодически обновляет
+    ensure_column(cursor, "surveys", "live_results", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS completion_counts (
+            version_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (version_id, chat_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS live_messages (
+            survey_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            version_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (survey_id, chat_id)
+        )
+    ''')
+    # Правки итогов согласуются между воркерами через базу: dirty — в опросе есть
+    # новые ответы, edited_at — когда в чате последний раз менялись итоги
+    ensure_column(cursor, "live_messages", "dirty", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS live_chats (
+            chat_id INTEGER PRIMARY KEY,
+            edited_at REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    # Отложенные задачи планировщика (публикации опросов, напоминания)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            run_at REAL NOT NULL,
+            payload TEXT,
+            job_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at INTEGER NOT NULL,
+            finished_at INTEGER
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (job_key)")
+    # Анкеты и ответы на них. Ответы дописываются по одному по мере прохождения
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            survey_id INTEGER NOT NULL,
+            version_id INTEGER NOT NULL,
+            group_id INTEGER,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            status TEXT NOT NULL DEFAULT 'draft',
+            started_at INTEGER NOT NULL,
+            completed_at INTEGER
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user ON submissions (user_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_survey ON submissions (survey_id, status, completed_at)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submission_answers (
+            submission_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            answer TEXT,
+            choices TEXT,
+            PRIMARY KEY (submission_id, position)
+        )
+    ''')
+    # Порядковый номер завершения: курсор инкрементальной выгрузки (идентификатор
+    # анкеты для этого не годится — он выдается при старте, а не при завершении)
+    if ensure_column(cursor, "submissions", "completed_seq", "INTEGER"):
+        cursor.execute("UPDATE submissions SET completed_seq = id WHERE status = 'complete'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_seq ON submissions (survey_id, completed_seq)")
+    # Поиск уже пройденной версии опроса при вступлении пользователя в очередную группу
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_completed ON submissions (user_id, version_id) "
+        "WHERE status = 'complete'"
+    )
+    # Группы, в которые пользователь вступил с уже заполненной анкетой
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submission_groups (
+            submission_id INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            linked_at INTEGER NOT NULL,
+            PRIMARY KEY (submission_id, group_id)
+        )
+    ''')
+    # Отборы администратора по роли и региону идут по индексам, без разбора ответов
+    for facet in FACETS:
+        ensure_column(cursor, "submissions", facet, "TEXT")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_submissions_{facet} ON submissions (survey_id, {facet}) "
+            "WHERE status = 'complete'"
+        )
     conn.commit()
     conn.close()
     ensure_initial_survey_exists()
 
 def ensure_initial_survey_exists():
     if not survey_exists("первичный"):
-        survey_id = add_survey("первичный")
         questions = [
             "Кто вы? (самозанятый, ИП, в найме, собственник)",
             "Откуда вы? (регион деятельности)",
@@ -48,33 +290,88 @@ def ensure_initial_survey_exists():
             "Возможная польза для участников сообщества",
             "Что-то от себя/ пожелания/ предложения и прочее"
         ]
-        for question in questions:
-            add_question(survey_id, question)
+        with unit_of_work() as cursor:
+            survey_id = insert_survey(cursor, "первичный", [(question, QTYPE_TEXT, None) for question in questions])
+        publish_survey_version(survey_id)
 
 def add_group(group_id, title):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT OR IGNORE INTO groups (id, title) VALUES (?, ?)", (group_id, title))
     conn.commit()
     conn.close()
 
 def remove_group(group_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM groups WHERE id = ?", (group_id,))
     conn.commit()
     conn.close()
 
+def set_group_status(group_id, status, title=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO groups (id, title, status, failures) VALUES (?, ?, ?, 0)
+        ON CONFLICT(id) DO UPDATE SET
+            status = excluded.status,
+            failures = 0,
+            title = COALESCE(excluded.title, groups.title)
+    ''', (group_id, title, status))
+    conn.commit()
+    conn.close()
+
+def update_group_title(group_id, title):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE groups SET title = ? WHERE id = ?", (title, group_id))
+    conn.commit()
+    conn.close()
+
+def migrate_group(old_id, new_id):
+    # Группа превратилась в супергруппу и получила новый идентификатор
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM groups WHERE id = ?", (new_id,))
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM groups WHERE id = ?", (old_id,))
+    else:
+        cursor.execute("UPDATE groups SET id = ? WHERE id = ?", (new_id, old_id))
+    cursor.execute("UPDATE OR REPLACE pending_users SET chat_id = ? WHERE chat_id = ?", (new_id, old_id))
+    conn.commit()
+    conn.close()
+
+def record_group_failure(group_id):
+    # Возвращает True, если группа только что была исключена из рассылок
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE groups SET failures = failures + 1 WHERE id = ?", (group_id,))
+    cursor.execute(
+        "UPDATE groups SET status = ? WHERE id = ? AND status = ? AND failures >= ?",
+        (GROUP_PARKED, group_id, GROUP_ACTIVE, GROUP_FAILURE_THRESHOLD)
+    )
+    parked = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return parked
+
+def reset_group_failures(group_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE groups SET failures = 0 WHERE id = ? AND failures > 0", (group_id,))
+    conn.commit()
+    conn.close()
+
 def get_all_groups():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM groups")
+    cursor.execute("SELECT id, title FROM groups WHERE status = ?", (GROUP_ACTIVE,))
     groups = cursor.fetchall()
     conn.close()
     return groups
 
 def survey_exists(survey_name):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM surveys WHERE name = ?", (survey_name,))
     exists = cursor.fetchone() is not None
@@ -82,7 +379,7 @@ def survey_exists(survey_name):
     return exists
 
 def add_survey(survey_name):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO surveys (name) VALUES (?)", (survey_name,))
     conn.commit()
@@ -90,23 +387,45 @@ def add_survey(survey_name):
     conn.close()
     return survey_id
 
-def add_question(survey_id, question):
-    conn = sqlite3.connect(DB_FILE)
+def dump_options(options):
+    return json.dumps(list(options), ensure_ascii=False) if options else None
+
+def insert_survey(cursor, survey_name, questions):
+    # Опрос со всеми вопросами в рамках транзакции unit_of_work().
+    # questions: кортежи (текст, тип, варианты)
+    cursor.execute("INSERT INTO surveys (name) VALUES (?)", (survey_name,))
+    survey_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO questions (survey_id, question, qtype, options) VALUES (?, ?, ?, ?)",
+        [(survey_id, question, qtype, dump_options(options)) for question, qtype, options in questions]
+    )
+    return survey_id
+
+def add_question(survey_id, question, qtype=QTYPE_TEXT, options=None):
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO questions (survey_id, question) VALUES (?, ?)", (survey_id, question))
+    cursor.execute(
+        "INSERT INTO questions (survey_id, question, qtype, options) VALUES (?, ?, ?, ?)",
+        (survey_id, question, qtype, dump_options(options))
+    )
+    cursor.execute("UPDATE surveys SET draft_dirty = 1 WHERE id = ?", (survey_id,))
     conn.commit()
     conn.close()
 
 def delete_survey_by_id(survey_id):
-    conn = sqlite3.connect(DB_FILE)
+    # Все три изменения фиксируются одной транзакцией
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM surveys WHERE id = ?", (survey_id,))
     cursor.execute("DELETE FROM questions WHERE survey_id = ?", (survey_id,))
+    cursor.execute("UPDATE survey_versions SET retired = 1 WHERE survey_id = ?", (survey_id,))
     conn.commit()
     conn.close()
+    for version_id in [version_id for version_id, version in version_cache.items() if version[0] == survey_id]:
+        version_cache.pop(version_id, None)
 
 def get_all_surveys():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM surveys")
     surveys = [row[0] for row in cursor.fetchall()]
@@ -114,7 +433,7 @@ def get_all_surveys():
     return surveys
 
 def get_survey_id_by_name(survey_name):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM surveys WHERE name = ?", (survey_name,))
     result = cursor.fetchone()
@@ -122,7 +441,7 @@ def get_survey_id_by_name(survey_name):
     return result[0] if result else None
 
 def get_survey_name_by_id(survey_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM surveys WHERE id = ?", (survey_id,))
     result = cursor.fetchone()
@@ -130,7 +449,7 @@ def get_survey_name_by_id(survey_id):
     return result[0] if result else None
 
 def get_questions_by_survey(survey_id, include_ids=False):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     if include_ids:
         cursor.execute("SELECT id, question FROM questions WHERE survey_id = ? ORDER BY id ASC", (survey_id,))
@@ -140,15 +459,66 @@ def get_questions_by_survey(survey_id, include_ids=False):
     conn.close()
     return questions
 
+def like_prefix(prefix):
+    # Экранируем спецсимволы LIKE, чтобы префикс искался буквально
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+def fetch_keyset_page(cursor, query, conditions, params, after_id=0, before_id=0, limit=10):
+    # Постраничная выборка по id без OFFSET: каждая страница читается по индексу
+    # от границы предыдущей. Возвращает (строки, есть_предыдущая, есть_следующая)
+    if before_id:
+        conditions = conditions + ["id < ?"]
+        params = list(params) + [before_id]
+        order = "DESC"
+    else:
+        conditions = conditions + ["id > ?"]
+        params = list(params) + [after_id]
+        order = "ASC"
+    cursor.execute(
+        f"{query} WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT ?",
+        params + [limit + 1],
+    )
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before_id:
+        rows.reverse()
+        return rows, has_more, True
+    return rows, bool(after_id), has_more
+
+def get_surveys_page(after_id=0, before_id=0, prefix=None, limit=10):
+    conn = get_connection()
+    cursor = conn.cursor()
+    conditions, params = [], []
+    if prefix:
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        params.append(like_prefix(prefix))
+    page = fetch_keyset_page(cursor, "SELECT id, name FROM surveys", conditions, params, after_id, before_id, limit)
+    conn.close()
+    return page
+
+def get_questions_page(survey_id, after_id=0, before_id=0, limit=10):
+    conn = get_connection()
+    cursor = conn.cursor()
+    page = fetch_keyset_page(
+        cursor, "SELECT id, question FROM questions", ["survey_id = ?"], [survey_id], after_id, before_id, limit
+    )
+    conn.close()
+    return page
+
 def add_user_to_pending(user_id, chat_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO pending_users (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
+    cursor.execute(
+        "INSERT OR IGNORE INTO pending_users (user_id, chat_id, joined_at) VALUES (?, ?, ?)",
+        (user_id, chat_id, int(time.time()))
+    )
     conn.commit()
     conn.close()
 
 def is_user_pending(user_id, chat_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM pending_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
     result = cursor.fetchone() is not None
@@ -156,14 +526,35 @@ def is_user_pending(user_id, chat_id):
     return result
 
 def remove_user_from_pending(user_id, chat_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM pending_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
     conn.commit()
     conn.close()
 
+def remove_user_from_pending_many(user_id, chat_ids):
+    # Одна транзакция на все чаты пользователя
+    if not chat_ids:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "DELETE FROM pending_users WHERE user_id = ? AND chat_id = ?",
+        [(user_id, chat_id) for chat_id in chat_ids]
+    )
+    conn.commit()
+    conn.close()
+
+def get_all_pending_users():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, chat_id, joined_at FROM pending_users")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
 def get_pending_chats_for_user(user_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT chat_id FROM pending_users WHERE user_id = ?", (user_id,))
     chats = [row[0] for row in cursor.fetchall()]
@@ -171,7 +562,7 @@ def get_pending_chats_for_user(user_id):
     return chats
 
 def get_group_info_by_chat_id(chat_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, title FROM groups WHERE id = ?", (chat_id,))
     result = cursor.fetchone()
@@ -181,29 +572,726 @@ def get_group_info_by_chat_id(chat_id):
 # Новые функции для редактирования опросов и вопросов
 
 def update_survey_name(survey_id, new_name):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE surveys SET name = ? WHERE id = ?", (new_name, survey_id))
     conn.commit()
     conn.close()
 
-def update_question_text(question_id, new_text):
-    conn = sqlite3.connect(DB_FILE)
+def update_question_text(question_id, new_text, qtype=QTYPE_TEXT, options=None):
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE questions SET question = ? WHERE id = ?", (new_text, question_id))
+    cursor.execute(
+        "UPDATE questions SET question = ?, qtype = ?, options = ? WHERE id = ?",
+        (new_text, qtype, dump_options(options), question_id)
+    )
+    mark_question_survey_dirty(cursor, question_id)
     conn.commit()
     conn.close()
 
 def delete_question_by_id(question_id):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
+    mark_question_survey_dirty(cursor, question_id)
     cursor.execute("DELETE FROM questions WHERE id = ?", (question_id,))
     conn.commit()
     conn.close()
 
-def add_question_to_survey(survey_id, question_text):
-    conn = sqlite3.connect(DB_FILE)
+def add_question_to_survey(survey_id, question_text, qtype=QTYPE_TEXT, options=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO questions (survey_id, question, qtype, options) VALUES (?, ?, ?, ?)",
+        (survey_id, question_text, qtype, dump_options(options))
+    )
+    cursor.execute("UPDATE surveys SET draft_dirty = 1 WHERE id = ?", (survey_id,))
+    conn.commit()
+    conn.close()
+
+def mark_question_survey_dirty(cursor, question_id):
+    cursor.execute(
+        "UPDATE surveys SET draft_dirty = 1 WHERE id = (SELECT survey_id FROM questions WHERE id = ?)",
+        (question_id,)
+    )
+
+# Версии опросов
+
+def publish_survey_version(survey_id):
+    # Снимок текущих вопросов опроса. Если черновик не менялся с прошлой
+    # публикации, возвращается последняя версия без новой записи
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Обычный случай (вызывается на каждое вступление): черновик не менялся, и
+    # версия находится простым чтением, без блокировки записи для всех воркеров
+    cursor.execute(
+        "SELECT s.draft_dirty, (SELECT id FROM survey_versions WHERE survey_id = s.id ORDER BY version DESC LIMIT 1) "
+        "FROM surveys s WHERE s.id = ?",
+        (survey_id,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        conn.close()
+        return None
+    if not row[0] and row[1] is not None:
+        conn.close()
+        return row[1]
+
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT draft_dirty FROM surveys WHERE id = ?", (survey_id,))
+    row = cursor.fetchone()
+    if row is None:
+        conn.rollback()
+        conn.close()
+        return None
+    cursor.execute(
+        "SELECT id, version FROM survey_versions WHERE survey_id = ? ORDER BY version DESC LIMIT 1",
+        (survey_id,)
+    )
+    latest = cursor.fetchone()
+    if latest and not row[0]:
+        conn.rollback()
+        conn.close()
+        return latest[0]
+
+    cursor.execute(
+        "SELECT id, question, qtype, options FROM questions WHERE survey_id = ? ORDER BY id ASC",
+        (survey_id,)
+    )
+    questions = cursor.fetchall()
+    if latest:
+        cursor.execute(
+            "SELECT question_id, question, qtype, options FROM survey_version_questions "
+            "WHERE version_id = ? ORDER BY position",
+            (latest[0],)
+        )
+        if cursor.fetchall() == questions:
+            cursor.execute("UPDATE surveys SET draft_dirty = 0 WHERE id = ?", (survey_id,))
+            conn.commit()
+            conn.close()
+            return latest[0]
+
+    cursor.execute(
+        "INSERT INTO survey_versions (survey_id, version, created_at) VALUES (?, ?, ?)",
+        (survey_id, latest[1] + 1 if latest else 1, int(time.time()))
+    )
+    version_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO survey_version_questions (version_id, position, question_id, question, qtype, options) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(version_id, position, *question) for position, question in enumerate(questions)]
+    )
+    cursor.execute("UPDATE surveys SET draft_dirty = 0 WHERE id = ?", (survey_id,))
+    conn.commit()
+    conn.close()
+    return version_id
+
+def get_latest_version_id(survey_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id FROM survey_versions WHERE survey_id = ? AND retired = 0 ORDER BY version DESC LIMIT 1",
+        (survey_id,)
+    )
+    result = cursor.fetchone()
+    conn.close()
+    if result:
+        return result[0]
+    # Опрос еще ни разу не публиковался
+    return publish_survey_version(survey_id)
+
+# Версия после создания не меняется; из кэша ее убирает только удаление опроса
+version_cache = {}
+
+def get_survey_version(version_id):
+    cached = version_cache.get(version_id)
+    if cached is not None:
+        return cached
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT survey_id, version FROM survey_versions WHERE id = ? AND retired = 0", (version_id,))
+    header = cursor.fetchone()
+    if header is None:
+        conn.close()
+        return None
+    cursor.execute(
+        "SELECT question, qtype, options FROM survey_version_questions WHERE version_id = ? ORDER BY position",
+        (version_id,)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    questions = tuple(row[0] for row in rows)
+    # Для каждого вопроса: (тип, варианты ответа)
+    layout = tuple((qtype, tuple(json.loads(options)) if options else ()) for question, qtype, options in rows)
+    version = version_cache[version_id] = (header[0], header[1], questions, layout)
+    return version
+
+def record_choice_votes(version_id, chat_id, votes):
+    # votes: пары (позиция вопроса, индекс варианта) одной завершенной анкеты
+    if not votes:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO choice_tallies (version_id, position, option_index, chat_id, votes) VALUES (?, ?, ?, ?, 1) "
+        "ON CONFLICT (version_id, position, option_index, chat_id) DO UPDATE SET votes = votes + 1",
+        [(version_id, position, option_index, chat_id) for position, option_index in votes]
+    )
+    conn.commit()
+    conn.close()
+
+def get_choice_tallies(version_id, chat_id=None):
+    # {(позиция, индекс варианта): голоса} по всем группам или по одной
+    with read_snapshot() as cursor:
+        if chat_id is None:
+            cursor.execute(
+                "SELECT position, option_index, SUM(votes) FROM choice_tallies WHERE version_id = ? "
+                "GROUP BY position, option_index",
+                (version_id,)
+            )
+        else:
+            cursor.execute(
+                "SELECT position, option_index, votes FROM choice_tallies WHERE version_id = ? AND chat_id = ?",
+                (version_id, chat_id)
+            )
+        return {(position, option_index): votes for position, option_index, votes in cursor.fetchall()}
+
+
+def record_completion(version_id, chat_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO completion_counts (version_id, chat_id, completed) VALUES (?, ?, 1) "
+        "ON CONFLICT (version_id, chat_id) DO UPDATE SET completed = completed + 1",
+        (version_id, chat_id)
+    )
+    conn.commit()
+    conn.close()
+
+def get_completion_count(version_id, chat_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT completed FROM completion_counts WHERE version_id = ? AND chat_id = ?",
+        (version_id, chat_id)
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result else 0
+
+def is_live_results_enabled(survey_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT live_results FROM surveys WHERE id = ?", (survey_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return bool(result and result[0])
+
+def set_live_results_enabled(survey_id, enabled):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE surveys SET live_results = ? WHERE id = ?", (int(enabled), survey_id))
+    conn.commit()
+    conn.close()
+
+def get_live_message(survey_id, chat_id):
+    # (version_id, message_id) сообщения с живыми итогами или None
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT version_id, message_id FROM live_messages WHERE survey_id = ? AND chat_id = ?",
+        (survey_id, chat_id)
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+def save_live_message(survey_id, chat_id, version_id, message_id):
+    # Новое сообщение с итогами считается правкой в чате
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO live_messages (survey_id, chat_id, version_id, message_id) VALUES (?, ?, ?, ?)",
+        (survey_id, chat_id, version_id, message_id)
+    )
+    cursor.execute("INSERT OR REPLACE INTO live_chats (chat_id, edited_at) VALUES (?, ?)", (chat_id, time.time()))
+    conn.commit()
+    conn.close()
+
+def mark_live_refresh(survey_id, chat_id):
+    # Отмечает итоги опроса в чате как устаревшие. Возвращает время последней
+    # правки в чате или None, если сообщения с итогами нет
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE live_messages SET dirty = 1 WHERE survey_id = ? AND chat_id = ?", (survey_id, chat_id))
+    marked = cursor.rowcount
+    conn.commit()
+    edited_at = None
+    if marked:
+        cursor.execute("SELECT edited_at FROM live_chats WHERE chat_id = ?", (chat_id,))
+        result = cursor.fetchone()
+        edited_at = result[0] if result else 0.0
+    conn.close()
+    return edited_at
+
+def claim_live_refresh(chat_id, now, interval=None):
+    # Забирает устаревшие итоги чата для правки: (None, [(survey_id, version_id, message_id)]).
+    # Если с последней правки в чате (в любом воркере) прошло меньше interval,
+    # ничего не забирает и возвращает (время, когда можно повторить, []).
+    # Проверка и отметка идут под блокировкой записи, поэтому правку забирает один воркер
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT edited_at FROM live_chats WHERE chat_id = ?", (chat_id,))
+    result = cursor.fetchone()
+    if interval is not None and result and now < result[0] + interval:
+        conn.rollback()
+        conn.close()
+        return result[0] + interval, []
+    cursor.execute(
+        "SELECT survey_id, version_id, message_id FROM live_messages WHERE chat_id = ? AND dirty = 1",
+        (chat_id,)
+    )
+    live = cursor.fetchall()
+    if live:
+        cursor.execute("UPDATE live_messages SET dirty = 0 WHERE chat_id = ?", (chat_id,))
+        cursor.execute("INSERT OR REPLACE INTO live_chats (chat_id, edited_at) VALUES (?, ?)", (chat_id, now))
+    conn.commit()
+    conn.close()
+    return None, live
+
+def delete_live_message(survey_id, chat_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM live_messages WHERE survey_id = ? AND chat_id = ?", (survey_id, chat_id))
+    conn.commit()
+    conn.close()
+
+# Анкеты
+
+def start_submission(user_id, survey_id, version_id, group_id, first_name=None, last_name=None, username=None):
+    # У пользователя один активный черновик: начатые ранее анкеты считаются брошенными
+    with unit_of_work() as cursor:
+        cursor.execute(
+            "UPDATE submissions SET status = ? WHERE user_id = ? AND status = ?",
+            (SUBMISSION_ABANDONED, user_id, SUBMISSION_DRAFT)
+        )
+        cursor.execute(
+            "INSERT INTO submissions (user_id, survey_id, version_id, group_id, first_name, last_name, username, started_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, survey_id, version_id, group_id, first_name, last_name, username, int(time.time()))
+        )
+        return cursor.lastrowid
+
+def save_answers(answers):
+    # answers: кортежи (submission_id, позиция, ответ, индексы вариантов или None)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO submission_answers (submission_id, position, answer, choices) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (submission_id, position) DO UPDATE SET answer = excluded.answer, choices = excluded.choices",
+        [
+            (submission_id, position, answer, json.dumps(choices) if choices is not None else None)
+            for submission_id, position, answer, choices in answers
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+def complete_submission(submission_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Запись в базу идет по одной транзакции за раз, поэтому номера возрастают в порядке фиксации
+    cursor.execute(
+        "UPDATE submissions SET status = ?, completed_at = ?, "
+        "completed_seq = (SELECT COALESCE(MAX(completed_seq), 0) + 1 FROM submissions) "
+        "WHERE id = ? AND status = ?",
+        (SUBMISSION_COMPLETE, int(time.time()), submission_id, SUBMISSION_DRAFT)
+    )
+    completed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return bool(completed)
+
+def get_draft_submission(user_id):
+    # Последний черновик пользователя: (id, survey_id, version_id, group_id, ответы) или None,
+    # ответы — кортежи (позиция, ответ, индексы вариантов) по порядку
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, survey_id, version_id, group_id FROM submissions "
+        "WHERE user_id = ? AND status = ? ORDER BY id DESC LIMIT 1",
+        (user_id, SUBMISSION_DRAFT)
+    )
+    draft = cursor.fetchone()
+    if draft is None:
+        conn.close()
+        return None
+    cursor.execute(
+        "SELECT position, answer, choices FROM submission_answers WHERE submission_id = ? ORDER BY position",
+        (draft[0],)
+    )
+    answers = [(position, answer, json.loads(choices) if choices else None) for position, answer, choices in cursor.fetchall()]
+    conn.close()
+    return draft + (answers,)
+
+def find_completed_submission(user_id, version_id):
+    # Условие status = 'complete' совпадает с частичным индексом idx_submissions_completed
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO questions (survey_id, question) VALUES (?, ?)", (survey_id, question_text))
+    cursor.execute(
+        "SELECT id FROM submissions WHERE user_id = ? AND version_id = ? AND status = 'complete' "
+        "ORDER BY id DESC LIMIT 1",
+        (user_id, version_id)
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+def link_submission_to_group(submission_id, group_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR IGNORE INTO submission_groups (submission_id, group_id, linked_at) VALUES (?, ?, ?)",
+        (submission_id, group_id, int(time.time()))
+    )
     conn.commit()
     conn.close()
+
+def get_facet_sources(survey_name, positions, submission_id=None):
+    # Ответы на вопросы-фасеты у завершенных анкет опроса, еще не разобранных
+    # по фасетам: {submission_id: {позиция: ответ}}
+    conn = get_connection()
+    cursor = conn.cursor()
+    query = (
+        "SELECT s.id, a.position, a.answer FROM submissions s "
+        "JOIN surveys v ON v.id = s.survey_id "
+        "LEFT JOIN submission_answers a ON a.submission_id = s.id "
+        f"AND a.position IN ({','.join('?' * len(positions))}) "
+        "WHERE v.name = ? AND s.status = 'complete' AND s.role IS NULL"
+    )
+    params = [*positions, survey_name]
+    if submission_id is not None:
+        query += " AND s.id = ?"
+        params.append(submission_id)
+    cursor.execute(query, params)
+    sources = {}
+    for source_id, position, answer in cursor.fetchall():
+        answers = sources.setdefault(source_id, {})
+        if position is not None:
+            answers[position] = answer
+    conn.close()
+    return sources
+
+def set_submission_facets(facets):
+    # facets: кортежи (submission_id, {фасет: значение})
+    with unit_of_work() as cursor:
+        for submission_id, values in facets:
+            columns = [facet for facet in FACETS if facet in values]
+            cursor.execute(
+                f"UPDATE submissions SET {', '.join(f'{facet} = ?' for facet in columns)} WHERE id = ?",
+                [values[facet] for facet in columns] + [submission_id]
+            )
+
+# Участники опроса по последней завершенной анкете каждого пользователя: строка на
+# группу, где анкета заполнена, и на группы, куда пользователь вступил с ней позже
+FACET_MEMBERS_QUERY = '''
+    SELECT s.user_id, s.first_name, s.last_name, s.username, s.role, s.region, s.group_id
+    FROM submissions s WHERE {where}
+    UNION
+    SELECT s.user_id, s.first_name, s.last_name, s.username, s.role, s.region, g.group_id
+    FROM submissions s JOIN submission_groups g ON g.submission_id = s.id WHERE {where}
+'''
+
+def get_facet_report(survey_id, filters, group_id=None, member_limit=30):
+    # Сводка по фасетам из одного снимка базы. filters: {фасет: значение}.
+    # Без фильтров — число участников по каждому значению фасетов, с фильтрами —
+    # распределение отобранных по группам и список участников
+    where = (
+        "s.survey_id = ? AND s.status = 'complete' AND NOT EXISTS ("
+        "SELECT 1 FROM submissions n WHERE n.user_id = s.user_id AND n.status = 'complete' "
+        "AND n.survey_id = s.survey_id AND n.id > s.id)"
+    )
+    params = [survey_id]
+    for facet in FACETS:
+        if facet in filters:
+            where += f" AND s.{facet} = ?"
+            params.append(filters[facet])
+    members = f"({FACET_MEMBERS_QUERY.format(where=where)})"
+    params = params * 2
+    outer = ""
+    if group_id is not None:
+        outer = " WHERE m.group_id = ?"
+        params.append(group_id)
+
+    report = {}
+    with read_snapshot() as cursor:
+        cursor.execute(f"SELECT COUNT(DISTINCT m.user_id) FROM {members} m{outer}", params)
+        report['total'] = cursor.fetchone()[0]
+        for facet in FACETS:
+            cursor.execute(
+                f"SELECT m.{facet}, COUNT(DISTINCT m.user_id) AS members FROM {members} m{outer} "
+                f"GROUP BY m.{facet} ORDER BY members DESC, m.{facet}",
+                params
+            )
+            report[facet] = cursor.fetchall()
+        cursor.execute(
+            f"SELECT m.group_id, g.title, COUNT(DISTINCT m.user_id) AS members FROM {members} m "
+            f"LEFT JOIN groups g ON g.id = m.group_id{outer} GROUP BY m.group_id ORDER BY members DESC",
+            params
+        )
+        report['groups'] = cursor.fetchall()
+        cursor.execute(
+            f"SELECT m.user_id, m.first_name, m.last_name, m.username, m.role, m.region FROM {members} m{outer} "
+            "GROUP BY m.user_id ORDER BY m.first_name, m.user_id LIMIT ?",
+            params + [member_limit]
+        )
+        report['members'] = cursor.fetchall()
+    return report
+
+SUBMISSION_ROWS_QUERY = '''
+    SELECT s.id, s.user_id, s.first_name, s.last_name, s.username, s.group_id, g.title,
+           s.completed_at, v.version, q.question, a.answer
+    FROM submissions s
+    JOIN survey_versions v ON v.id = s.version_id
+    JOIN submission_answers a ON a.submission_id = s.id
+    LEFT JOIN survey_version_questions q ON q.version_id = s.version_id AND q.position = a.position
+    LEFT JOIN groups g ON g.id = s.group_id
+'''
+
+def get_submission_rows(survey_id, completed_before=None):
+    # Ответы завершенных анкет опроса построчно, в порядке завершения
+    query = SUBMISSION_ROWS_QUERY + " WHERE s.survey_id = ? AND s.status = ?"
+    params = [survey_id, SUBMISSION_COMPLETE]
+    if completed_before is not None:
+        query += " AND s.completed_at < ?"
+        params.append(int(completed_before))
+    with read_snapshot() as cursor:
+        cursor.execute(query + " ORDER BY s.completed_at, s.id, a.position", params)
+        return cursor.fetchall()
+
+def get_survey_list():
+    # (id, название) всех опросов
+    with read_snapshot() as cursor:
+        cursor.execute("SELECT id, name FROM surveys ORDER BY id")
+        return cursor.fetchall()
+
+def get_submissions_since(survey_id, since=0, limit=500):
+    # Страница завершенных анкет после курсора since (по completed_seq) для внешней
+    # выгрузки. Все запросы страницы читают один снимок базы. Возвращает список словарей
+    with read_snapshot() as cursor:
+        return select_submissions_since(cursor, survey_id, since, limit)
+
+def select_submissions_since(cursor, survey_id, since, limit):
+    cursor.execute(
+        "SELECT s.id, s.completed_seq, s.user_id, s.first_name, s.last_name, s.username, s.group_id, "
+        "s.completed_at, s.version_id, v.version FROM submissions s "
+        "JOIN survey_versions v ON v.id = s.version_id "
+        "WHERE s.survey_id = ? AND s.completed_seq > ? ORDER BY s.completed_seq LIMIT ?",
+        (survey_id, since, limit)
+    )
+    columns = [column[0] for column in cursor.description]
+    submissions = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    if not submissions:
+        return []
+    by_id = {submission['id']: submission for submission in submissions}
+    for submission in submissions:
+        submission['answers'] = []
+        submission['linked_groups'] = []
+    placeholders = ",".join("?" * len(by_id))
+    cursor.execute(
+        "SELECT a.submission_id, a.position, q.question, a.answer FROM submission_answers a "
+        "JOIN submissions s ON s.id = a.submission_id "
+        "LEFT JOIN survey_version_questions q ON q.version_id = s.version_id AND q.position = a.position "
+        f"WHERE a.submission_id IN ({placeholders}) ORDER BY a.submission_id, a.position",
+        list(by_id)
+    )
+    for submission_id, position, question, answer in cursor.fetchall():
+        by_id[submission_id]['answers'].append({'position': position, 'question': question, 'answer': answer})
+    cursor.execute(
+        f"SELECT submission_id, group_id FROM submission_groups WHERE submission_id IN ({placeholders})",
+        list(by_id)
+    )
+    for submission_id, group_id in cursor.fetchall():
+        by_id[submission_id]['linked_groups'].append(group_id)
+    return submissions
+
+def get_surveys_with_submissions(completed_before):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT DISTINCT s.survey_id, v.name FROM submissions s JOIN surveys v ON v.id = s.survey_id "
+        "WHERE s.status = ? AND s.completed_at < ?",
+        (SUBMISSION_COMPLETE, int(completed_before))
+    )
+    result = cursor.fetchall()
+    conn.close()
+    return result
+
+def delete_submissions(submission_ids):
+    with unit_of_work() as cursor:
+        cursor.executemany("DELETE FROM submission_groups WHERE submission_id = ?", [(i,) for i in submission_ids])
+        cursor.executemany("DELETE FROM submission_answers WHERE submission_id = ?", [(i,) for i in submission_ids])
+        cursor.executemany("DELETE FROM submissions WHERE id = ?", [(i,) for i in submission_ids])
+
+# Отложенные задачи
+
+def add_jobs(jobs):
+    # jobs: кортежи (kind, run_at, payload, job_key)
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = int(time.time())
+    cursor.executemany(
+        "INSERT INTO jobs (kind, run_at, payload, job_key, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(kind, run_at, json.dumps(payload or {}), job_key, now) for kind, run_at, payload, job_key in jobs]
+    )
+    conn.commit()
+    conn.close()
+
+def add_job(kind, run_at, payload=None, job_key=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO jobs (kind, run_at, payload, job_key, created_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, run_at, json.dumps(payload or {}), job_key, int(time.time()))
+    )
+    job_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+def claim_due_jobs(now, limit):
+    # Забирает пачку наступивших задач, помечая их выполняемыми в той же транзакции
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        "SELECT id, kind, payload, attempts FROM jobs WHERE status = ? AND run_at <= ? ORDER BY run_at LIMIT ?",
+        (JOB_PENDING, now, limit)
+    )
+    jobs = [(job_id, kind, json.loads(payload), attempts) for job_id, kind, payload, attempts in cursor.fetchall()]
+    cursor.executemany(
+        "UPDATE jobs SET status = ?, attempts = attempts + 1 WHERE id = ?",
+        [(JOB_RUNNING, job[0]) for job in jobs]
+    )
+    conn.commit()
+    conn.close()
+    return jobs
+
+def finish_job(job_id, status=JOB_DONE, error=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE jobs SET status = ?, last_error = ?, finished_at = ? WHERE id = ?",
+        (status, error, int(time.time()), job_id)
+    )
+    conn.commit()
+    conn.close()
+
+def retry_job(job_id, run_at, error):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE jobs SET status = ?, run_at = ?, last_error = ? WHERE id = ?",
+        (JOB_PENDING, run_at, error, job_id)
+    )
+    conn.commit()
+    conn.close()
+
+def cancel_jobs(job_key=None, job_id=None):
+    # Отменяются только еще не начатые задачи
+    conn = get_connection()
+    cursor = conn.cursor()
+    if job_id is not None:
+        cursor.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (JOB_CANCELLED, int(time.time()), job_id, JOB_PENDING)
+        )
+    else:
+        cursor.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE job_key = ? AND status = ?",
+            (JOB_CANCELLED, int(time.time()), job_key, JOB_PENDING)
+        )
+    cancelled = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return cancelled
+
+def get_next_job_time():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(run_at) FROM jobs WHERE status = ?", (JOB_PENDING,))
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+def requeue_running_jobs():
+    # Задачи, прерванные остановкой процесса, выполняются повторно
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE jobs SET status = ? WHERE status = ?", (JOB_PENDING, JOB_RUNNING))
+    requeued = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return requeued
+
+def get_pending_jobs(kind, limit=20):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, run_at, payload FROM jobs WHERE status = ? AND kind = ? ORDER BY run_at LIMIT ?",
+        (JOB_PENDING, kind, limit)
+    )
+    jobs = [(job_id, run_at, json.loads(payload)) for job_id, run_at, payload in cursor.fetchall()]
+    conn.close()
+    return jobs
+
+# Обслуживание базы: очистка устаревших данных и сжатие файла
+
+def purge_stale_pending_users(older_than):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pending_users WHERE joined_at < ?", (int(older_than),))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+def purge_finished_jobs(older_than):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+        (JOB_DONE, JOB_FAILED, JOB_CANCELLED, int(older_than))
+    )
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+def purge_stale_drafts(older_than):
+    # Брошенные и давно не продолжавшиеся черновики вместе с их ответами
+    with unit_of_work() as cursor:
+        cursor.execute(
+            "SELECT id FROM submissions WHERE status IN (?, ?) AND started_at < ?",
+            (SUBMISSION_DRAFT, SUBMISSION_ABANDONED, int(older_than))
+        )
+        ids = [(row[0],) for row in cursor.fetchall()]
+        cursor.executemany("DELETE FROM submission_answers WHERE submission_id = ?", ids)
+        cursor.executemany("DELETE FROM submissions WHERE id = ?", ids)
+    return len(ids)
+
+def compact_db(max_pages=None):
+    # Первый запуск переводит базу в режим incremental auto_vacuum (нужен полный VACUUM),
+    # дальше освобожденные страницы возвращаются порциями без перестройки всего файла
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("VACUUM")
+    elif max_pages:
+        cursor.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+    else:
+        cursor.execute("PRAGMA incremental_vacuum").fetchall()
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
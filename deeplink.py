@@ -0,0 +1,66 @@
+import os
+import hmac
+import base64
+import struct
+import hashlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ключ подписи ссылок на опросы. По умолчанию выводится из токена бота, поэтому
+# одинаков во всех воркерах и не меняется между перезапусками
+DEEPLINK_SECRET = os.getenv('DEEPLINK_SECRET') or os.getenv('TELEGRAM_TOKEN', '')
+# Старые ссылки вида survey_<id>_<chat_id> (уже закрепленные в группах) проверяются по базе
+ACCEPT_LEGACY_DEEPLINKS = os.getenv('ACCEPT_LEGACY_DEEPLINKS', 'True').lower() == 'true'
+
+TOKEN_PREFIX = 's'
+# Версия опроса (uint32) и идентификатор чата (int64)
+TOKEN_PAYLOAD = struct.Struct('>Iq')
+TAG_SIZE = 8
+# base64url без выравнивания: 20 байт -> 27 символов, с префиксом 28 из допустимых 64
+TOKEN_LENGTH = len(TOKEN_PREFIX) + (TOKEN_PAYLOAD.size + TAG_SIZE) * 4 // 3 + 1
+
+secret_key = hashlib.sha256(b'deeplink:' + DEEPLINK_SECRET.encode()).digest()
+
+
+def sign(payload: bytes) -> bytes:
+    return hmac.new(secret_key, payload, hashlib.sha256).digest()[:TAG_SIZE]
+
+
+def make_survey_token(version_id, chat_id):
+    payload = TOKEN_PAYLOAD.pack(version_id, chat_id)
+    return TOKEN_PREFIX + base64.urlsafe_b64encode(payload + sign(payload)).decode().rstrip('=')
+
+
+def parse_survey_token(token):
+    # Проверка целиком в памяти: поддельная или поврежденная ссылка отклоняется
+    # до обращения к базе. Возвращает (version_id, chat_id) или None
+    if len(token) != TOKEN_LENGTH or not token.startswith(TOKEN_PREFIX):
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token[len(TOKEN_PREFIX):] + '=')
+    except ValueError:
+        return None
+    if len(raw) != TOKEN_PAYLOAD.size + TAG_SIZE:
+        return None
+    payload, tag = raw[:TOKEN_PAYLOAD.size], raw[TOKEN_PAYLOAD.size:]
+    if not hmac.compare_digest(tag, sign(payload)):
+        return None
+    return TOKEN_PAYLOAD.unpack(payload)
+
+
+def parse_legacy_survey_param(param):
+    # survey_<id>_<chat_id> -> (survey_id, chat_id) или None
+    if not ACCEPT_LEGACY_DEEPLINKS or not param.startswith('survey_'):
+        return None
+    parts = param.split('_', 2)
+    if len(parts) < 3:
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def survey_deep_link(bot_username, version_id, chat_id):
+    return f"https://t.me/{bot_username}?start={make_survey_token(version_id, chat_id)}"
@@ -0,0 +1,162 @@
+import os
+import re
+from aiogram import html
+from db_manager import FACETS, get_facet_sources, set_submission_facets, get_facet_report, get_survey_id_by_name
+
+# Свободные ответы анкеты при вступлении («Кто вы?», «Откуда вы?») приводятся
+# к единым значениям при завершении анкеты и хранятся в колонках submissions.
+# Позиции вопросов соответствуют ensure_initial_survey_exists
+FACET_SURVEY = os.getenv('FACET_SURVEY', "первичный")
+FACET_POSITIONS = {'role': 0, 'region': 1}
+# Сколько участников выводится в списке по команде /facets
+FACET_MEMBER_LIMIT = int(os.getenv('FACET_MEMBER_LIMIT', '30'))
+# Сколько значений фасета и групп выводится, остальные сворачиваются в одну строку
+FACET_TOP = int(os.getenv('FACET_TOP', '15'))
+
+FACET_TITLES = {'role': "Роль", 'region': "Регион"}
+FILTER_KEYS = {'role': 'role', 'роль': 'role', 'region': 'region', 'регион': 'region', 'group': 'group', 'группа': 'group'}
+
+NOT_SPECIFIED = ''
+ROLE_OTHER = "другое"
+# Роль определяется по первому узнаваемому слову ответа: точное слово или начало слова
+ROLE_RULES = [
+    ("самозанятый", {'нпд'}, ('самозан',)),
+    ("ИП", {'ип'}, ('индивидуальн', 'предпринимат')),
+    ("в найме", set(), ('найм', 'наем', 'сотрудник', 'работаю', 'наемн')),
+    ("собственник", set(), ('собственн', 'владел', 'учредител', 'основател')),
+]
+REGION_ALIASES = {
+    "москва": "Москва", "мск": "Москва",
+    "московская область": "Московская область", "московская обл": "Московская область",
+    "мо": "Московская область", "подмосковье": "Московская область",
+    "санкт петербург": "Санкт-Петербург", "спб": "Санкт-Петербург", "питер": "Санкт-Петербург",
+    "петербург": "Санкт-Петербург",
+    "ленинградская область": "Ленинградская область", "ленобласть": "Ленинградская область",
+    "екатеринбург": "Екатеринбург", "екб": "Екатеринбург",
+    "новосибирск": "Новосибирск", "нск": "Новосибирск",
+    "нижний новгород": "Нижний Новгород", "нн": "Нижний Новгород",
+    "россия": "Вся Россия", "рф": "Вся Россия", "вся россия": "Вся Россия", "по всей россии": "Вся Россия",
+}
+REGION_PREFIXES = {'г', 'город', 'гор'}
+REGION_MAX_LENGTH = 64
+
+WORD_RE = re.compile(r"[\w-]+")
+FILTER_RE = re.compile(r"(\w+)=", re.UNICODE)
+
+
+def words(text):
+    return WORD_RE.findall((text or "").lower().replace('ё', 'е'))
+
+
+def normalize_role(answer):
+    tokens = words(answer)
+    if not tokens:
+        return NOT_SPECIFIED
+    for token in tokens:
+        for role, exact, stems in ROLE_RULES:
+            if token in exact or token.startswith(stems):
+                return role
+    return ROLE_OTHER
+
+
+def normalize_region(answer):
+    tokens = [token.strip('-') for token in words(answer)]
+    tokens = [token for token in tokens if token]
+    while tokens and tokens[0] in REGION_PREFIXES:
+        tokens = tokens[1:]
+    if not tokens:
+        return NOT_SPECIFIED
+    cleaned = " ".join(tokens).replace('-', ' ')
+    if cleaned in REGION_ALIASES:
+        return REGION_ALIASES[cleaned]
+    # «Москва и область», «спб, лен. обл.» — по первому слову
+    if tokens[0] in REGION_ALIASES:
+        return REGION_ALIASES[tokens[0]]
+    region = " ".join(tokens)
+    return (region[:1].upper() + region[1:])[:REGION_MAX_LENGTH]
+
+
+NORMALIZERS = {'role': normalize_role, 'region': normalize_region}
+
+
+def index_facets(submission_id=None):
+    # Разбирает ответы завершенных анкет, у которых фасеты еще не заполнены: одну
+    # только что завершенную анкету или, без аргумента, все (при запуске бота).
+    # Пустой ответ сохраняется как '', чтобы анкета не разбиралась повторно
+    positions = [FACET_POSITIONS[facet] for facet in FACETS]
+    sources = get_facet_sources(FACET_SURVEY, positions, submission_id)
+    if not sources:
+        return 0
+    set_submission_facets([
+        (source_id, {facet: NORMALIZERS[facet](answers.get(FACET_POSITIONS[facet])) for facet in FACETS})
+        for source_id, answers in sources.items()
+    ])
+    return len(sources)
+
+
+def parse_facet_filters(text):
+    # "role=ИП region=нижний новгород group=-100123" -> ({фасет: значение}, group_id).
+    # Значения приводятся так же, как ответы, поэтому «мск» найдет «Москва»
+    filters, group_id = {}, None
+    parts = FILTER_RE.split(text or "")
+    if parts[0].strip():
+        raise ValueError(parts[0].strip())
+    for key, value in zip(parts[1::2], parts[2::2]):
+        name = FILTER_KEYS.get(key.lower())
+        value = value.strip()
+        if name is None or not value:
+            raise ValueError(f"{key}={value}")
+        if name == 'group':
+            group_id = int(value)
+        else:
+            filters[name] = NORMALIZERS[name](value)
+    return filters, group_id
+
+
+def facet_value(value):
+    return html.quote(value) if value else "не указано"
+
+
+def member_line(user_id, first_name, last_name, username, role, region):
+    name = html.quote(" ".join(part for part in (first_name, last_name) if part) or str(user_id))
+    mention = f" (@{html.quote(username)})" if username else ""
+    return f"• {name}{mention} — {facet_value(role)}, {facet_value(region)}"
+
+
+def top_lines(rows, render):
+    lines = [render(*row) for row in rows[:FACET_TOP]]
+    if len(rows) > FACET_TOP:
+        lines.append(f"… еще {len(rows) - FACET_TOP}")
+    return lines
+
+
+def facet_report_text(filters, group_id=None):
+    survey_id = get_survey_id_by_name(FACET_SURVEY)
+    if survey_id is None:
+        return f"Опрос '{html.quote(FACET_SURVEY)}' не найден."
+    report = get_facet_report(survey_id, filters, group_id, FACET_MEMBER_LIMIT)
+    conditions = [f"{FACET_TITLES[facet].lower()} «{facet_value(filters[facet])}»" for facet in FACETS if facet in filters]
+    if group_id is not None:
+        conditions.append(f"группа {group_id}")
+    header = f"Опрос '{html.quote(FACET_SURVEY)}'"
+    if conditions:
+        header += ", " + ", ".join(conditions)
+    lines = [f"<b>{header}</b>: участников — {report['total']}"]
+    if not report['total']:
+        return lines[0]
+    for facet in FACETS:
+        if facet in filters:
+            continue
+        lines.append(f"\n<b>{FACET_TITLES[facet]}</b>")
+        lines.extend(top_lines(report[facet], lambda value, members: f"• {facet_value(value)} — {members}"))
+    if group_id is None:
+        lines.append("\n<b>По группам</b>")
+        lines.extend(top_lines(
+            report['groups'], lambda chat_id, title, members: f"• {html.quote(title or str(chat_id))} — {members}"
+        ))
+    if filters or group_id is not None:
+        lines.append("\n<b>Участники</b>")
+        lines.extend(member_line(*member) for member in report['members'])
+        if report['total'] > len(report['members']):
+            lines.append(f"… и еще {report['total'] - len(report['members'])}")
+    return "\n".join(lines)
@@ -0,0 +1,72 @@
+import os
+import json
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Быстрый профиль: цикл событий uvloop и сериализация JSON через orjson (ответы
+# Bot API, FSM-хранилище, записи апдейтов, NDJSON-выгрузки). Оба пакета
+# необязательны: если какого-то нет, соответствующая часть работает как обычно
+FAST_PROFILE = os.getenv('FAST_PROFILE', 'False').lower() == 'true'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+USE_ORJSON = FAST_PROFILE and orjson is not None
+USE_UVLOOP = FAST_PROFILE and uvloop is not None
+
+
+def json_dumps(obj, default=None) -> str:
+    # Строка без экранирования не-ASCII символов, как json.dumps(..., ensure_ascii=False).
+    # Нестроковые ключи словарей (номера вопросов) приводятся к строкам, как в json
+    if USE_ORJSON:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, ensure_ascii=False, default=default)
+
+
+json_loads = orjson.loads if USE_ORJSON else json.loads
+
+
+def session_json_options():
+    # Параметры сессии aiogram; без orjson остаются кодеки aiogram по умолчанию
+    if USE_ORJSON:
+        return {'json_loads': json_loads, 'json_dumps': json_dumps}
+    return {}
+
+
+def install_event_loop():
+    # Вызывается до asyncio.run(): политика действует на все новые циклы событий процесса
+    if USE_UVLOOP:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return USE_UVLOOP
+
+
+def describe():
+    if not FAST_PROFILE:
+        return "off"
+    missing = [name for name, module in (('uvloop', uvloop), ('orjson', orjson)) if module is None]
+    parts = [
+        "uvloop" if USE_UVLOOP else "asyncio",
+        "orjson" if USE_ORJSON else "json",
+    ]
+    if missing:
+        parts.append(f"not installed: {', '.join(missing)}")
+    return ", ".join(parts)
+
+
+def log_profile():
+    if not FAST_PROFILE:
+        return
+    if uvloop is None or orjson is None:
+        logging.warning("Fast profile is incomplete: %s", describe())
+    else:
+        logging.info("Fast profile: %s", describe())
@@ -0,0 +1,67 @@
+import os
+import json
+import sqlite3
+from typing import Any, Dict, Mapping, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+FSM_DB_FILE = os.getenv('FSM_DB_FILE', "fsm.db")
+
+
+class SQLiteStorage(BaseStorage):
+    # Постоянное FSM-хранилище: состояние анкеты переживает перезапуск
+    # и доступно любому процессу-воркеру, работающему с тем же файлом
+    def __init__(self, path: str = FSM_DB_FILE, json_dumps=json.dumps, json_loads=json.loads):
+        self.path = path
+        self.json_dumps = json_dumps
+        self.json_loads = json_loads
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT
+            )
+        ''')
+
+    @staticmethod
+    def build_key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        if key.business_connection_id:
+            parts.append(key.business_connection_id)
+        parts.append(key.destiny)
+        return ':'.join(parts)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        self.conn.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self.build_key(key), state),
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self.conn.execute("SELECT state FROM fsm WHERE key = ?", (self.build_key(key),)).fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        payload = self.json_dumps(dict(data)) if data else None
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        self.conn.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self.build_key(key), payload),
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT data FROM fsm WHERE key = ?", (self.build_key(key),)).fetchone()
+        if not row or not row[0]:
+            return {}
+        return self.json_loads(row[0])
+
+    async def close(self) -> None:
+        self.conn.execute("DELETE FROM fsm WHERE state IS NULL AND data IS NULL")
+        self.conn.close()
@@ -1,22 +1,41 @@
 import os
+import time
 import logging
 import asyncio
 from aiogram import Router, Bot, F, Dispatcher
-from aiogram.types import Message, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from aiogram.enums import ChatMemberStatus
+from aiogram.types import Message, ChatMemberUpdated, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramMigrateToChat
 from db_manager import (
     get_survey_id_by_name,
+    publish_survey_version,
     add_user_to_pending,
     is_user_pending,
     remove_user_from_pending,
+    remove_user_from_pending_many,
     get_pending_chats_for_user,
-    add_group
+    get_all_pending_users,
+    find_completed_submission,
+    link_submission_to_group,
+    add_group,
+    set_group_status,
+    update_group_title,
+    migrate_group,
+    record_group_failure,
+    reset_group_failures,
+    GROUP_ACTIVE,
+    GROUP_LEFT,
 )
+from deeplink import survey_deep_link
 from dotenv import load_dotenv
 
 load_dotenv()
 ENABLE_CAPTCHA = os.getenv('ENABLE_CAPTCHA', 'False').lower() == 'true'
 CAPTCHA_TIMEOUT = int(os.getenv('CAPTCHA_TIMEOUT', '5'))  # В минутах
+# Пользователь, уже заполнивший текущую версию приветственного опроса в другой группе,
+# не получает его повторно; его анкета привязывается к новой группе
+REUSE_PRIMARY_SUBMISSION = os.getenv('REUSE_PRIMARY_SUBMISSION', 'True').lower() == 'true'
+LINK_REUSED_SUBMISSION = os.getenv('LINK_REUSED_SUBMISSION', 'True').lower() == 'true'
 
 router = Router()
 
@@ -25,20 +44,30 @@ async def welcome_new_member(message: Message, bot: Bot):
     if message.new_chat_members:
         # Добавляем группу в базу данных, если ее там нет
         add_group(message.chat.id, message.chat.title)
+        chat_id = message.chat.id
+        survey_id = get_survey_id_by_name("первичный")
+        if not survey_id:
+            await bot.send_message(chat_id, "Опрос 'первичный' не найден.", parse_mode='HTML')
+            return
+        # Новые участники получают последнюю редакцию приветственного опроса
+        version_id = publish_survey_version(survey_id)
         for new_member in message.new_chat_members:
             user = new_member
-            chat_id = message.chat.id
-            survey_id = get_survey_id_by_name("первичный")
-            if not survey_id:
-                await bot.send_message(chat_id, "Опрос 'первичный' не найден.", parse_mode='HTML')
-                return
-            survey_param = f"survey_{survey_id}_{chat_id}"  # Добавлено chat_id в параметр
-
-            # Получаем имя пользователя бота
-            bot_user = await bot.get_me()
+            if REUSE_PRIMARY_SUBMISSION and await reuse_primary_submission(bot, user.id, chat_id, version_id):
+                continue
+
+            # Ограничение ставится до приветствия: сообщения в чат идут с лимитом
+            # на чат, и при массовом вступлении приветствия выстраиваются в очередь
+            if ENABLE_CAPTCHA:
+                await restrict_user(bot, chat_id, user.id)
+                add_user_to_pending(user.id, chat_id)
+
+            # Получаем имя пользователя бота (значение кэшируется)
+            bot_user = await bot.me()
             bot_username = bot_user.username
 
-            deep_link = f"https://t.me/{bot_username}?start={survey_param}"
+            # Подписанная ссылка: версия опроса и chat_id проверяются без обращения к базе
+            deep_link = survey_deep_link(bot_username, version_id, chat_id)
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
                     [InlineKeyboardButton(text="Пройти анкетирование", url=deep_link)]
@@ -52,10 +81,21 @@ async def welcome_new_member(message: Message, bot: Bot):
             )
 
             if ENABLE_CAPTCHA:
-                await restrict_user(bot, chat_id, user.id)
-                add_user_to_pending(user.id, chat_id)
                 # Запускаем таймер для проверки
-                asyncio.create_task(start_captcha_timer(bot, user.id, chat_id))
+                schedule_captcha_timer(bot, user.id, chat_id)
+
+async def reuse_primary_submission(bot: Bot, user_id: int, chat_id: int, version_id: int):
+    # Анкета уже заполнена в другой группе: без приветствия и капчи
+    submission_id = find_completed_submission(user_id, version_id)
+    if submission_id is None:
+        return False
+    if LINK_REUSED_SUBMISSION:
+        link_submission_to_group(submission_id, chat_id)
+    # Повторное вступление, пока действовало прежнее ограничение, снимает его сразу
+    if is_user_pending(user_id, chat_id) and await unrestrict_user(bot, chat_id, user_id):
+        remove_user_from_pending(user_id, chat_id)
+    logging.info("User %s joined chat %s with completed submission %s", user_id, chat_id, submission_id)
+    return True
 
 async def restrict_user(bot: Bot, chat_id: int, user_id: int):
     try:
@@ -64,39 +104,109 @@ async def restrict_user(bot: Bot, chat_id: int, user_id: int):
             user_id=user_id,
             permissions=ChatPermissions(can_send_messages=False)
         )
-        logging.info(f"User {user_id} restricted in chat {chat_id}")
+        logging.info("User %s restricted in chat %s", user_id, chat_id)
+    except TelegramForbiddenError:
+        logging.error("Bot lacks permission to restrict members in chat %s", chat_id)
+    except TelegramBadRequest as e:
+        logging.error("Failed to restrict user %s in chat %s: %s", user_id, chat_id, e)
+
+async def unrestrict_user(bot: Bot, chat_id: int, user_id: int):
+    try:
+        await bot.restrict_chat_member(
+            chat_id=chat_id,
+            user_id=user_id,
+            permissions=ChatPermissions(can_send_messages=True)
+        )
+        logging.info("User %s unrestricted in chat %s", user_id, chat_id)
+        return True
     except TelegramForbiddenError:
-        logging.error(f"Bot lacks permission to restrict members in chat {chat_id}")
+        logging.error("Bot lacks permission to unrestrict members in chat %s", chat_id)
     except TelegramBadRequest as e:
-        logging.error(f"Failed to restrict user {user_id} in chat {chat_id}: {e}")
+        logging.error("Failed to unrestrict user %s in chat %s: %s", user_id, chat_id, e)
+    return False
 
 async def unrestrict_user_if_needed(bot: Bot, user_id: int):
     pending_chats = get_pending_chats_for_user(user_id)
-    for chat_id in pending_chats:
-        try:
-            await bot.restrict_chat_member(
-                chat_id=chat_id,
-                user_id=user_id,
-                permissions=ChatPermissions(can_send_messages=True)
-            )
-            logging.info(f"User {user_id} unrestricted in chat {chat_id}")
-            remove_user_from_pending(user_id, chat_id)
-        except TelegramForbiddenError:
-            logging.error(f"Bot lacks permission to unrestrict members in chat {chat_id}")
-        except TelegramBadRequest as e:
-            logging.error(f"Failed to unrestrict user {user_id} in chat {chat_id}: {e}")
+    if not pending_chats:
+        return
+    # Запросы во все чаты уходят одновременно, темп задает очередь исходящих запросов
+    results = await asyncio.gather(*(unrestrict_user(bot, chat_id, user_id) for chat_id in pending_chats))
+    remove_user_from_pending_many(user_id, [chat_id for chat_id, ok in zip(pending_chats, results) if ok])
 
-async def start_captcha_timer(bot: Bot, user_id: int, chat_id: int):
-    await asyncio.sleep(CAPTCHA_TIMEOUT * 60)
+async def start_captcha_timer(bot: Bot, user_id: int, chat_id: int, delay: float = None):
+    await asyncio.sleep(CAPTCHA_TIMEOUT * 60 if delay is None else delay)
     if is_user_pending(user_id, chat_id):
         try:
-            await bot.kick_chat_member(chat_id=chat_id, user_id=user_id)
-            logging.info(f"User {user_id} kicked from chat {chat_id} due to captcha timeout")
+            # Исключение из чата без вечного бана: бан с немедленным снятием
+            await bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+            await bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
+            logging.info("User %s kicked from chat %s due to captcha timeout", user_id, chat_id)
             remove_user_from_pending(user_id, chat_id)
         except TelegramForbiddenError:
-            logging.error(f"Bot lacks permission to kick members in chat {chat_id}")
+            logging.error("Bot lacks permission to kick members in chat %s", chat_id)
         except TelegramBadRequest as e:
-            logging.error(f"Failed to kick user {user_id} from chat {chat_id}: {e}")
+            logging.error("Failed to kick user %s from chat %s: %s", user_id, chat_id, e)
+
+captcha_tasks = set()
+
+def schedule_captcha_timer(bot: Bot, user_id: int, chat_id: int, delay: float = None):
+    task = asyncio.create_task(start_captcha_timer(bot, user_id, chat_id, delay))
+    captcha_tasks.add(task)
+    task.add_done_callback(captcha_tasks.discard)
+
+def resume_captcha_timers(bot: Bot):
+    # Таймеры живут только в памяти процесса, поэтому после перезапуска
+    # восстанавливаем их по времени вступления из pending_users
+    if not ENABLE_CAPTCHA:
+        return 0
+    now = time.time()
+    pending = get_all_pending_users()
+    for user_id, chat_id, joined_at in pending:
+        delay = max(0.0, (joined_at or now) + CAPTCHA_TIMEOUT * 60 - now)
+        schedule_captcha_timer(bot, user_id, chat_id, delay)
+    return len(pending)
+
+# Учет групп, в которых состоит бот
+
+@router.my_chat_member(F.chat.type.in_({"group", "supergroup"}))
+async def bot_membership_changed(event: ChatMemberUpdated):
+    member = event.new_chat_member
+    if member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED) or (
+        member.status == ChatMemberStatus.RESTRICTED and not member.is_member
+    ):
+        set_group_status(event.chat.id, GROUP_LEFT, event.chat.title)
+        logging.info("Bot removed from chat %s", event.chat.id)
+    else:
+        set_group_status(event.chat.id, GROUP_ACTIVE, event.chat.title)
+        logging.info("Bot is a member of chat %s with status %s", event.chat.id, member.status)
+
+@router.message(F.new_chat_title)
+async def group_title_changed(message: Message):
+    update_group_title(message.chat.id, message.new_chat_title)
+
+@router.message(F.migrate_to_chat_id)
+async def group_migrated(message: Message):
+    migrate_group(message.chat.id, message.migrate_to_chat_id)
+    logging.info("Chat %s migrated to supergroup %s", message.chat.id, message.migrate_to_chat_id)
+
+@router.message(F.migrate_from_chat_id)
+async def supergroup_created(message: Message):
+    migrate_group(message.migrate_from_chat_id, message.chat.id)
+
+async def send_to_group(bot: Bot, group_id: int, text: str, **kwargs):
+    # Отправка в группу с учетом миграции в супергруппу и автоматическим
+    # исключением групп, куда бот раз за разом не может писать
+    try:
+        message = await bot.send_message(chat_id=group_id, text=text, **kwargs)
+    except TelegramMigrateToChat as e:
+        migrate_group(group_id, e.migrate_to_chat_id)
+        message = await bot.send_message(chat_id=e.migrate_to_chat_id, text=text, **kwargs)
+    except TelegramForbiddenError:
+        if record_group_failure(group_id):
+            logging.warning("Chat %s excluded from broadcasts after repeated delivery failures", group_id)
+        raise
+    reset_group_failures(message.chat.id)
+    return message
 
 def register_group_handlers(dp: Dispatcher):
     dp.include_router(router)
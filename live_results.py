@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+import logging
+from aiogram import Bot, html
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+import metrics
+from choices import render_tallies
+from db_manager import (
+    get_survey_name_by_id,
+    get_survey_version,
+    get_choice_tallies,
+    get_completion_count,
+    is_live_results_enabled,
+    get_live_message,
+    save_live_message,
+    mark_live_refresh,
+    claim_live_refresh,
+    delete_live_message,
+)
+from group_event import send_to_group
+from outbound import outbound_priority, BROADCAST
+
+# Не чаще одной правки сообщений с итогами в чате за этот интервал (секунды)
+LIVE_RESULTS_INTERVAL = float(os.getenv('LIVE_RESULTS_INTERVAL', '30'))
+
+# Интервал общий для всех воркеров: время последней правки и устаревшие итоги
+# хранятся в базе, а правку выполняет тот воркер, который первым их заберет.
+# Последний отправленный текст помнит каждый процесс, чтобы не править впустую
+last_text = {}
+# chat_id -> (задача отложенного обновления в этом процессе, бот)
+pending = {}
+
+
+def render_live_results(survey_id, version_id, chat_id):
+    survey_name = get_survey_name_by_id(survey_id) or ""
+    survey_id, survey_version, questions, layout = get_survey_version(version_id)
+    text = (
+        f"📊 Итоги опроса «{html.quote(survey_name)}»\n"
+        f"Прошли опрос: {get_completion_count(version_id, chat_id)}"
+    )
+    report = render_tallies(questions, layout, get_choice_tallies(version_id, chat_id))
+    if report:
+        text += "\n\n" + report
+    return text
+
+
+async def post_live_results(bot: Bot, survey_id, version_id, chat_id):
+    # Новое сообщение с итогами при каждой публикации опроса в группе
+    previous = get_live_message(survey_id, chat_id)
+    text = await asyncio.to_thread(render_live_results, survey_id, version_id, chat_id)
+    message = await send_to_group(bot, chat_id, text, parse_mode='HTML')
+    chat_id = message.chat.id
+    save_live_message(survey_id, chat_id, version_id, message.message_id)
+    last_text[(survey_id, chat_id)] = text
+    try:
+        await bot.pin_chat_message(chat_id=chat_id, message_id=message.message_id, disable_notification=True)
+        if previous:
+            await bot.unpin_chat_message(chat_id=chat_id, message_id=previous[1])
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        logging.warning("Failed to pin live results in chat %s: %s", chat_id, e)
+
+
+async def refresh_live_results(bot: Bot, survey_id, version_id, message_id, chat_id):
+    # Подсчет итогов — несколько запросов к базе, он не должен задерживать апдейты
+    text = await asyncio.to_thread(render_live_results, survey_id, version_id, chat_id)
+    if text == last_text.get((survey_id, chat_id)):
+        metrics.inc('live_results.unchanged')
+        return
+    try:
+        with outbound_priority(BROADCAST):
+            await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, parse_mode='HTML')
+        metrics.inc('live_results.edits')
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            # Сообщение удалено или недоступно: перестаем его обновлять
+            logging.warning("Live results message in chat %s is gone: %s", chat_id, e)
+            delete_live_message(survey_id, chat_id)
+            return
+    except TelegramForbiddenError:
+        delete_live_message(survey_id, chat_id)
+        return
+    last_text[(survey_id, chat_id)] = text
+
+
+async def refresh_chat(bot: Bot, chat_id, live):
+    for survey_id, version_id, message_id in live:
+        try:
+            await refresh_live_results(bot, survey_id, version_id, message_id, chat_id)
+        except Exception as e:
+            logging.error("Failed to refresh live results for survey %s in chat %s: %s", survey_id, chat_id, e)
+
+
+async def refresh_later(bot: Bot, chat_id, delay):
+    while True:
+        await asyncio.sleep(delay)
+        retry_at, live = claim_live_refresh(chat_id, time.time(), LIVE_RESULTS_INTERVAL)
+        if retry_at is None:
+            break
+        # Другой воркер успел обновить итоги в этом чате: ждем конца его интервала
+        delay = max(0.0, retry_at - time.time())
+    pending.pop(chat_id, None)
+    if not live:
+        # Новые ответы уже попали в правку другого воркера
+        metrics.inc('live_results.claimed_elsewhere')
+        return
+    await refresh_chat(bot, chat_id, live)
+
+
+def schedule_live_refresh(bot: Bot, survey_id, chat_id):
+    # Вызывается на каждый завершенный опрос; все ответы, пришедшие
+    # до истечения интервала, попадают в одну правку
+    if not is_live_results_enabled(survey_id):
+        return
+    edited_at = mark_live_refresh(survey_id, chat_id)
+    if edited_at is None:
+        return
+    if chat_id in pending:
+        metrics.inc('live_results.coalesced')
+        return
+    delay = max(0.0, edited_at + LIVE_RESULTS_INTERVAL - time.time())
+    task = asyncio.create_task(refresh_later(bot, chat_id, delay))
+    pending[chat_id] = (task, bot)
+
+
+async def flush_live_results():
+    # При остановке отложенные правки выполняются сразу, не дожидаясь интервала
+    while pending:
+        chat_id, (task, bot) = pending.popitem()
+        task.cancel()
+        retry_at, live = claim_live_refresh(chat_id, time.time())
+        await refresh_chat(bot, chat_id, live)
@@ -0,0 +1,146 @@
+import sys
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+from fast_profile import json_dumps
+
+# Контекст текущего апдейта, который автоматически добавляется к каждой записи лога
+log_context = ContextVar('log_context', default=None)
+
+CONTEXT_FIELDS = ('update_id', 'user_id', 'chat_id', 'handler')
+# Служебные события, которые пишутся на каждый апдейт и поэтому выборочно прореживаются
+NOISY_LOGGERS = {'aiogram.event', 'bot.updates'}
+
+update_logger = logging.getLogger('bot.updates')
+
+
+class ContextFilter(logging.Filter):
+    # Выполняется в потоке, где был вызван логгер: только здесь виден contextvar
+    def filter(self, record):
+        context = log_context.get()
+        if context:
+            for field in CONTEXT_FIELDS:
+                if field in context and not hasattr(record, field):
+                    setattr(record, field, context[field])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or record.name not in NOISY_LOGGERS:
+            return True
+        return random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный QueueHandler форматирует сообщение в вызывающем потоке.
+    # Очередь здесь внутрипроцессная, поэтому запись передается как есть,
+    # а подстановка аргументов и сериализация происходят в потоке QueueListener
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('duration_ms', 'update_type', 'handled'):
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if record.exc_info:
+            event['exc_info'] = self.formatException(record.exc_info)
+        return json_dumps(event, default=str)
+
+
+def setup_logging(level: str = 'INFO', log_format: str = 'json', sample_rate: float = 1.0):
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    if sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class LoggingContextMiddleware(BaseMiddleware):
+    # Внешний middleware: заполняет контекст лога и пишет событие с длительностью обработки
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        context = {
+            'update_id': event.update_id,
+            'user_id': user.id if user else None,
+            'chat_id': chat.id if chat else None,
+        }
+        token = log_context.set(context)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            log_context.reset(token)
+        if update_logger.isEnabledFor(logging.INFO):
+            update_logger.info(
+                "update processed",
+                extra={
+                    **context,
+                    'handler': context.get('handler'),
+                    'update_type': event.event_type,
+                    'duration_ms': duration_ms,
+                    'handled': result is not UNHANDLED,
+                },
+            )
+        return result
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    # Внутренний middleware: к этому моменту уже известен выбранный обработчик
+    async def __call__(self, handler, event, data):
+        context = log_context.get()
+        handler_object = data.get('handler')
+        if context is not None and handler_object is not None:
+            context['handler'] = getattr(handler_object.callback, '__qualname__', None)
+        return await handler(event, data)
+
+
+def install_logging_middlewares(dp):
+    dp.update.outer_middleware(LoggingContextMiddleware())
+    handler_name_middleware = HandlerNameMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ('update', 'error'):
+            observer.middleware(handler_name_middleware)
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import metrics
+
+# Сторож цикла событий: сопрограмма-пульс отмечается каждые WATCHDOG_INTERVAL секунд,
+# а отдельный поток замечает, что пульс пропал, и снимает стек потока цикла —
+# по нему видно, какой обработчик и какая функция блокируют цикл
+ENABLE_WATCHDOG = os.getenv('ENABLE_WATCHDOG', 'True').lower() == 'true'
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '0.1'))
+# Задержка цикла, после которой снимается стек (секунды)
+WATCHDOG_THRESHOLD = float(os.getenv('WATCHDOG_THRESHOLD', '0.25'))
+# Одно и то же место блокировки попадает в лог не чаще раза в этот интервал
+WATCHDOG_LOG_INTERVAL = float(os.getenv('WATCHDOG_LOG_INTERVAL', '60'))
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STACK_DEPTH = 12
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+# Кадр aiogram, из которого вызывается зарегистрированный обработчик
+HANDLER_CALLER = os.path.join('dispatcher', 'event', 'handler.py')
+
+
+def blocking_location(stack):
+    # Кадры после последнего кадра asyncio — это выполняемая задача. Обработчик —
+    # кадр проекта, вызванный aiogram (а не промежуточное ПО), функция — последний
+    # кадр проекта перед блокирующим вызовом
+    start = 0
+    for index, frame in enumerate(stack):
+        if frame.filename.startswith(ASYNCIO_DIR):
+            start = index + 1
+    handler = function = None
+    caller = None
+    for frame in stack[start:]:
+        if frame.filename.startswith(PROJECT_DIR) and frame.filename != __file__:
+            if handler is None and caller is not None and caller.filename.endswith(HANDLER_CALLER):
+                handler = frame
+            function = frame
+        caller = frame
+    if handler is None and function is not None:
+        # Не обработчик апдейта (фоновая задача): ее первый кадр проекта
+        handler = next(frame for frame in stack[start:] if frame.filename.startswith(PROJECT_DIR))
+    return handler, function
+
+
+def describe(frame):
+    if frame is None:
+        return "?"
+    return f"{frame.name} ({os.path.relpath(frame.filename, PROJECT_DIR)}:{frame.lineno})"
+
+
+class LoopWatchdog:
+    def __init__(self, interval=WATCHDOG_INTERVAL, threshold=WATCHDOG_THRESHOLD, log_interval=WATCHDOG_LOG_INTERVAL):
+        self.interval = interval
+        self.threshold = threshold
+        self.log_interval = log_interval
+        self.beat = time.monotonic()
+        self.captured_beat = None
+        self.loop_thread_id = None
+        # Место блокировки -> (время последней записи в лог, пропущено записей)
+        self.reported = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # Вызывается из работающего цикла событий; возвращает задачу пульса
+        self.loop_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.thread = threading.Thread(target=self.monitor, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        return asyncio.create_task(self.heartbeat())
+
+    def stop(self):
+        self.stopped.set()
+
+    async def heartbeat(self):
+        loop = asyncio.get_running_loop()
+        lag = metrics.histogram('loop.lag', LAG_BUCKETS)
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag.observe(max(0.0, loop.time() - expected))
+                self.beat = time.monotonic()
+        finally:
+            self.stop()
+
+    def monitor(self):
+        while not self.stopped.wait(self.interval):
+            beat = self.beat
+            # Пульс и так отмечается раз в interval, задержкой считается только превышение
+            stalled = time.monotonic() - beat - self.interval
+            # Для каждой остановки цикла стек снимается один раз
+            if stalled >= self.threshold and self.captured_beat != beat:
+                self.captured_beat = beat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.report(traceback.extract_stack(frame), stalled)
+
+    def report(self, stack, stalled):
+        handler, function = blocking_location(stack)
+        location = (describe(handler), describe(function))
+        metrics.inc('loop.stalls')
+        metrics.inc(f"loop.blocked.{handler.name if handler else 'unknown'}")
+        now = time.monotonic()
+        last_logged, suppressed = self.reported.get(location, (None, 0))
+        if last_logged is not None and now - last_logged < self.log_interval:
+            self.reported[location] = (last_logged, suppressed + 1)
+            return
+        self.reported[location] = (now, 0)
+        logging.warning(
+            "Event loop blocked for at least %.2f s in handler %s, blocking call in %s "
+            "(%s similar stalls not logged)\n%s",
+            stalled, location[0], location[1], suppressed,
+            "".join(traceback.format_list(stack[-STACK_DEPTH:])).rstrip(),
+        )
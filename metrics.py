@@ -0,0 +1,75 @@
+import bisect
+from collections import defaultdict
+
+# Простейший реестр счетчиков и гистограмм процесса.
+# Значения можно посмотреть командой /stats в личном чате администратора.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_counters = defaultdict(int)
+_histograms = {}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+def inc(name: str, value: int = 1):
+    _counters[name] += value
+
+
+def histogram(name: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms[name] = Histogram(buckets)
+    return hist
+
+
+def observe(name: str, value: float):
+    histogram(name).observe(value)
+
+
+def snapshot():
+    return {
+        'counters': dict(_counters),
+        'histograms': {name: hist.snapshot() for name, hist in _histograms.items()},
+    }
+
+
+def render_text():
+    lines = []
+    for name in sorted(_counters):
+        lines.append(f"{name}: {_counters[name]}")
+    for name in sorted(_histograms):
+        hist = _histograms[name]
+        lines.append(
+            f"{name}: n={hist.count} p50≤{hist.quantile(0.5)} p95≤{hist.quantile(0.95)} p99≤{hist.quantile(0.99)}"
+        )
+    return "\n".join(lines) if lines else "Метрики пока не собраны."
@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from throttling import TokenBucket
+import metrics
+
+# Приоритеты исходящих запросов: чем меньше число, тем раньше запрос уйдет
+INTERACTIVE = 0
+MODERATION = 1
+BROADCAST = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', MODERATION: 'moderation', BROADCAST: 'broadcast'}
+
+# Методы, адресованные конкретному чату, которые проходят через очередь.
+# Остальные (getUpdates, getMe, answerCallbackQuery и т.п.) отправляются напрямую
+QUEUED_METHODS = {
+    'SendMessage', 'SendDocument', 'SendPhoto', 'CopyMessage', 'ForwardMessage',
+    'EditMessageText', 'EditMessageReplyMarkup', 'DeleteMessage',
+    'PinChatMessage', 'UnpinChatMessage',
+    'RestrictChatMember', 'BanChatMember', 'UnbanChatMember',
+}
+MODERATION_METHODS = {'RestrictChatMember', 'BanChatMember', 'UnbanChatMember', 'PinChatMessage', 'UnpinChatMessage', 'DeleteMessage'}
+# Лимит Telegram на чат относится к сообщениям, а не к модерации участников: эти
+# методы ограничиваются только общим лимитом бота и не ждут сообщений своего чата
+MEMBER_METHODS = {'RestrictChatMember', 'BanChatMember', 'UnbanChatMember'}
+# Повторные правки одного и того же сообщения схлопываются в последнюю
+MERGEABLE_METHODS = {'EditMessageText', 'EditMessageReplyMarkup'}
+
+_priority_override = ContextVar('outbound_priority', default=None)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    # Все запросы внутри блока получают указанный приоритет, например BROADCAST для рассылок
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+class OutboundJob:
+    __slots__ = (
+        'priority', 'chat_id', 'bot', 'method', 'make_request', 'futures', 'attempts', 'merge_key', 'enqueued_at',
+        'paced',
+    )
+
+    def __init__(self, priority, chat_id, bot, method, make_request, future, merge_key):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.bot = bot
+        self.method = method
+        self.make_request = make_request
+        self.futures = [future]
+        self.attempts = 0
+        self.merge_key = merge_key
+        self.enqueued_at = time.monotonic()
+        self.paced = type(method).__name__ not in MEMBER_METHODS
+
+    @property
+    def queue_key(self):
+        # Очередь чата; модерация идет отдельной очередью, минуя лимит чата
+        return self.chat_id, self.paced
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    def __init__(self, global_rate=25.0, global_burst=30.0, private_rate=1.0, private_burst=3.0,
+                 group_rate=0.33, group_burst=3.0, max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.private_limits = (private_rate, private_burst)
+        self.group_limits = (group_rate, group_burst)
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.chat_buckets = OrderedDict()
+        self.blocked_until = {}
+        self.pending_merges = {}
+        self.in_flight = set()
+        self.wakeup = None
+        self.worker = None
+
+    @classmethod
+    def from_env(cls, share=1):
+        # share > 1, когда общий лимит бота делят несколько процессов
+        return cls(
+            global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', '25')) / share,
+            global_burst=max(1.0, float(os.getenv('OUTBOUND_GLOBAL_BURST', '30')) / share),
+            private_rate=float(os.getenv('OUTBOUND_PRIVATE_RATE', '1')),
+            private_burst=float(os.getenv('OUTBOUND_PRIVATE_BURST', '3')),
+            group_rate=float(os.getenv('OUTBOUND_GROUP_RATE', '0.33')),
+            group_burst=float(os.getenv('OUTBOUND_GROUP_BURST', '3')),
+            max_retries=int(os.getenv('OUTBOUND_MAX_RETRIES', '3')),
+        )
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        chat_id = getattr(method, 'chat_id', None)
+        if name not in QUEUED_METHODS or not isinstance(chat_id, int):
+            return await make_request(bot, method)
+
+        priority = _priority_override.get()
+        if priority is None:
+            priority = MODERATION if name in MODERATION_METHODS else INTERACTIVE
+
+        future = asyncio.get_running_loop().create_future()
+        merge_key = None
+        if name in MERGEABLE_METHODS and getattr(method, 'message_id', None):
+            merge_key = (name, chat_id, method.message_id)
+            job = self.pending_merges.get(merge_key)
+            if job is not None:
+                # Правка еще не отправлена: подменяем ее содержимое новой версией
+                job.method = method
+                job.make_request = make_request
+                job.futures.append(future)
+                metrics.inc('outbound.merged')
+                return await future
+
+        job = OutboundJob(priority, chat_id, bot, method, make_request, future, merge_key)
+        if merge_key is not None:
+            self.pending_merges[merge_key] = job
+        self.push(job)
+        metrics.inc(f'outbound.enqueued.{PRIORITY_NAMES[priority]}')
+        return await future
+
+    def push(self, job, front=False):
+        chat_queue = self.queues[job.priority].get(job.queue_key)
+        if chat_queue is None:
+            chat_queue = self.queues[job.priority][job.queue_key] = deque()
+        if front:
+            chat_queue.appendleft(job)
+        else:
+            chat_queue.append(job)
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self.run())
+        self.wakeup.set()
+
+    def chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is not None:
+            self.chat_buckets.move_to_end(chat_id)
+            return bucket
+        rate, burst = self.private_limits if chat_id > 0 else self.group_limits
+        bucket = self.chat_buckets[chat_id] = TokenBucket(rate, burst, now)
+        while len(self.chat_buckets) > self.max_chats:
+            self.chat_buckets.popitem(last=False)
+        return bucket
+
+    def pick(self, now):
+        # Возвращает (задание, None) или (None, сколько ждать до следующей попытки)
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        min_wait = None
+        for queue in self.queues:
+            for queue_key, chat_queue in queue.items():
+                chat_id, paced = queue_key
+                wait = self.chat_bucket(chat_id, now).wait_time(now) if paced else 0.0
+                blocked_until = self.blocked_until.get(chat_id)
+                if blocked_until is not None:
+                    if blocked_until > now:
+                        wait = max(wait, blocked_until - now)
+                    else:
+                        del self.blocked_until[chat_id]
+                if wait <= 0:
+                    job = chat_queue.popleft()
+                    if chat_queue:
+                        # Чаты одного приоритета обслуживаются по кругу
+                        queue.move_to_end(queue_key)
+                    else:
+                        del queue[queue_key]
+                    return job, None
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            job, wait = self.pick(now)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.global_bucket.consume()
+            if job.paced:
+                self.chat_bucket(job.chat_id, now).consume()
+            if job.merge_key is not None:
+                self.pending_merges.pop(job.merge_key, None)
+            metrics.observe(f'outbound.queue_wait.{PRIORITY_NAMES[job.priority]}', now - job.enqueued_at)
+            task = asyncio.create_task(self.execute(job))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def execute(self, job):
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            metrics.inc('outbound.retry_after')
+            self.blocked_until[job.chat_id] = time.monotonic() + e.retry_after
+            if job.attempts <= self.max_retries:
+                logging.warning(
+                    "Flood control in chat %s, retrying %s in %s s",
+                    job.chat_id, type(job.method).__name__, e.retry_after,
+                )
+                self.push(job, front=True)
+                return
+            self.resolve(job, error=e)
+        except Exception as e:
+            self.resolve(job, error=e)
+        else:
+            self.resolve(job, result=result)
+
+    def resolve(self, job, result=None, error=None):
+        for future in job.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def pending_count(self):
+        return sum(len(chat_queue) for queue in self.queues for chat_queue in queue.values())
+
+    async def drain(self):
+        # Дожидается отправки всего, что уже поставлено в очередь
+        while self.pending_count() or self.in_flight:
+            if self.in_flight:
+                await asyncio.wait(set(self.in_flight), timeout=0.1)
+            else:
+                await asyncio.sleep(0.05)
@@ -2,16 +2,27 @@ import os
 import asyncio
 import logging
 from aiogram import F, Router
-from aiogram.types import Message, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.enums import ChatMemberStatus
+from aiogram.types import Message, ChatMemberUpdated, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from db_manager import (
     get_survey_id_by_name,
+    publish_survey_version,
     add_user_to_pending,
     is_user_pending,
     remove_user_from_pending,
+    remove_user_from_pending_many,
     get_pending_chats_for_user,
+    find_completed_submission,
+    link_submission_to_group,
     add_group,
+    set_group_status,
+    update_group_title,
+    migrate_group,
+    GROUP_ACTIVE,
+    GROUP_LEFT,
 )
+from deeplink import survey_deep_link
 
 
 class GroupEventPlugin:
@@ -27,9 +38,14 @@ class GroupEventPlugin:
         self.router = Router()
         self.enable_captcha = os.getenv("ENABLE_CAPTCHA", "False").lower() == "true"
         self.captcha_timeout = int(os.getenv("CAPTCHA_TIMEOUT", "5"))
+        self.reuse_submission = os.getenv("REUSE_PRIMARY_SUBMISSION", "True").lower() == "true"
+        self.link_submission = os.getenv("LINK_REUSED_SUBMISSION", "True").lower() == "true"
 
     def register_handlers(self):
         self.router.message(F.new_chat_members)(self.welcome_new_member)
+        self.router.my_chat_member(F.chat.type.in_({"group", "supergroup"}))(self.bot_membership_changed)
+        self.router.message(F.new_chat_title)(self.group_title_changed)
+        self.router.message(F.migrate_to_chat_id)(self.group_migrated)
 
     def get_commands(self):
         return []
@@ -39,15 +55,30 @@ class GroupEventPlugin:
             return
 
         add_group(message.chat.id, message.chat.title)
+        chat_id = message.chat.id
+        survey_id = get_survey_id_by_name("первичный")
+        if not survey_id:
+            await self.bot.send_message(chat_id, "Опрос 'первичный' не найден.", parse_mode="HTML")
+            return
+        # Новые участники получают последнюю редакцию приветственного опроса
+        version_id = publish_survey_version(survey_id)
         for user in message.new_chat_members:
-            chat_id = message.chat.id
-            survey_id = get_survey_id_by_name("первичный")
-            if not survey_id:
-                await self.bot.send_message(chat_id, "Опрос 'первичный' не найден.", parse_mode="HTML")
-                return
-
-            bot_username = (await self.bot.get_me()).username
-            deep_link = f"https://t.me/{bot_username}?start=survey_{survey_id}_{chat_id}"
+            # Анкета уже заполнена в другой группе: без приветствия и капчи
+            submission_id = find_completed_submission(user.id, version_id) if self.reuse_submission else None
+            if submission_id is not None:
+                if self.link_submission:
+                    link_submission_to_group(submission_id, chat_id)
+                if is_user_pending(user.id, chat_id) and await self.unrestrict_user(chat_id, user.id):
+                    remove_user_from_pending(user.id, chat_id)
+                continue
+
+            # Ограничение ставится до приветствия, которое может ждать лимита чата
+            if self.enable_captcha:
+                await self.restrict_user(chat_id, user.id)
+                add_user_to_pending(user.id, chat_id)
+
+            bot_username = (await self.bot.me()).username
+            deep_link = survey_deep_link(bot_username, version_id, chat_id)
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[[InlineKeyboardButton(text="Пройти анкетирование", url=deep_link)]]
             )
@@ -59,10 +90,23 @@ class GroupEventPlugin:
             )
 
             if self.enable_captcha:
-                await self.restrict_user(chat_id, user.id)
-                add_user_to_pending(user.id, chat_id)
                 asyncio.create_task(self.start_captcha_timer(user.id, chat_id))
 
+    async def bot_membership_changed(self, event: ChatMemberUpdated):
+        member = event.new_chat_member
+        if member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED) or (
+            member.status == ChatMemberStatus.RESTRICTED and not member.is_member
+        ):
+            set_group_status(event.chat.id, GROUP_LEFT, event.chat.title)
+        else:
+            set_group_status(event.chat.id, GROUP_ACTIVE, event.chat.title)
+
+    async def group_title_changed(self, message: Message):
+        update_group_title(message.chat.id, message.new_chat_title)
+
+    async def group_migrated(self, message: Message):
+        migrate_group(message.chat.id, message.migrate_to_chat_id)
+
     async def restrict_user(self, chat_id: int, user_id: int):
         try:
             await self.bot.restrict_chat_member(
@@ -71,35 +115,42 @@ class GroupEventPlugin:
                 permissions=ChatPermissions(can_send_messages=False),
             )
         except TelegramForbiddenError:
-            logging.error(f"Bot lacks permission to restrict members in chat {chat_id}")
+            logging.error("Bot lacks permission to restrict members in chat %s", chat_id)
+        except TelegramBadRequest as e:
+            logging.error("Failed to restrict user %s in chat %s: %s", user_id, chat_id, e)
+
+    async def unrestrict_user(self, chat_id: int, user_id: int):
+        try:
+            await self.bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                permissions=ChatPermissions(can_send_messages=True),
+            )
+            return True
+        except TelegramForbiddenError:
+            logging.error("Bot lacks permission to unrestrict members in chat %s", chat_id)
         except TelegramBadRequest as e:
-            logging.error(f"Failed to restrict user {user_id} in chat {chat_id}: {e}")
+            logging.error("Failed to unrestrict user %s in chat %s: %s", user_id, chat_id, e)
+        return False
 
     async def unrestrict_user_if_needed(self, user_id: int):
         pending_chats = get_pending_chats_for_user(user_id)
-        for chat_id in pending_chats:
-            try:
-                await self.bot.restrict_chat_member(
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    permissions=ChatPermissions(can_send_messages=True),
-                )
-                remove_user_from_pending(user_id, chat_id)
-            except TelegramForbiddenError:
-                logging.error(f"Bot lacks permission to unrestrict members in chat {chat_id}")
-            except TelegramBadRequest as e:
-                logging.error(f"Failed to unrestrict user {user_id} in chat {chat_id}: {e}")
+        if not pending_chats:
+            return
+        results = await asyncio.gather(*(self.unrestrict_user(chat_id, user_id) for chat_id in pending_chats))
+        remove_user_from_pending_many(user_id, [chat_id for chat_id, ok in zip(pending_chats, results) if ok])
 
     async def start_captcha_timer(self, user_id: int, chat_id: int):
         await asyncio.sleep(self.captcha_timeout * 60)
         if is_user_pending(user_id, chat_id):
             try:
-                await self.bot.kick_chat_member(chat_id=chat_id, user_id=user_id)
+                await self.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+                await self.bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
                 remove_user_from_pending(user_id, chat_id)
             except TelegramForbiddenError:
-                logging.error(f"Bot lacks permission to kick members in chat {chat_id}")
+                logging.error("Bot lacks permission to kick members in chat %s", chat_id)
             except TelegramBadRequest as e:
-                logging.error(f"Failed to kick user {user_id} from chat {chat_id}: {e}")
+                logging.error("Failed to kick user %s from chat %s: %s", user_id, chat_id, e)
 
 
 def load_plugin(bot, plugin_manager):
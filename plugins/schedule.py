@@ -1,47 +1,78 @@
-from aiogram import F, Router
-from aiogram.filters import Command
+import os
+from datetime import datetime
+from aiogram import F, Router, html
+from aiogram.filters import Command, CommandObject
 from aiogram.types import BotCommand, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
+from db_manager import cancel_jobs, get_survey_name_by_id
+from scheduler import schedule_publication, upcoming_publications
+
+
+ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
+
 
 class SchedulePlugin:
     __plugin_meta__ = {
         "name": "schedule",
-        "description": "Shows a simple weekly schedule",
-        "version": "1.0.0",
+        "description": "Plans survey publications through the persistent job scheduler",
+        "version": "2.0.0",
     }
 
     def __init__(self, bot, plugin_manager):
         self.bot = bot
         self.plugin_manager = plugin_manager
         self.router = Router()
-        self.schedule = {
-            "Monday": "Math, Physics",
-            "Tuesday": "History, Art",
-            "Wednesday": "Biology, Chemistry",
-            "Thursday": "Sports",
-            "Friday": "Computer Science",
-        }
 
     def register_handlers(self):
-        self.router.message(Command("schedule"))(self.show_menu)
-        self.router.callback_query(F.data.startswith("schedule:"))(self.show_day)
+        self.router.message(Command("schedule"), F.from_user.id.in_(ADMIN_IDS))(self.handle_schedule)
+        self.router.callback_query(F.data.startswith("schedule:cancel:"), F.from_user.id.in_(ADMIN_IDS))(self.cancel)
 
     def get_commands(self):
-        return [BotCommand(command="schedule", description="Show weekly schedule")]
-
-    async def show_menu(self, message: Message):
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text=day, callback_data=f"schedule:{day}")]
-                for day in self.schedule.keys()
-            ]
-        )
-        await message.answer("Select a day:", reply_markup=keyboard)
-
-    async def show_day(self, call: CallbackQuery):
-        day = call.data.split(":")[1]
-        text = self.schedule.get(day, "No schedule available.")
-        await call.message.edit_text(f"{day} schedule:\n{text}")
+        return [BotCommand(command="schedule", description="Scheduled survey publications")]
+
+    def render(self):
+        publications = upcoming_publications()
+        if not publications:
+            return "Запланированных отправок нет.", None
+        lines, buttons = [], []
+        for job_id, run_at, survey_id, survey_name in publications:
+            when = datetime.fromtimestamp(run_at).strftime("%d.%m.%Y %H:%M")
+            lines.append(f"• {when} — {html.quote(survey_name or str(survey_id))}")
+            buttons.append([InlineKeyboardButton(text=f"Отменить: {when} {survey_name}", callback_data=f"schedule:cancel:{job_id}")])
+        return "Запланированные отправки:\n" + "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    async def handle_schedule(self, message: Message, command: CommandObject):
+        # /schedule — список, /schedule <id опроса> ДД.ММ.ГГГГ ЧЧ:ММ — новая отправка
+        if command.args:
+            parts = command.args.split(maxsplit=1)
+            try:
+                survey_id = int(parts[0])
+                run_at = datetime.strptime(parts[1].strip(), "%d.%m.%Y %H:%M")
+            except (ValueError, IndexError):
+                await message.answer("Формат: /schedule <id опроса> ДД.ММ.ГГГГ ЧЧ:ММ", parse_mode="HTML")
+                return
+            survey_name = get_survey_name_by_id(survey_id)
+            if survey_name is None:
+                await message.answer("Опрос не найден.", parse_mode="HTML")
+                return
+            if run_at <= datetime.now():
+                await message.answer("Время отправки уже прошло. Укажите время в будущем.", parse_mode="HTML")
+                return
+            schedule_publication(survey_id, run_at.timestamp())
+            await message.answer(
+                f"Отправка опроса '{html.quote(survey_name)}' запланирована на {run_at.strftime('%d.%m.%Y %H:%M')}.",
+                parse_mode="HTML",
+            )
+            return
+        text, markup = self.render()
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    async def cancel(self, call: CallbackQuery):
+        job_id = int(call.data.split(":")[-1])
+        cancelled = cancel_jobs(job_id=job_id)
+        text, markup = self.render()
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+        await call.answer("Отправка отменена." if cancelled else "Отправка уже выполнена или отменена.")
 
 
 def load_plugin(bot, plugin_manager):
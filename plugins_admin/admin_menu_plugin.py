@@ -1,25 +1,32 @@
 import os
+import asyncio
 import logging
-from aiogram import F, Router
+import sqlite3
+from aiogram import F, Router, html
 from aiogram.filters import Command
-from aiogram.types import BotCommand, CallbackQuery, Message
+from aiogram.types import BotCommand, CallbackQuery, InlineKeyboardButton, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import Bot
 
+from outbound import outbound_priority, BROADCAST
+from choices import parse_question_spec, QUESTION_FORMAT_HINT
+from announce import announce_survey
+from survey_import import import_document, IMPORT_FORMAT_HINT
 from db_manager import (
-    add_survey,
     survey_exists,
-    add_question,
-    get_all_surveys,
-    get_survey_id_by_name,
+    unit_of_work,
+    insert_survey,
+    get_surveys_page,
     get_survey_name_by_id,
     get_all_groups,
+    publish_survey_version,
 )
 
 
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "10"))
 
 
 def is_admin(user_id: int) -> bool:
@@ -31,6 +38,14 @@ class SurveyCreation(StatesGroup):
     waiting_for_questions = State()
 
 
+class SurveyImport(StatesGroup):
+    waiting_for_file = State()
+
+
+class ResendSearch(StatesGroup):
+    waiting_for_prefix = State()
+
+
 class AdminMenuPlugin:
     __plugin_meta__ = {
         "name": "admin_menu",
@@ -47,9 +62,15 @@ class AdminMenuPlugin:
         self.router.message(Command("admin"), F.chat.type == "private")(self.admin_panel)
         self.router.callback_query(F.data == "admin:create")(self.create_survey_start)
         self.router.message(SurveyCreation.waiting_for_survey_name, F.chat.type == "private")(self.receive_survey_name)
-        self.router.message(SurveyCreation.waiting_for_questions, F.chat.type == "private")(self.receive_question)
         self.router.message(Command("done"), SurveyCreation.waiting_for_questions, F.chat.type == "private")(self.finish_questions)
+        self.router.message(SurveyCreation.waiting_for_questions, F.chat.type == "private")(self.receive_question)
+        self.router.callback_query(F.data == "admin:import")(self.import_start)
+        self.router.message(SurveyImport.waiting_for_file, F.chat.type == "private", F.document)(self.receive_import_file)
         self.router.callback_query(F.data == "admin:resend")(self.show_resend_survey_list)
+        self.router.callback_query(F.data.startswith("admin:resend_page:"))(self.resend_survey_page)
+        self.router.callback_query(F.data == "admin:resend_search")(self.resend_search_start)
+        self.router.callback_query(F.data == "admin:resend_reset")(self.resend_search_reset)
+        self.router.message(ResendSearch.waiting_for_prefix, F.chat.type == "private", F.text)(self.receive_search_prefix)
         self.router.callback_query(F.data.startswith("admin:resend:"))(self.resend_survey)
 
     def get_commands(self):
@@ -62,6 +83,7 @@ class AdminMenuPlugin:
         kb = InlineKeyboardBuilder()
         kb.button(text="Создать опрос", callback_data="admin:create")
         kb.button(text="Повторно отправить опрос", callback_data="admin:resend")
+        kb.button(text="Импортировать опросы из файла", callback_data="admin:import")
         kb.adjust(1)
         await message.answer("Выберите действие:", reply_markup=kb.as_markup(), parse_mode="HTML")
         await state.clear()
@@ -76,37 +98,111 @@ class AdminMenuPlugin:
         if survey_exists(name):
             await message.answer(f"Опрос '{name}' уже существует. Введите другое название.", parse_mode="HTML")
             return
-        survey_id = add_survey(name)
-        await state.update_data(survey_id=survey_id, survey_name=name)
-        await message.answer("Введите вопросы по одному. После ввода всех вопросов напишите /done", parse_mode="HTML")
+        await state.update_data(survey_name=name, questions=[])
+        await message.answer(
+            f"Введите вопросы по одному. После ввода всех вопросов напишите /done\n\n{html.quote(QUESTION_FORMAT_HINT)}",
+            parse_mode="HTML",
+        )
         await state.set_state(SurveyCreation.waiting_for_questions)
 
     async def receive_question(self, message: Message, state: FSMContext):
+        try:
+            question, qtype, options = parse_question_spec(message.text)
+        except ValueError as e:
+            await message.answer(html.quote(str(e)), parse_mode="HTML")
+            return
         data = await state.get_data()
-        survey_id = data.get("survey_id")
-        add_question(survey_id, message.text.strip())
+        await state.update_data(questions=data.get("questions", []) + [[question, qtype, options]])
         await message.answer("Вопрос добавлен. Введите следующий вопрос или /done для завершения.", parse_mode="HTML")
 
     async def finish_questions(self, message: Message, state: FSMContext):
         data = await state.get_data()
         survey_name = data.get("survey_name")
-        await message.answer(f"Опрос '{survey_name}' успешно создан.", parse_mode="HTML")
+        try:
+            with unit_of_work() as cursor:
+                insert_survey(cursor, survey_name, data.get("questions", []))
+        except sqlite3.IntegrityError:
+            await message.answer(f"Опрос '{survey_name}' уже существует.", parse_mode="HTML")
+        else:
+            await message.answer(f"Опрос '{survey_name}' успешно создан.", parse_mode="HTML")
         await state.clear()
 
-    async def show_resend_survey_list(self, call: CallbackQuery, state: FSMContext):
-        surveys = get_all_surveys()
-        if not surveys:
-            await call.message.edit_text("Опросы не найдены.", parse_mode="HTML")
-            await call.answer()
+    async def import_start(self, call: CallbackQuery, state: FSMContext):
+        if not is_admin(call.from_user.id):
+            await call.answer("У вас нет прав доступа.", show_alert=True)
+            return
+        await call.message.edit_text(
+            f"Отправьте файл .json или .csv с описанием опросов.\n\n{html.quote(IMPORT_FORMAT_HINT)}",
+            parse_mode="HTML",
+        )
+        await state.set_state(SurveyImport.waiting_for_file)
+        await call.answer()
+
+    async def receive_import_file(self, message: Message, state: FSMContext, bot: Bot):
+        try:
+            surveys = await import_document(bot, message.document)
+        except ValueError as e:
+            await message.answer(f"Файл не импортирован: {html.quote(str(e))}", parse_mode="HTML")
             return
+        await message.answer(f"Импортировано опросов: {len(surveys)}", parse_mode="HTML")
+        await state.clear()
+
+    def resend_picker(self, prefix=None, after_id=0, before_id=0):
+        # Страницы выбираются по id (keyset), callback хранит только границы страницы
+        rows, has_prev, has_next = get_surveys_page(after_id, before_id, prefix, ADMIN_PAGE_SIZE)
+        if not rows and (after_id or before_id):
+            rows, has_prev, has_next = get_surveys_page(prefix=prefix, limit=ADMIN_PAGE_SIZE)
+        if not rows and not prefix:
+            return "Опросы не найдены.", None
         kb = InlineKeyboardBuilder()
-        for s in surveys:
-            survey_id = get_survey_id_by_name(s)
-            kb.button(text=s, callback_data=f"admin:resend:{survey_id}")
+        for survey_id, name in rows:
+            kb.button(text=name, callback_data=f"admin:resend:{survey_id}")
         kb.adjust(1)
-        await call.message.edit_text("Выберите опрос для отправки:", reply_markup=kb.as_markup(), parse_mode="HTML")
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin:resend_page:0:{rows[0][0]}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"admin:resend_page:{rows[-1][0]}:0"))
+        if navigation:
+            kb.row(*navigation)
+        kb.row(InlineKeyboardButton(text="🔍 Поиск по названию", callback_data="admin:resend_search"))
+        if prefix:
+            kb.row(InlineKeyboardButton(text="Сбросить фильтр", callback_data="admin:resend_reset"))
+        if not rows:
+            return f"Опросы, название которых начинается с «{html.quote(prefix)}», не найдены.", kb.as_markup()
+        return "Выберите опрос для отправки:", kb.as_markup()
+
+    async def show_resend_survey_list(self, call: CallbackQuery, state: FSMContext):
+        await state.update_data(picker_prefix=None)
+        text, markup = self.resend_picker()
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
         await call.answer()
 
+    async def resend_survey_page(self, call: CallbackQuery, state: FSMContext):
+        after_id, before_id = (int(x) for x in call.data.split(":")[-2:])
+        data = await state.get_data()
+        text, markup = self.resend_picker(data.get("picker_prefix"), after_id, before_id)
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+        await call.answer()
+
+    async def resend_search_start(self, call: CallbackQuery, state: FSMContext):
+        await call.message.edit_text("Введите начало названия опроса.", parse_mode="HTML")
+        await state.set_state(ResendSearch.waiting_for_prefix)
+        await call.answer()
+
+    async def resend_search_reset(self, call: CallbackQuery, state: FSMContext):
+        await state.update_data(picker_prefix=None)
+        text, markup = self.resend_picker()
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+        await call.answer()
+
+    async def receive_search_prefix(self, message: Message, state: FSMContext):
+        prefix = message.text.strip()
+        await state.update_data(picker_prefix=prefix)
+        await state.set_state(None)
+        text, markup = self.resend_picker(prefix)
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
     async def resend_survey(self, call: CallbackQuery, state: FSMContext, bot: Bot):
         survey_id = int(call.data.split(":")[-1])
         survey_name = get_survey_name_by_id(survey_id)
@@ -115,17 +211,17 @@ class AdminMenuPlugin:
             await call.message.edit_text("Бот не состоит ни в одной группе.", parse_mode="HTML")
             await call.answer()
             return
-        bot_user = await bot.get_me()
-        bot_username = bot_user.username
-        for group_id, group_title in groups:
-            deep_link = f"https://t.me/{bot_username}?start=survey_{survey_id}_{group_id}"
-            text = f"Дорогие друзья, просим вас пройти опрос: [{survey_name}]({deep_link})"
+        # Публикуем текущий черновик как новую версию (если он менялся)
+        version_id = publish_survey_version(survey_id)
+
+        async def announce_in_group(group_id):
             try:
-                sent_message = await bot.send_message(chat_id=group_id, text=text, parse_mode="Markdown")
-                if survey_name != "первичный":
-                    await bot.pin_chat_message(chat_id=group_id, message_id=sent_message.message_id, disable_notification=False)
+                await announce_survey(bot, survey_id, version_id, group_id, survey_name)
             except Exception as e:
-                logging.error(f"Ошибка при отправке опроса в группу {group_id}: {e}")
+                logging.error("Ошибка при отправке опроса в группу %s: %s", group_id, e)
+
+        with outbound_priority(BROADCAST):
+            await asyncio.gather(*(announce_in_group(group_id) for group_id, group_title in groups))
         await call.message.edit_text(f"Опрос '{survey_name}' был успешно отправлен во все группы.", parse_mode="HTML")
         await call.answer()
 
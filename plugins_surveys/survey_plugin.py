@@ -1,21 +1,36 @@
-from aiogram import Router
-from aiogram.filters import CommandStart
-from aiogram.types import Message
+from aiogram import F, Router, html
+from aiogram.filters import CommandStart, StateFilter
+from aiogram.types import CallbackQuery, Message, User
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from datetime import datetime
 
 from db_manager import (
-    get_questions_by_survey,
-    get_survey_name_by_id,
     get_group_info_by_chat_id,
+    get_latest_version_id,
+    get_survey_version,
+    get_survey_name_by_id,
+    record_choice_votes,
+    record_completion,
+    start_submission,
+    complete_submission,
+    get_draft_submission,
+    CHOICE_QTYPES,
+    QTYPE_MULTI,
 )
-from data_manager import save_to_excel as dm_save_to_excel
+from callbacks import ChoiceCallback
+from deeplink import parse_survey_token, parse_legacy_survey_param
+from choices import choice_keyboard, answer_text, DONE_OPTION
+from live_results import schedule_live_refresh
+from scheduler import schedule_reminder, cancel_reminder
+from answer_writer import answer_writer
+from facets import index_facets
 from group_event import unrestrict_user_if_needed
+from survey import SESSION_EXPIRED, submission_id_for
 
 
 class SurveyStates(StatesGroup):
     answering = State()
+    choosing = State()
 
 
 class SurveyPlugin:
@@ -33,6 +48,10 @@ class SurveyPlugin:
     def register_handlers(self):
         self.router.message(CommandStart())(self.start_survey)
         self.router.message(SurveyStates.answering)(self.handle_survey_response)
+        self.router.message(SurveyStates.choosing)(self.handle_text_instead_of_choice)
+        self.router.callback_query(ChoiceCallback.filter(), SurveyStates.choosing)(self.handle_choice)
+        self.router.callback_query(ChoiceCallback.filter())(self.handle_stale_choice)
+        self.router.message(StateFilter(None), F.chat.type == "private", F.text, ~F.text.startswith("/"))(self.resume_survey)
 
     def get_commands(self):
         # No additional commands beyond /start
@@ -40,82 +59,179 @@ class SurveyPlugin:
 
     async def start_survey(self, message: Message, state: FSMContext):
         args = message.text.split()
-        if len(args) <= 1 or not args[1].startswith("survey_"):
-            await message.answer("Опрос не найден. Пожалуйста, попробуйте еще раз.", parse_mode="HTML")
-            return
-
-        parts = args[1].split("_", 2)
-        if len(parts) < 3:
-            await message.answer("Некорректный формат ссылки. Пожалуйста, попробуйте еще раз.", parse_mode="HTML")
-            return
-
-        try:
-            survey_id = int(parts[1])
-            chat_id = int(parts[2])
-        except ValueError:
-            await message.answer("Некорректные идентификаторы опроса или чата.", parse_mode="HTML")
-            return
-
-        questions = get_questions_by_survey(survey_id)
-        survey_name = get_survey_name_by_id(survey_id)
-        if not questions:
+        param = args[1] if len(args) > 1 else ""
+        token = parse_survey_token(param)
+        if token is not None:
+            version_id, group_id = token
+        else:
+            legacy = parse_legacy_survey_param(param)
+            if legacy is None:
+                await message.answer("Опрос не найден. Пожалуйста, попробуйте еще раз.", parse_mode="HTML")
+                return
+            survey_id, group_id = legacy
+            if not get_group_info_by_chat_id(group_id):
+                await message.answer("Информация о группе не найдена.", parse_mode="HTML")
+                return
+            version_id = get_latest_version_id(survey_id)
+
+        version = get_survey_version(version_id) if version_id else None
+        # Подписанная ссылка могла остаться от удаленного опроса
+        if not version or not version[2] or get_survey_name_by_id(version[0]) is None:
             await message.answer("Опрос не найден или не содержит вопросов.", parse_mode="HTML")
             return
-
-        group_info = get_group_info_by_chat_id(chat_id)
-        if not group_info:
-            await message.answer("Информация о группе не найдена.", parse_mode="HTML")
-            return
-        group_id, group_name = group_info
+        survey_id = version[0]
+        user = message.from_user
+        submission_id = start_submission(user.id, survey_id, version_id, group_id, user.first_name, user.last_name, user.username)
 
         await state.update_data(
             survey_id=survey_id,
-            survey_name=survey_name,
-            questions=questions,
+            version_id=version_id,
+            submission_id=submission_id,
             current_question=0,
-            responses=[],
+            choices=[],
+            selected=[],
             group_id=group_id,
-            group_name=group_name,
-            survey_date=datetime.now().strftime("%d-%m-%Y"),
         )
-        await self.ask_next_question(message, state)
+        schedule_reminder(message.from_user.id, survey_id, group_id, version_id)
+        await self.ask_next_question(message, state, message.from_user)
 
-    async def ask_next_question(self, message: Message, state: FSMContext):
+    async def ask_next_question(self, message: Message, state: FSMContext, user: User):
         data = await state.get_data()
         idx = data["current_question"]
-        questions = data["questions"]
+        version_id = data["version_id"]
+        version = get_survey_version(version_id)
+        if version is None:
+            await state.clear()
+            await message.answer("Опрос не найден или был удален.", parse_mode="HTML")
+            return
+        survey_id, survey_version, questions, layout = version
         if idx < len(questions):
-            await message.answer(questions[idx], parse_mode="HTML")
-            await state.set_state(SurveyStates.answering)
+            qtype, options = layout[idx]
+            if qtype in CHOICE_QTYPES:
+                markup = choice_keyboard(version_id, idx, qtype, options)
+                await message.answer(questions[idx], reply_markup=markup, parse_mode="HTML")
+                await state.set_state(SurveyStates.choosing)
+            else:
+                await message.answer(questions[idx], parse_mode="HTML")
+                await state.set_state(SurveyStates.answering)
         else:
-            await self.save_survey_results(message, state)
+            await self.save_survey_results(message, state, user)
+
+    async def resume_draft(self, state: FSMContext, user: User):
+        # Сессия потеряна после перезапуска: восстанавливаем ее из черновика анкеты
+        draft = get_draft_submission(user.id)
+        version = get_survey_version(draft[2]) if draft else None
+        if version is None:
+            return None
+        submission_id, survey_id, version_id, group_id, answers = draft
+        idx = len(answers)
+        await state.set_data({
+            "survey_id": survey_id,
+            "version_id": version_id,
+            "submission_id": submission_id,
+            "current_question": idx,
+            "choices": [[position, index] for position, answer, indexes in answers for index in indexes or ()],
+            "selected": [],
+            "group_id": group_id,
+        })
+        if idx < len(version[2]):
+            await state.set_state(SurveyStates.choosing if version[3][idx][0] in CHOICE_QTYPES else SurveyStates.answering)
+        return idx
+
+    async def resume_survey(self, message: Message, state: FSMContext):
+        if await self.resume_draft(state, message.from_user) is None:
+            return
+        if await state.get_state() == SurveyStates.answering.state:
+            await self.handle_survey_response(message, state)
+            return
+        await message.answer("Продолжаем опрос с того места, где вы остановились.", parse_mode="HTML")
+        await self.ask_next_question(message, state, message.from_user)
 
     async def handle_survey_response(self, message: Message, state: FSMContext):
         data = await state.get_data()
-        responses = data.get("responses", [])
-        responses.append(message.text)
-        await state.update_data(responses=responses, current_question=data["current_question"] + 1)
-        await self.ask_next_question(message, state)
+        answer_writer.add(await submission_id_for(state, data, message.from_user), data["current_question"], message.text)
+        await state.update_data(current_question=data["current_question"] + 1)
+        await self.ask_next_question(message, state, message.from_user)
 
-    async def save_survey_results(self, message: Message, state: FSMContext):
+    async def handle_text_instead_of_choice(self, message: Message):
+        await message.answer("Выберите вариант ответа с помощью кнопок под вопросом.", parse_mode="HTML")
+
+    async def handle_choice(self, call: CallbackQuery, callback_data: ChoiceCallback, state: FSMContext):
         data = await state.get_data()
-        responses = [
-            {"question": q, "answer": a}
-            for q, a in zip(data["questions"], data["responses"])
-        ]
+        idx = data["current_question"]
+        if callback_data.version_id != data["version_id"] or callback_data.position != idx:
+            await call.answer("Этот вопрос уже неактуален.")
+            return
+        version = get_survey_version(data["version_id"])
+        if version is None:
+            await state.clear()
+            await call.answer("Опрос не найден или был удален.")
+            return
+        survey_id, survey_version, questions, layout = version
+        qtype, options = layout[idx]
+        option = callback_data.option
+
+        if qtype == QTYPE_MULTI and option != DONE_OPTION:
+            if not 0 <= option < len(options):
+                await call.answer()
+                return
+            selected = set(data.get("selected", [])) ^ {option}
+            await state.update_data(selected=sorted(selected))
+            await call.message.edit_reply_markup(
+                reply_markup=choice_keyboard(data["version_id"], idx, qtype, options, selected)
+            )
+            await call.answer()
+            return
 
-        user = message.from_user
-        dm_save_to_excel(
-            user_id=user.id,
-            first_name=user.first_name,
-            last_name=user.last_name or "",
-            username=user.username or "",
-            group_id=data.get("group_id"),
-            group_name=data.get("group_name"),
-            survey_date=data.get("survey_date"),
-            responses=responses,
-            survey_name=data["survey_name"],
+        if qtype == QTYPE_MULTI:
+            indexes = data.get("selected", [])
+            if not indexes:
+                await call.answer("Выберите хотя бы один вариант.")
+                return
+        elif 0 <= option < len(options):
+            indexes = [option]
+        else:
+            await call.answer()
+            return
+
+        answer = answer_text(options, indexes)
+        answer_writer.add(await submission_id_for(state, data, call.from_user), idx, answer, indexes)
+        await state.update_data(
+            choices=data.get("choices", []) + [[idx, index] for index in indexes],
+            selected=[],
+            current_question=idx + 1,
         )
+        await call.message.edit_text(f"{questions[idx]}\n\nВаш ответ: {html.quote(answer)}", parse_mode="HTML")
+        await call.answer()
+        await self.ask_next_question(call.message, state, call.from_user)
+
+    async def handle_stale_choice(self, call: CallbackQuery, callback_data: ChoiceCallback, state: FSMContext):
+        if await state.get_state() is None and await self.resume_draft(state, call.from_user) is not None:
+            if await state.get_state() == SurveyStates.choosing.state:
+                await self.handle_choice(call, callback_data, state)
+            else:
+                await call.answer()
+                await self.ask_next_question(call.message, state, call.from_user)
+            return
+        await call.answer("Опрос уже завершен или не начат.")
+
+    async def save_survey_results(self, message: Message, state: FSMContext, user: User):
+        data = await state.get_data()
+        survey_id = get_survey_version(data["version_id"])[0]
+        submission_id = await submission_id_for(state, data, user)
+        # Ответы уже в базе: дописываем последнюю пачку и закрываем черновик
+        await answer_writer.flush()
+        if not complete_submission(submission_id):
+            # Черновик уже завершен или удален по сроку хранения
+            cancel_reminder(user.id, survey_id)
+            await state.clear()
+            await message.answer(SESSION_EXPIRED, parse_mode="HTML")
+            return
+        index_facets(submission_id)
+        record_choice_votes(data["version_id"], data.get("group_id"), data.get("choices", []))
+        record_completion(data["version_id"], data.get("group_id"))
+        cancel_reminder(user.id, survey_id)
+        schedule_live_refresh(self.bot, survey_id, data.get("group_id"))
         await message.answer("Спасибо за ваши ответы! Ваши данные сохранены.", parse_mode="HTML")
         await unrestrict_user_if_needed(self.bot, user.id)
         await state.clear()
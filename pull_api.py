@@ -0,0 +1,146 @@
+import os
+import csv
+import io
+import hmac
+import asyncio
+import logging
+from datetime import datetime
+from aiohttp import web
+from dotenv import load_dotenv
+from db_manager import get_survey_list, get_submissions_since
+from fast_profile import json_dumps
+
+load_dotenv()
+
+# Локальный HTTP API для аналитики: потоковая выгрузка завершенных анкет.
+#   GET /surveys
+#   GET /surveys/<id>/submissions?since=<курсор>&format=ndjson|csv&limit=<анкет>
+# Курсор — поле cursor последней полученной анкеты; следующий запрос с since=<курсор>
+# вернет только анкеты, завершенные после нее
+ENABLE_PULL_API = os.getenv('ENABLE_PULL_API', 'False').lower() == 'true'
+PULL_API_HOST = os.getenv('PULL_API_HOST', '127.0.0.1')
+PULL_API_PORT = int(os.getenv('PULL_API_PORT', '8090'))
+# Если задан, запросы должны передавать заголовок Authorization: Bearer <токен>
+PULL_API_TOKEN = os.getenv('PULL_API_TOKEN', '')
+# Сколько анкет читается из базы за один запрос к ней
+PULL_API_PAGE_SIZE = int(os.getenv('PULL_API_PAGE_SIZE', '500'))
+
+CSV_COLUMNS = [
+    'cursor', 'submission_id', 'user_id', 'first_name', 'last_name', 'username', 'group_id',
+    'completed_at', 'version', 'position', 'question', 'answer',
+]
+
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+
+def ndjson_lines(submissions):
+    for submission in submissions:
+        record = {
+            'cursor': submission['completed_seq'],
+            'submission_id': submission['id'],
+            'user_id': submission['user_id'],
+            'first_name': submission['first_name'],
+            'last_name': submission['last_name'],
+            'username': submission['username'],
+            'group_id': submission['group_id'],
+            'linked_groups': submission['linked_groups'],
+            'completed_at': iso_time(submission['completed_at']),
+            'version': submission['version'],
+            'answers': submission['answers'],
+        }
+        yield json_dumps(record) + '\n'
+
+
+def csv_lines(submissions, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for submission in submissions:
+        completed_at = iso_time(submission['completed_at'])
+        for answer in submission['answers']:
+            writer.writerow([
+                submission['completed_seq'], submission['id'], submission['user_id'],
+                submission['first_name'], submission['last_name'], submission['username'],
+                submission['group_id'], completed_at, submission['version'],
+                answer['position'], answer['question'], answer['answer'],
+            ])
+    return buffer.getvalue()
+
+
+def parse_int(request, name, default):
+    value = request.query.get(name, '')
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+
+
+@web.middleware
+async def auth_middleware(request, handler):
+    authorization = request.headers.get('Authorization', '')
+    if PULL_API_TOKEN and not hmac.compare_digest(authorization, f"Bearer {PULL_API_TOKEN}"):
+        raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+async def list_surveys(request):
+    surveys = await asyncio.to_thread(get_survey_list)
+    return web.json_response([{'id': survey_id, 'name': name} for survey_id, name in surveys], dumps=json_dumps)
+
+
+async def stream_submissions(request):
+    survey_id = int(request.match_info['survey_id'])
+    since = parse_int(request, 'since', 0)
+    limit = parse_int(request, 'limit', 0)
+    output = request.query.get('format', 'ndjson')
+    if output not in ('ndjson', 'csv'):
+        raise web.HTTPBadRequest(text="format must be ndjson or csv")
+
+    response = web.StreamResponse()
+    response.content_type = 'application/x-ndjson' if output == 'ndjson' else 'text/csv'
+    response.charset = 'utf-8'
+    await response.prepare(request)
+    sent = 0
+    while not limit or sent < limit:
+        page_size = min(PULL_API_PAGE_SIZE, limit - sent) if limit else PULL_API_PAGE_SIZE
+        # Чтение идет в отдельном потоке через соединение только для чтения
+        submissions = await asyncio.to_thread(get_submissions_since, survey_id, since, page_size)
+        if not submissions:
+            break
+        if output == 'ndjson':
+            chunk = ''.join(ndjson_lines(submissions))
+        else:
+            chunk = csv_lines(submissions, header=sent == 0)
+        await response.write(chunk.encode('utf-8'))
+        sent += len(submissions)
+        since = submissions[-1]['completed_seq']
+        if len(submissions) < page_size:
+            break
+    if output == 'csv' and sent == 0:
+        await response.write(csv_lines([], header=True).encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+def make_app():
+    app = web.Application(middlewares=[auth_middleware])
+    app.router.add_get('/surveys', list_surveys)
+    app.router.add_get(r'/surveys/{survey_id:\d+}/submissions', stream_submissions)
+    return app
+
+
+async def serve_pull_api(host=PULL_API_HOST, port=PULL_API_PORT):
+    # Работает до отмены задачи при остановке бота
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logging.info("Pull API listening on %s:%s", host, port)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
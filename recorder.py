@@ -0,0 +1,97 @@
+import os
+import gzip
+import hmac
+import time
+import queue
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from fast_profile import json_dumps
+
+RECORD_DIR = os.getenv('RECORD_DIR', "recordings")
+# Ключ псевдонимизации. Без него ключ случайный для каждого процесса, и один и тот же
+# пользователь в записях разных воркеров получит разные идентификаторы
+RECORD_SALT = os.getenv('RECORD_SALT', '')
+
+# Поля, в которых Telegram передает объект пользователя
+USER_FIELDS = {
+    'from', 'user', 'new_chat_member', 'left_chat_member',
+    'new_chat_participant', 'left_chat_participant', 'new_chat_members',
+}
+PERSONAL_FIELDS = ('last_name', 'username', 'phone_number', 'bio')
+
+
+def pseudonym(user_id: int, salt: bytes) -> int:
+    # Стабильный в пределах ключа положительный идентификатор вместо настоящего
+    digest = hmac.new(salt, str(user_id).encode(), hashlib.sha256).digest()
+    return 10 ** 9 + int.from_bytes(digest[:6], 'big') % (9 * 10 ** 9)
+
+
+def anonymize_user(user: dict, salt: bytes):
+    if user.get('is_bot'):
+        return user
+    user = dict(user)
+    user['id'] = pseudonym(user['id'], salt)
+    user['first_name'] = f"User{user['id']}"
+    for field in PERSONAL_FIELDS:
+        user.pop(field, None)
+    return user
+
+
+def anonymize(value, salt: bytes, field=None):
+    if isinstance(value, list):
+        return [anonymize(item, salt, field) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if field in USER_FIELDS and 'is_bot' in value:
+        value = anonymize_user(value, salt)
+    elif field in ('chat', 'sender_chat') and value.get('type') == 'private':
+        # Личный чат имеет тот же идентификатор, что и пользователь
+        value = anonymize_user(dict(value, is_bot=False), salt)
+        value.pop('is_bot')
+    return {key: anonymize(item, salt, key) for key, item in value.items()}
+
+
+class UpdateRecorder(BaseMiddleware):
+    # Записывает входящие апдейты в сжатый JSONL для последующего воспроизведения
+    # (replay.py). Сериализация и сжатие выполняются в отдельном потоке
+    def __init__(self, directory: str = RECORD_DIR, salt: str = RECORD_SALT):
+        self.salt = salt.encode() if salt else os.urandom(16)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"updates-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl.gz")
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.writer, name="update-recorder", daemon=True)
+        self.thread.start()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.closed:
+            self.queue.put((time.time(), event))
+        return await handler(event, data)
+
+    def writer(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                ts, event = item
+                raw = event.model_dump(mode='json', exclude_none=True, by_alias=True)
+                record = {'ts': round(ts, 3), 'update': anonymize(raw, self.salt)}
+                f.write(json_dumps(record) + '\n')
+
+    def close(self):
+        # Дописывает очередь и закрывает gzip-поток, иначе файл останется без концовки
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(timeout=10)
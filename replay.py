@@ -0,0 +1,181 @@
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import shutil
+import tempfile
+from aiohttp import web
+from aiogram.types import Update
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from stub_bot_api import StubBotAPI
+from fast_profile import install_event_loop, json_loads
+
+# Воспроизведение записанных апдейтов (recorder.py) через диспетчер бота
+# и заглушку Bot API. Каждый прогон выполняется в чистом рабочем каталоге,
+# поэтому одна и та же запись дает один и тот же входной поток.
+# Ссылки на опросы в записанных /start подписаны ключом рабочего бота
+# (DEEPLINK_SECRET, а без него TELEGRAM_TOKEN). Бот в прогоне работает с
+# фиктивным токеном, поэтому ключ передается явно через --deeplink-secret или
+# переменную окружения, иначе такие /start отклоняются как неверные ссылки.
+# Запуск: python replay.py recordings/updates-*.jsonl.gz --speed 0 --deeplink-secret "$DEEPLINK_SECRET"
+
+
+def load_recording(paths):
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json_loads(line)
+                    records.append((record.get('ts', 0.0), record.get('update', record)))
+    # Записи нескольких воркеров сливаются в общий поток по времени получения
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def replay(records, speed=0.0, concurrency=0, latency=0.0, deeplink_secret=None):
+    stub = StubBotAPI([], latency=latency)
+    runner = web.AppRunner(stub.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    # Бот импортируется после настройки окружения: адрес API читается при импорте
+    os.environ['TELEGRAM_API_SERVER'] = f"http://127.0.0.1:{port}"
+    if deeplink_secret:
+        os.environ['DEEPLINK_SECRET'] = deeplink_secret
+    elif not os.getenv('DEEPLINK_SECRET') and not os.getenv('TELEGRAM_TOKEN'):
+        print("warning: no --deeplink-secret: signed survey links in the recording will be rejected", file=sys.stderr)
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:replay')
+    os.environ.setdefault('ADMIN_IDS', '1')
+    os.environ.setdefault('ENABLE_RETENTION', 'False')
+    os.environ.setdefault('LOGGING_LEVEL', 'WARNING')
+    import bot as bot_module
+    dp, bot = bot_module.dp, bot_module.bot
+
+    workflow_data = {'dispatcher': dp, 'bots': [bot], 'worker_index': 0, **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    # Апдейты одного пользователя (или чата) обрабатываются строго по порядку,
+    # как у воркера в многопроцессном режиме; разные пользователи — параллельно
+    chains = {}
+
+    def order_key(update):
+        context = UserContextMiddleware.resolve_event_context(Update.model_validate(update, context={'bot': bot}))
+        return context.user_id or context.chat_id or update.get('update_id')
+
+    async def process(update, previous):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            errors += 1
+        finally:
+            latencies.append(time.perf_counter() - started)
+            if semaphore:
+                semaphore.release()
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    first_ts = records[0][0] if records else 0.0
+    started = loop.time()
+    for ts, update in records:
+        if speed:
+            # Исходные интервалы между апдейтами, ускоренные в speed раз
+            delay = (ts - first_ts) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if semaphore:
+            await semaphore.acquire()
+        key = order_key(update)
+        task = asyncio.create_task(process(update, chains.get(key)))
+        chains[key] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    processed_at = loop.time()
+
+    # Остановка дожидается отправки всего, что осталось в очереди исходящих
+    await dp.emit_shutdown(bot=bot, **workflow_data)
+    finished_at = loop.time()
+    await bot.session.close()
+    await runner.cleanup()
+
+    latencies.sort()
+    elapsed = processed_at - started
+    return {
+        'updates': len(records),
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'drain': round(finished_at - processed_at, 3),
+        'throughput': round(len(records) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(percentile(latencies, q) * 1000, 2)
+            for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+        'calls': dict(sorted(stub.calls.items(), key=lambda item: -item[1])),
+    }
+
+
+def print_report(report):
+    print(f"updates: {report['updates']} (errors: {report['errors']})")
+    print(f"elapsed: {report['elapsed']} s, throughput: {report['throughput']} updates/s, drain: {report['drain']} s")
+    latency = report['latency_ms']
+    print(f"latency ms: p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}, max {latency['max']}")
+    print(f"outbound calls: {sum(report['calls'].values())}")
+    for method, count in report['calls'].items():
+        print(f"  {method}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов через диспетчер бота")
+    parser.add_argument('recordings', nargs='+', help="Файлы записи (.jsonl или .jsonl.gz)")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="0 — как можно быстрее, 1 — в исходном темпе, N — в N раз быстрее")
+    parser.add_argument('--concurrency', type=int, default=0, help="Ограничение одновременно обрабатываемых апдейтов")
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа заглушки Bot API, секунды")
+    parser.add_argument('--workdir', help="Рабочий каталог (база, файлы результатов); по умолчанию временный")
+    parser.add_argument('--db', help="Копия базы, с которой начинается прогон (группы, опросы)")
+    parser.add_argument('--deeplink-secret', default=os.getenv('DEEPLINK_SECRET'),
+                        help="Ключ подписи ссылок на опросы рабочего бота (DEEPLINK_SECRET или, если он не задан, "
+                             "TELEGRAM_TOKEN); по умолчанию из переменной DEEPLINK_SECRET")
+    parser.add_argument('--json', action='store_true', help="Вывести отчет в JSON")
+    args = parser.parse_args()
+
+    records = load_recording(args.recordings)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='replay-')
+    os.makedirs(workdir, exist_ok=True)
+    if args.db:
+        # Исходная база не меняется: прогон работает с ее копией
+        shutil.copy(args.db, os.path.join(workdir, os.path.basename(os.getenv('DB_FILE', "surveys.db"))))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    install_event_loop()
+    report = asyncio.run(replay(records, args.speed, args.concurrency, args.latency, args.deeplink_secret))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from db_manager import purge_stale_pending_users, purge_finished_jobs, purge_stale_drafts, compact_db
+from data_manager import archive_old_responses, archive_old_submissions
+
+# Политика хранения. Значение 0 отключает соответствующий шаг
+RESPONSES_RETENTION_DAYS = int(os.getenv('RESPONSES_RETENTION_DAYS', '0'))
+PENDING_RETENTION_DAYS = int(os.getenv('PENDING_RETENTION_DAYS', '7'))
+JOBS_RETENTION_DAYS = int(os.getenv('JOBS_RETENTION_DAYS', '30'))
+# Незавершенные анкеты, к которым пользователь не вернулся
+DRAFTS_RETENTION_DAYS = int(os.getenv('DRAFTS_RETENTION_DAYS', '30'))
+# Час (по локальному времени сервера), в который выполняется обслуживание
+RETENTION_QUIET_HOUR = int(os.getenv('RETENTION_QUIET_HOUR', '4'))
+VACUUM_MAX_PAGES = int(os.getenv('VACUUM_MAX_PAGES', '0'))
+
+
+def run_retention(now=None):
+    now = now or datetime.now()
+    if RESPONSES_RETENTION_DAYS:
+        cutoff = now - timedelta(days=RESPONSES_RETENTION_DAYS)
+        archived = archive_old_responses(cutoff) + archive_old_submissions(cutoff)
+        logging.info("Retention: archived %s old responses", archived)
+    if PENDING_RETENTION_DAYS:
+        removed = purge_stale_pending_users(time.time() - PENDING_RETENTION_DAYS * 86400)
+        logging.info("Retention: purged %s stale pending users", removed)
+    if DRAFTS_RETENTION_DAYS:
+        removed = purge_stale_drafts(time.time() - DRAFTS_RETENTION_DAYS * 86400)
+        logging.info("Retention: purged %s stale survey drafts", removed)
+    if JOBS_RETENTION_DAYS:
+        removed = purge_finished_jobs(time.time() - JOBS_RETENTION_DAYS * 86400)
+        logging.info("Retention: purged %s finished jobs", removed)
+    compact_db(VACUUM_MAX_PAGES or None)
+    logging.info("Retention: database compacted")
+
+
+def seconds_until_quiet_hour(now=None):
+    now = now or datetime.now()
+    next_run = now.replace(hour=RETENTION_QUIET_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def retention_loop():
+    while True:
+        await asyncio.sleep(seconds_until_quiet_hour())
+        try:
+            # Чтение и перезапись книг Excel и VACUUM не должны блокировать цикл событий
+            await asyncio.to_thread(run_retention)
+        except Exception as e:
+            logging.error("Retention run failed: %s", e)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run_retention()
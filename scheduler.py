@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+import metrics
+from announce import announce_survey
+from deeplink import survey_deep_link
+from outbound import outbound_priority, BROADCAST
+from db_manager import (
+    add_job,
+    add_jobs,
+    claim_due_jobs,
+    finish_job,
+    retry_job,
+    cancel_jobs,
+    get_next_job_time,
+    requeue_running_jobs,
+    get_pending_jobs,
+    get_all_groups,
+    get_survey_name_by_id,
+    get_latest_version_id,
+    publish_survey_version,
+    JOB_FAILED,
+    JOB_CANCELLED,
+)
+
+# Сколько наступивших задач забирается из базы за один проход
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '50'))
+# Максимальный интервал между проверками базы (задачи могут добавлять другие процессы)
+SCHEDULER_POLL_INTERVAL = float(os.getenv('SCHEDULER_POLL_INTERVAL', '30'))
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv('SCHEDULER_MAX_ATTEMPTS', '3'))
+# Запланированная рассылка опроса растягивается по группам на это окно (секунды)
+PUBLISH_SPREAD_WINDOW = float(os.getenv('PUBLISH_SPREAD_WINDOW', '600'))
+# Через сколько часов напомнить о незавершенном опросе. 0 отключает напоминания
+SURVEY_REMINDER_DELAY_HOURS = float(os.getenv('SURVEY_REMINDER_DELAY_HOURS', '24'))
+
+job_handlers = {}
+wakeup = None
+
+
+def job_handler(kind):
+    def register(handler):
+        job_handlers[kind] = handler
+        return handler
+    return register
+
+
+def schedule_job(kind, run_at, payload=None, job_key=None):
+    job_id = add_job(kind, run_at, payload, job_key)
+    # Цикл в этом же процессе просыпается сразу, остальные увидят задачу при следующей проверке
+    if wakeup is not None:
+        wakeup.set()
+    return job_id
+
+
+def schedule_publication(survey_id, run_at):
+    return schedule_job('publish_survey', run_at, {'survey_id': survey_id})
+
+
+def upcoming_publications(limit=20):
+    return [
+        (job_id, run_at, payload['survey_id'], get_survey_name_by_id(payload['survey_id']))
+        for job_id, run_at, payload in get_pending_jobs('publish_survey', limit)
+    ]
+
+
+def reminder_key(user_id, survey_id):
+    return f"reminder:{user_id}:{survey_id}"
+
+
+def schedule_reminder(user_id, survey_id, group_id, version_id=None):
+    if not SURVEY_REMINDER_DELAY_HOURS:
+        return
+    key = reminder_key(user_id, survey_id)
+    # Повторный старт опроса переносит напоминание
+    cancel_jobs(job_key=key)
+    schedule_job(
+        'survey_reminder',
+        time.time() + SURVEY_REMINDER_DELAY_HOURS * 3600,
+        {'user_id': user_id, 'survey_id': survey_id, 'group_id': group_id, 'version_id': version_id},
+        job_key=key,
+    )
+
+
+def cancel_reminder(user_id, survey_id):
+    if SURVEY_REMINDER_DELAY_HOURS:
+        cancel_jobs(job_key=reminder_key(user_id, survey_id))
+
+
+@job_handler('publish_survey')
+async def publish_survey_job(bot: Bot, survey_id):
+    # Рассылка превращается в отдельные задачи по группам, равномерно
+    # распределенные по окну, чтобы не упираться в лимиты Telegram
+    version_id = publish_survey_version(survey_id)
+    groups = get_all_groups()
+    if version_id is None or not groups:
+        return
+    now = time.time()
+    step = PUBLISH_SPREAD_WINDOW / len(groups)
+    add_jobs([
+        ('announce_survey', now + index * step, {'survey_id': survey_id, 'version_id': version_id, 'group_id': group_id}, None)
+        for index, (group_id, group_title) in enumerate(groups)
+    ])
+    logging.info("Survey %s scheduled to %s groups over %s seconds", survey_id, len(groups), PUBLISH_SPREAD_WINDOW)
+
+
+@job_handler('announce_survey')
+async def announce_survey_job(bot: Bot, survey_id, version_id, group_id):
+    with outbound_priority(BROADCAST):
+        await announce_survey(bot, survey_id, version_id, group_id)
+
+
+@job_handler('survey_reminder')
+async def survey_reminder_job(bot: Bot, user_id, survey_id, group_id, version_id=None):
+    survey_name = get_survey_name_by_id(survey_id)
+    if survey_name is None:
+        return
+    bot_user = await bot.me()
+    # Ссылка ведет на ту же версию опроса, что и начатая сессия
+    deep_link = survey_deep_link(bot_user.username, version_id or get_latest_version_id(survey_id), group_id)
+    text = (
+        f"Напоминаем: вы начали опрос «{survey_name}», но не завершили его. "
+        f"Ответьте на текущий вопрос или пройдите опрос заново по <a href=\"{deep_link}\">ссылке</a>."
+    )
+    try:
+        with outbound_priority(BROADCAST):
+            await bot.send_message(chat_id=user_id, text=text, parse_mode='HTML')
+    except TelegramForbiddenError:
+        # Пользователь заблокировал бота — повторять бессмысленно
+        logging.info("Reminder for user %s skipped: bot is blocked", user_id)
+
+
+async def run_job(bot: Bot, job_id, kind, payload, attempts):
+    handler = job_handlers.get(kind)
+    if handler is None:
+        finish_job(job_id, JOB_FAILED, f"unknown job kind {kind}")
+        return
+    # Публикации, объявления и напоминания удаленного опроса больше не нужны
+    if 'survey_id' in payload and get_survey_name_by_id(payload['survey_id']) is None:
+        finish_job(job_id, JOB_CANCELLED, "survey deleted")
+        metrics.inc(f'scheduler.cancelled.{kind}')
+        return
+    try:
+        await handler(bot, **payload)
+    except Exception as e:
+        if attempts + 1 >= SCHEDULER_MAX_ATTEMPTS:
+            logging.error("Job %s (%s) failed: %s", job_id, kind, e)
+            finish_job(job_id, JOB_FAILED, str(e))
+            metrics.inc(f'scheduler.failed.{kind}')
+        else:
+            logging.warning("Job %s (%s) failed, will retry: %s", job_id, kind, e)
+            retry_job(job_id, time.time() + 60 * 2 ** attempts, str(e))
+        return
+    finish_job(job_id)
+    metrics.inc(f'scheduler.done.{kind}')
+
+
+async def scheduler_loop(bot: Bot):
+    global wakeup
+    wakeup = asyncio.Event()
+    requeued = requeue_running_jobs()
+    if requeued:
+        logging.info("Scheduler: requeued %s interrupted jobs", requeued)
+    while True:
+        wakeup.clear()
+        try:
+            jobs = claim_due_jobs(time.time(), SCHEDULER_BATCH_SIZE)
+            next_run = None if jobs else get_next_job_time()
+        except Exception as e:
+            logging.error("Scheduler failed to load jobs: %s", e)
+            jobs, next_run = [], None
+        if jobs:
+            await asyncio.gather(*(run_job(bot, *job) for job in jobs))
+            continue
+        timeout = SCHEDULER_POLL_INTERVAL
+        if next_run is not None:
+            timeout = min(max(0.0, next_run - time.time()), SCHEDULER_POLL_INTERVAL)
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
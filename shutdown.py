@@ -0,0 +1,88 @@
+import os
+import asyncio
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+import metrics
+
+# Сколько секунд при остановке ждать завершения начатой работы
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '25'))
+
+# Функции, которые сбрасывают на диск накопленные в памяти данные перед остановкой
+flush_callbacks = []
+
+
+def register_flush(callback):
+    flush_callbacks.append(callback)
+    return callback
+
+
+class InflightTracker(BaseMiddleware):
+    # Считает апдейты, которые сейчас обрабатываются, чтобы при остановке дождаться их
+    def __init__(self):
+        self.inflight = 0
+        self.accepting = True
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.accepting:
+            # Апдейт не подтвержден следующим getUpdates и придет снова после перезапуска
+            metrics.inc('shutdown.rejected_updates')
+            return None
+        self.inflight += 1
+        self.idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight -= 1
+            if not self.inflight:
+                self.idle.set()
+
+    async def drain(self, timeout: float):
+        self.accepting = False
+        if self.inflight:
+            logging.info("Waiting for %s in-flight updates", self.inflight)
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Shutdown deadline reached with %s updates still in flight", self.inflight)
+
+
+tracker = InflightTracker()
+
+
+async def graceful_shutdown(timeout: float = SHUTDOWN_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    await tracker.drain(timeout)
+    for callback in flush_callbacks:
+        remaining = max(0.0, deadline - loop.time())
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                await asyncio.wait_for(result, remaining)
+        except asyncio.TimeoutError:
+            logging.warning("Flush %s did not finish before the shutdown deadline", getattr(callback, '__qualname__', callback))
+        except Exception as e:
+            logging.error("Flush %s failed: %s", getattr(callback, '__qualname__', callback), e)
+    logging.info("Shutdown complete")
+
+
+def install_shutdown(dp):
+    dp.update.outer_middleware(tracker)
+
+    async def on_shutdown():
+        await graceful_shutdown()
+
+    # Диспетчер закрывает FSM-хранилище в своем обработчике shutdown; наш должен
+    # выполниться раньше, пока незавершенные обработчики еще могут сохранить состояние
+    dp.shutdown.register(on_shutdown)
+    dp.shutdown.handlers.insert(0, dp.shutdown.handlers.pop())
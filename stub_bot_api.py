@@ -0,0 +1,150 @@
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+# Локальная заглушка Bot API для нагрузочных прогонов без Telegram.
+# Запуск: python stub_bot_api.py --synthetic 10000 --users 500
+# и затем бот с TELEGRAM_API_SERVER=http://127.0.0.1:8081
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+MESSAGE_METHODS = {
+    'sendmessage', 'senddocument', 'sendphoto', 'copymessage', 'forwardmessage',
+    'editmessagetext', 'editmessagereplymarkup',
+}
+
+
+def fake_result(method: str, params: dict, message_id: int):
+    # Ответ, достаточный для того, чтобы aiogram смог разобрать результат вызова
+    method = method.lower()
+    if method == 'getme':
+        return BOT_USER
+    if method in MESSAGE_METHODS:
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get('text') or "",
+        }
+    if method == 'getchat':
+        chat_id = int(params.get('chat_id') or 0)
+        return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup", "accent_color_id": 0, "max_reaction_count": 0}
+    return True
+
+
+def load_updates(path: str):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield record.get('update', record)
+
+
+def synthetic_updates(count: int, users: int):
+    # Каждый пользователь пишет боту в личку: нагрузка равномерно распределяется по шардам
+    for i in range(count):
+        user_id = 100000 + i % users
+        yield {
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "text": "/start",
+            }
+        }
+
+
+class StubBotAPI:
+    def __init__(self, updates, latency: float = 0.0):
+        self.pending = []
+        for update_id, update in enumerate(updates, start=1):
+            update = dict(update)
+            update['update_id'] = update_id
+            self.pending.append(update)
+        self.total = len(self.pending)
+        self.cursor = 0
+        self.latency = latency
+        self.calls = Counter()
+        self.message_id = 0
+        self.delivered = 0
+        self.started_at = None
+        self.last_call_at = None
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        if method.lower() == 'getupdates':
+            return web.json_response({"ok": True, "result": await self.get_updates(params)})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.message_id += 1
+        self.last_call_at = time.monotonic()
+        return web.json_response({"ok": True, "result": fake_result(method, params, self.message_id)})
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        # Подтвержденные апдейты (update_id < offset) больше не отдаем
+        while self.cursor < self.total and self.pending[self.cursor]['update_id'] < offset:
+            self.cursor += 1
+        self.delivered = self.cursor
+        if self.cursor >= self.total:
+            await asyncio.sleep(min(timeout, 1.0))
+            return []
+        return self.pending[self.cursor:self.cursor + limit]
+
+    async def stats(self, request: web.Request):
+        elapsed = (self.last_call_at or time.monotonic()) - (self.started_at or time.monotonic())
+        return web.json_response({
+            "updates_total": self.total,
+            "updates_delivered": self.delivered,
+            "elapsed": elapsed,
+            "calls": dict(self.calls),
+        })
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API для локальных тестов")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('STUB_BOT_API_PORT', '8081')))
+    parser.add_argument('--updates', help="JSONL (можно .gz) с апдейтами для выдачи через getUpdates")
+    parser.add_argument('--synthetic', type=int, default=0, help="Сгенерировать N синтетических сообщений")
+    parser.add_argument('--users', type=int, default=100, help="Число разных пользователей для --synthetic")
+    parser.add_argument('--latency', type=float, default=0.0, help="Искусственная задержка ответа, секунды")
+    args = parser.parse_args()
+
+    if args.updates:
+        updates = list(load_updates(args.updates))
+    else:
+        updates = list(synthetic_updates(args.synthetic, args.users))
+    stub = StubBotAPI(updates, latency=args.latency)
+    print(f"Stub Bot API on http://{args.host}:{args.port}, {stub.total} updates queued", file=sys.stderr)
+    web.run_app(stub.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,122 +1,272 @@
 import logging
-from aiogram import Router, Bot, F, Dispatcher
-from aiogram.types import Message
-from aiogram.filters import CommandStart
+from aiogram import Router, Bot, F, Dispatcher, html
+from aiogram.types import Message, CallbackQuery, User
+from aiogram.filters import CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from db_manager import get_questions_by_survey, get_survey_name_by_id, get_group_info_by_chat_id
-from data_manager import save_to_excel as dm_save_to_excel
+from db_manager import (
+    get_group_info_by_chat_id,
+    get_latest_version_id,
+    get_survey_version,
+    get_survey_name_by_id,
+    record_choice_votes,
+    record_completion,
+    start_submission,
+    complete_submission,
+    get_draft_submission,
+    CHOICE_QTYPES,
+    QTYPE_MULTI,
+)
+from callbacks import ChoiceCallback
+from deeplink import parse_survey_token, parse_legacy_survey_param
+from choices import choice_keyboard, answer_text, DONE_OPTION
+from live_results import schedule_live_refresh
+from scheduler import schedule_reminder, cancel_reminder
+from answer_writer import answer_writer
+from facets import index_facets
 from group_event import unrestrict_user_if_needed
-from datetime import datetime
 
 router = Router()
 
+SESSION_EXPIRED = "Сессия опроса истекла. Чтобы пройти опрос заново, откройте ссылку из группы еще раз."
+
 class SurveyState(StatesGroup):
     answering = State()
+    choosing = State()
 
 @router.message(CommandStart())
 async def start_survey(message: Message, state: FSMContext):
     args = message.text.split()
     user_id = message.from_user.id
-    logging.info(f"User {user_id} started survey with args: {args}")
+    logging.info("User %s started survey with args: %s", user_id, args)
 
-    if len(args) > 1 and args[1].startswith('survey_'):
-        parts = args[1].split('_', 2)
-        if len(parts) < 3:
-            await message.answer("Некорректный формат ссылки. Пожалуйста, попробуйте еще раз.", parse_mode='HTML')
-            logging.warning(f"User {user_id} provided invalid survey args: {args}")
+    param = args[1] if len(args) > 1 else ''
+    # Подписанная ссылка проверяется в памяти; версия опроса и чат берутся из нее,
+    # без запросов к базе
+    token = parse_survey_token(param)
+    if token is not None:
+        version_id, group_id = token
+    else:
+        legacy = parse_legacy_survey_param(param)
+        if legacy is None:
+            await message.answer("Опрос не найден. Пожалуйста, попробуйте еще раз.", parse_mode='HTML')
+            logging.warning("User %s provided invalid survey link: %s", user_id, args)
             return
-        survey_id_str = parts[1]
-        chat_id_str = parts[2]
-        try:
-            survey_id = int(survey_id_str)
-            chat_id = int(chat_id_str)
-        except ValueError:
-            await message.answer("Некорректные идентификаторы опроса или чата.", parse_mode='HTML')
-            logging.warning(f"User {user_id} provided invalid survey_id or chat_id: {args}")
+        # Старая ссылка survey_<id>_<chat_id>: идентификаторы проверяются по базе
+        survey_id, group_id = legacy
+        if not get_group_info_by_chat_id(group_id):
+            await message.answer("Информация о группе не найдена.", parse_mode='HTML')
+            logging.warning("Group info not found for chat_id %s", group_id)
             return
-    else:
-        await message.answer("Опрос не найден. Пожалуйста, попробуйте еще раз.", parse_mode='HTML')
-        logging.warning(f"User {user_id} did not provide survey ID.")
-        return
+        version_id = get_latest_version_id(survey_id)
 
-    questions = get_questions_by_survey(survey_id)
-    survey_name = get_survey_name_by_id(survey_id)
-    if not questions:
+    # Сессия закрепляется за конкретной версией опроса: правки администратора
+    # во время прохождения не меняют набор вопросов
+    version = get_survey_version(version_id) if version_id else None
+    # Подпись доказывает только то, что ссылку выдал бот: опрос мог быть удален
+    # после ее публикации (в другом воркере версия может еще оставаться в кэше)
+    if not version or not version[2] or get_survey_name_by_id(version[0]) is None:
         await message.answer("Опрос не найден или не содержит вопросов.", parse_mode='HTML')
-        logging.warning(f"Survey ID {survey_id} not found or has no questions.")
+        logging.warning("Survey version %s not found or has no questions.", version_id)
         return
-
-    # Получаем информацию о группе по chat_id
-    group_info = get_group_info_by_chat_id(chat_id)
-    if not group_info:
-        await message.answer("Информация о группе не найдена.", parse_mode='HTML')
-        logging.warning(f"Group info not found for chat_id {chat_id}")
-        return
-    group_id, group_name = group_info
+    survey_id = version[0]
+    user = message.from_user
+    # Черновик анкеты: ответы дописываются в него по мере прохождения
+    submission_id = start_submission(user_id, survey_id, version_id, group_id, user.first_name, user.last_name, user.username)
 
     await state.update_data(
         survey_id=survey_id,
-        survey_name=survey_name,
-        questions=questions,
+        version_id=version_id,
+        submission_id=submission_id,
         current_question=0,
-        responses=[],
+        choices=[],
+        selected=[],
         group_id=group_id,
-        group_name=group_name,
-        survey_date=datetime.now().strftime("%d-%m-%Y")  # Изменен формат даты
     )
-    logging.info(f"Survey session started for user {user_id} with survey '{survey_name}' (ID: {survey_id}) in group '{group_name}' (ID: {group_id})")
-    await ask_next_question(message, state)
+    logging.info("Survey session started for user %s with survey %s (version %s) in group %s", user_id, survey_id, version_id, group_id)
+    # Напоминание придет, если опрос не будет завершен вовремя
+    schedule_reminder(user_id, survey_id, group_id, version_id)
+    await ask_next_question(message, state, message.from_user)
 
-async def ask_next_question(message: Message, state: FSMContext):
+async def ask_next_question(message: Message, state: FSMContext, user: User):
     data_state = await state.get_data()
     current_question_index = data_state['current_question']
-    questions = data_state['questions']
+    version_id = data_state['version_id']
+    version = get_survey_version(version_id)
+    if version is None:
+        # Опрос удален, пока пользователь его проходил
+        await state.clear()
+        await message.answer("Опрос не найден или был удален.", parse_mode='HTML')
+        return
+    survey_id, survey_version, questions, layout = version
 
     if current_question_index < len(questions):
         question = questions[current_question_index]
-        await message.answer(question, parse_mode='HTML')
-        await state.set_state(SurveyState.answering)
+        qtype, options = layout[current_question_index]
+        if qtype in CHOICE_QTYPES:
+            markup = choice_keyboard(version_id, current_question_index, qtype, options)
+            await message.answer(question, reply_markup=markup, parse_mode='HTML')
+            await state.set_state(SurveyState.choosing)
+        else:
+            await message.answer(question, parse_mode='HTML')
+            await state.set_state(SurveyState.answering)
     else:
-        await save_survey_results(message, state)
+        await save_survey_results(message, state, user)
+
+async def submission_id_for(state: FSMContext, data_state: dict, user: User):
+    submission_id = data_state.get('submission_id')
+    if submission_id is None:
+        # Сессия начата до появления черновиков: накопленные ответы переносятся в базу
+        submission_id = start_submission(
+            user.id, data_state['survey_id'], data_state['version_id'], data_state.get('group_id'),
+            user.first_name, user.last_name, user.username
+        )
+        for position, answer in enumerate(data_state.get('responses', [])):
+            answer_writer.add(submission_id, position, answer)
+        await state.update_data(submission_id=submission_id, responses=[])
+    return submission_id
+
+async def resume_draft(state: FSMContext, user: User):
+    # Состояние потеряно (например, перезапуск с хранилищем в памяти): сессия
+    # восстанавливается из черновика. Возвращает номер текущего вопроса или None
+    draft = get_draft_submission(user.id)
+    if draft is None:
+        return None
+    submission_id, survey_id, version_id, group_id, answers = draft
+    version = get_survey_version(version_id)
+    if version is None:
+        return None
+    questions, layout = version[2], version[3]
+    position = len(answers)
+    await state.set_data({
+        'survey_id': survey_id,
+        'version_id': version_id,
+        'submission_id': submission_id,
+        'current_question': position,
+        'choices': [[answer_position, index] for answer_position, answer, indexes in answers for index in indexes or ()],
+        'selected': [],
+        'group_id': group_id,
+    })
+    if position < len(questions):
+        await state.set_state(SurveyState.choosing if layout[position][0] in CHOICE_QTYPES else SurveyState.answering)
+    logging.info("Survey session of user %s resumed from draft %s at question %s", user.id, submission_id, position)
+    return position
 
 @router.message(SurveyState.answering)
 async def handle_survey_response(message: Message, state: FSMContext):
     data_state = await state.get_data()
-    responses = data_state.get('responses', [])
-    responses.append(message.text)
-    await state.update_data(responses=responses, current_question=data_state['current_question'] + 1)
-    await ask_next_question(message, state)
+    position = data_state['current_question']
+    answer_writer.add(await submission_id_for(state, data_state, message.from_user), position, message.text)
+    await state.update_data(current_question=position + 1)
+    await ask_next_question(message, state, message.from_user)
 
-async def save_survey_results(message: Message, state: FSMContext):
-    data_state = await state.get_data()
-    user_id = message.from_user.id
-    survey_name = data_state['survey_name']
-    responses = [{'question': q, 'answer': a} for q, a in zip(data_state['questions'], data_state['responses'])]
+@router.message(SurveyState.choosing)
+async def handle_text_instead_of_choice(message: Message):
+    await message.answer("Выберите вариант ответа с помощью кнопок под вопросом.", parse_mode='HTML')
 
-    # Получение информации о пользователе
-    first_name = message.from_user.first_name
-    last_name = message.from_user.last_name if message.from_user.last_name else ""
-    username = message.from_user.username if message.from_user.username else ""
+@router.callback_query(ChoiceCallback.filter(), SurveyState.choosing)
+async def handle_choice(call: CallbackQuery, callback_data: ChoiceCallback, state: FSMContext):
+    data_state = await state.get_data()
+    position = data_state['current_question']
+    # Нажатие на клавиатуру уже отвеченного вопроса или другой версии опроса
+    if callback_data.version_id != data_state['version_id'] or callback_data.position != position:
+        await call.answer("Этот вопрос уже неактуален.")
+        return
+    version = get_survey_version(data_state['version_id'])
+    if version is None:
+        await state.clear()
+        await call.answer("Опрос не найден или был удален.")
+        return
+    survey_id, survey_version, questions, layout = version
+    qtype, options = layout[position]
+    option = callback_data.option
 
-    # Получение информации о группе
-    group_id = data_state.get('group_id')
-    group_name = data_state.get('group_name')
+    if qtype == QTYPE_MULTI and option != DONE_OPTION:
+        if not 0 <= option < len(options):
+            await call.answer()
+            return
+        selected = set(data_state.get('selected', []))
+        selected ^= {option}
+        await state.update_data(selected=sorted(selected))
+        await call.message.edit_reply_markup(
+            reply_markup=choice_keyboard(data_state['version_id'], position, qtype, options, selected)
+        )
+        await call.answer()
+        return
 
-    # Получение даты прохождения опроса
-    survey_date = data_state.get('survey_date')
+    if qtype == QTYPE_MULTI:
+        indexes = data_state.get('selected', [])
+        if not indexes:
+            await call.answer("Выберите хотя бы один вариант.")
+            return
+    elif 0 <= option < len(options):
+        indexes = [option]
+    else:
+        await call.answer()
+        return
 
-    dm_save_to_excel(
-        user_id=user_id,
-        first_name=first_name,
-        last_name=last_name,
-        username=username,
-        group_id=group_id,
-        group_name=group_name,
-        survey_date=survey_date,
-        responses=responses,
-        survey_name=survey_name
+    answer = answer_text(options, indexes)
+    answer_writer.add(await submission_id_for(state, data_state, call.from_user), position, answer, indexes)
+    await state.update_data(
+        choices=data_state.get('choices', []) + [[position, index] for index in indexes],
+        selected=[],
+        current_question=position + 1,
+    )
+    await call.message.edit_text(
+        f"{questions[position]}\n\nВаш ответ: {html.quote(answer)}", parse_mode='HTML'
     )
+    await call.answer()
+    await ask_next_question(call.message, state, call.from_user)
+
+@router.callback_query(ChoiceCallback.filter())
+async def handle_stale_choice(call: CallbackQuery, callback_data: ChoiceCallback, state: FSMContext):
+    if await state.get_state() is None and await resume_draft(state, call.from_user) is not None:
+        if await state.get_state() == SurveyState.choosing.state:
+            # Нажатие на клавиатуру другого вопроса handle_choice отклонит сам
+            await handle_choice(call, callback_data, state)
+        else:
+            await call.answer()
+            await ask_next_question(call.message, state, call.from_user)
+        return
+    await call.answer("Опрос уже завершен или не начат.")
+
+@router.message(StateFilter(None), F.chat.type == 'private', F.text, ~F.text.startswith('/'))
+async def resume_survey(message: Message, state: FSMContext):
+    if await resume_draft(state, message.from_user) is None:
+        return
+    if await state.get_state() == SurveyState.answering.state:
+        # Сообщение — ответ на вопрос, заданный до потери сессии
+        await handle_survey_response(message, state)
+        return
+    await message.answer("Продолжаем опрос с того места, где вы остановились.", parse_mode='HTML')
+    await ask_next_question(message, state, message.from_user)
+
+async def save_survey_results(message: Message, state: FSMContext, user: User):
+    data_state = await state.get_data()
+    user_id = user.id
+    version_id = data_state['version_id']
+    survey_id = get_survey_version(version_id)[0]
+    group_id = data_state.get('group_id')
+    submission_id = await submission_id_for(state, data_state, user)
+
+    # Ответы уже записаны по ходу опроса: остается дописать последнюю пачку
+    # и сменить статус черновика
+    await answer_writer.flush()
+    if not complete_submission(submission_id):
+        # Черновик уже завершен или удален по сроку хранения: повторно голоса
+        # и завершение не учитываются
+        logging.warning("Submission %s of user %s is no longer a draft", submission_id, user_id)
+        cancel_reminder(user_id, survey_id)
+        await state.clear()
+        await message.answer(SESSION_EXPIRED, parse_mode='HTML')
+        return
+    # Роль и регион из анкеты при вступлении раскладываются по колонкам для отборов
+    index_facets(submission_id)
+    # Голоса учитываются только по завершенным анкетам
+    record_choice_votes(version_id, group_id, data_state.get('choices', []))
+    record_completion(version_id, group_id)
+    cancel_reminder(user_id, survey_id)
+    schedule_live_refresh(message.bot, survey_id, group_id)
     await message.answer("Спасибо за ваши ответы! Ваши данные сохранены.", parse_mode='HTML')
 
     # Если капча включена, разблокируем пользователя
@@ -0,0 +1,116 @@
+import io
+import csv
+import json
+import asyncio
+from aiogram import Bot
+from aiogram.types import Document
+from choices import validate_question
+from db_manager import unit_of_work, insert_survey, publish_survey_version
+
+# Ограничения на загружаемый файл с описанием опросов
+IMPORT_MAX_FILE_SIZE = 1024 * 1024
+IMPORT_MAX_QUESTIONS = 200
+
+IMPORT_FORMAT_HINT = (
+    "JSON: {\"name\": \"Опрос\", \"questions\": [\"Текст\", "
+    "{\"text\": \"Вопрос\", \"type\": \"single\", \"options\": [\"Да\", \"Нет\"]}]} "
+    "или список таких объектов.\n"
+    "CSV: столбцы survey, question, type, options (варианты через «|», шкала — «1..5»)."
+)
+
+
+def parse_json_surveys(data: bytes):
+    try:
+        document = json.loads(data.decode('utf-8-sig'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Некорректный JSON: {e}")
+    entries = document if isinstance(document, list) else [document]
+    surveys = []
+    for number, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Опрос №{number}: ожидается объект с полями name и questions.")
+        questions = []
+        for position, question in enumerate(entry.get('questions') or [], start=1):
+            if isinstance(question, str):
+                question = {'text': question}
+            if not isinstance(question, dict):
+                raise ValueError(f"Опрос №{number}, вопрос {position}: ожидается строка или объект.")
+            try:
+                questions.append(validate_question(question.get('text'), question.get('type'), question.get('options')))
+            except ValueError as e:
+                raise ValueError(f"Опрос №{number}, вопрос {position}: {e}")
+        surveys.append((str(entry.get('name') or '').strip(), questions))
+    return surveys
+
+
+def parse_csv_surveys(data: bytes):
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("CSV-файл должен быть в кодировке UTF-8.")
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {'survey', 'question'} <= set(reader.fieldnames):
+        raise ValueError("В CSV нужны как минимум столбцы survey и question.")
+    surveys = {}
+    for row in reader:
+        line = reader.line_num
+        options = row.get('options') or ''
+        qtype = row.get('type') or ''
+        if qtype.strip().lower() != 'scale' or '|' in options:
+            options = options.split('|') if options else []
+        try:
+            question = validate_question(row.get('question'), qtype, options)
+        except ValueError as e:
+            raise ValueError(f"Строка {line}: {e}")
+        surveys.setdefault((row.get('survey') or '').strip(), []).append(question)
+    return list(surveys.items())
+
+
+def validate_surveys(surveys, existing_name):
+    names = set()
+    for name, questions in surveys:
+        if not name:
+            raise ValueError("У каждого опроса должно быть название.")
+        if name in names or existing_name(name):
+            raise ValueError(f"Опрос с названием '{name}' уже существует.")
+        if not questions:
+            raise ValueError(f"В опросе '{name}' нет вопросов.")
+        if len(questions) > IMPORT_MAX_QUESTIONS:
+            raise ValueError(f"В опросе '{name}' больше {IMPORT_MAX_QUESTIONS} вопросов.")
+        names.add(name)
+
+
+def parse_survey_file(filename: str, data: bytes):
+    filename = (filename or '').lower()
+    if filename.endswith('.json'):
+        return parse_json_surveys(data)
+    if filename.endswith('.csv'):
+        return parse_csv_surveys(data)
+    raise ValueError("Поддерживаются файлы .json и .csv.")
+
+
+def import_surveys(surveys):
+    # Все опросы файла создаются в одной транзакции: при ошибке не остается частично загруженных
+    with unit_of_work() as cursor:
+        def existing_name(name):
+            cursor.execute("SELECT 1 FROM surveys WHERE name = ?", (name,))
+            return cursor.fetchone() is not None
+        validate_surveys(surveys, existing_name)
+        survey_ids = [insert_survey(cursor, name, questions) for name, questions in surveys]
+    for survey_id in survey_ids:
+        publish_survey_version(survey_id)
+    return survey_ids
+
+
+async def import_document(bot: Bot, document: Document):
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        raise ValueError("Файл слишком большой.")
+    buffer = await bot.download(document)
+    # Размер в описании файла необязателен, поэтому ограничение проверяется и по содержимому
+    data = buffer.read(IMPORT_MAX_FILE_SIZE + 1)
+    if len(data) > IMPORT_MAX_FILE_SIZE:
+        raise ValueError("Файл слишком большой.")
+    surveys = parse_survey_file(document.file_name, data)
+    # Транзакция и публикация версий не должны задерживать остальные апдейты
+    await asyncio.to_thread(import_surveys, surveys)
+    return surveys
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Модули бота читают настройки при импорте
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:test')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ.setdefault('ENABLE_LOGGING', 'False')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
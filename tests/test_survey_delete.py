@@ -0,0 +1,63 @@
+import time
+import asyncio
+import datetime
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update, User
+import db_manager
+import survey
+
+GROUP_ID = -100123
+
+
+class RecordingSession(BaseSession):
+    # Вместо Bot API запоминает отправленные запросы
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if method.__returning__ is Message:
+            return Message(message_id=len(self.requests), date=datetime.datetime.now(),
+                           chat=Chat(id=method.chat_id, type='private'), text=getattr(method, 'text', None))
+        return True
+
+
+def start_update(user_id, text):
+    return Update.model_validate({'update_id': user_id, 'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Участник'},
+    }})
+
+
+def test_deleted_survey_cannot_be_started(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_manager.initialize_db()
+    db_manager.add_group(GROUP_ID, "Группа")
+    survey_id = db_manager.add_survey("Удаляемый")
+    db_manager.add_question(survey_id, "q1")
+    version_id = db_manager.get_latest_version_id(survey_id)
+    assert db_manager.get_survey_version(version_id)[2] == ("q1",)
+
+    db_manager.delete_survey_by_id(survey_id)
+
+    assert db_manager.get_latest_version_id(survey_id) is None
+    assert db_manager.get_survey_version(version_id) is None
+
+    session = RecordingSession()
+    bot = Bot(token='123456:test', session=session)
+    dispatcher = Dispatcher()
+    dispatcher.include_router(survey.router)
+    asyncio.run(dispatcher.feed_update(bot, start_update(42, f"/start survey_{survey_id}_{GROUP_ID}")))
+
+    replies = [request.text for request in session.requests if type(request).__name__ == 'SendMessage']
+    # Только ответ об ошибке, без первого вопроса опроса
+    assert len(replies) == 1 and "не найден" in replies[0]
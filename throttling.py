@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+import metrics
+
+# Лимиты задаются строкой вида "message:1:5,callback_query:2:8",
+# где для каждого типа апдейта указаны скорость (токенов в секунду) и емкость корзины
+DEFAULT_USER_LIMITS = "message:1:5,callback_query:2:8,default:2:10"
+DEFAULT_CHAT_LIMITS = "message:10:30,callback_query:10:30,default:20:60"
+
+# Вступления, выходы и смена прав не ограничиваются: отброшенное вступление
+# означает пользователя без приветствия и без капчи
+EXEMPT_UPDATE_TYPES = {'my_chat_member', 'chat_member', 'chat_join_request'}
+SERVICE_MESSAGE_FIELDS = ('new_chat_members', 'left_chat_member', 'migrate_to_chat_id', 'migrate_from_chat_id')
+THROTTLE_NOTICE = "Слишком много сообщений подряд. Подождите несколько секунд и отправьте ответ еще раз."
+THROTTLE_CALLBACK_NOTICE = "Слишком много нажатий подряд. Подождите несколько секунд и нажмите еще раз."
+
+
+def parse_limits(raw: str):
+    limits = {}
+    for item in raw.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        update_type, rate, capacity = item.split(':')
+        limits[update_type] = (float(rate), float(capacity))
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        # Через сколько секунд в корзине появится целый токен
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, user_limits=None, chat_limits=None, mode='drop', max_delay=2.0, max_buckets=10000,
+                 notice_interval=10.0):
+        self.user_limits = user_limits or parse_limits(DEFAULT_USER_LIMITS)
+        self.chat_limits = chat_limits or parse_limits(DEFAULT_CHAT_LIMITS)
+        self.mode = mode
+        self.max_delay = max_delay
+        self.max_buckets = max_buckets
+        self.notice_interval = notice_interval
+        self.buckets = OrderedDict()
+        # Когда пользователю последний раз сообщили об ограничении
+        self.notified = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            user_limits=parse_limits(os.getenv('THROTTLE_USER_LIMITS', DEFAULT_USER_LIMITS)),
+            chat_limits=parse_limits(os.getenv('THROTTLE_CHAT_LIMITS', DEFAULT_CHAT_LIMITS)),
+            mode=os.getenv('THROTTLE_MODE', 'drop').lower(),
+            max_delay=float(os.getenv('THROTTLE_MAX_DELAY', '2')),
+            max_buckets=int(os.getenv('THROTTLE_MAX_BUCKETS', '10000')),
+            notice_interval=float(os.getenv('THROTTLE_NOTICE_INTERVAL', '10')),
+        )
+
+    @staticmethod
+    def is_exempt(event: Update) -> bool:
+        if event.event_type in EXEMPT_UPDATE_TYPES:
+            return True
+        message = event.message
+        return message is not None and any(getattr(message, field) for field in SERVICE_MESSAGE_FIELDS)
+
+    def should_notify(self, user, now: float) -> bool:
+        # Уведомление об ограничении — не чаще раза в notice_interval секунд
+        last = self.notified.get(user.id)
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self.notified[user.id] = now
+        self.notified.move_to_end(user.id)
+        while len(self.notified) > self.max_buckets:
+            self.notified.popitem(last=False)
+        return True
+
+    async def notify(self, event: Update, user, now: float):
+        # Отброшенный ответ на вопрос анкеты или нажатие кнопки иначе выглядит
+        # как зависший опрос
+        if event.callback_query is not None:
+            # На нажатие нужно ответить в любом случае, иначе кнопка
+            # продолжает крутиться, пока Telegram не прервет ожидание
+            text = THROTTLE_CALLBACK_NOTICE if self.should_notify(user, now) else None
+            await event.callback_query.answer(text)
+        elif self.should_notify(user, now):
+            await event.message.answer(THROTTLE_NOTICE, parse_mode='HTML')
+
+    def get_bucket(self, key, limits, update_type, now):
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            self.buckets.move_to_end(key)
+            return bucket
+        rate, capacity = limits.get(update_type) or limits['default']
+        bucket = self.buckets[key] = TokenBucket(rate, capacity, now)
+        # Вытесняем давно не использовавшиеся корзины: к моменту вытеснения они
+        # как правило уже полностью восстановились, так что лимиты не теряются
+        while len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+            metrics.inc('throttle.evicted')
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        update_type = event.event_type
+        if self.is_exempt(event):
+            metrics.inc(f'throttle.exempt.{update_type}')
+            return await handler(event, data)
+        now = time.monotonic()
+        # Сообщения в личном чате (ответы на анкету) лучше задержать, чем потерять
+        private_message = update_type == 'message' and chat is not None and chat.type == 'private'
+        delay = self.mode == 'delay' or private_message
+
+        buckets = []
+        if user is not None:
+            buckets.append(self.get_bucket(('user', user.id, update_type), self.user_limits, update_type, now))
+        if chat is not None and (user is None or chat.id != user.id):
+            buckets.append(self.get_bucket(('chat', chat.id, update_type), self.chat_limits, update_type, now))
+        if not buckets:
+            return await handler(event, data)
+
+        wait = max(bucket.wait_time(now) for bucket in buckets)
+        if wait > 0 and (not delay or wait > self.max_delay):
+            metrics.inc(f'throttle.dropped.{update_type}')
+            logging.debug(
+                "Throttled %s from user %s in chat %s",
+                update_type, user.id if user else None, chat.id if chat else None,
+            )
+            if user is not None and (private_message or update_type == 'callback_query'):
+                await self.notify(event, user, now)
+            return None
+
+        # Токен резервируется сразу, чтобы параллельные апдейты во время
+        # ожидания не проскочили лимит
+        for bucket in buckets:
+            bucket.consume()
+        if wait > 0:
+            metrics.inc(f'throttle.delayed.{update_type}')
+            await asyncio.sleep(wait)
+        else:
+            metrics.inc(f'throttle.allowed.{update_type}')
+        return await handler(event, data)